@@ -0,0 +1,138 @@
+import time
+import asyncio
+
+from model_calls import ModelCallError
+from streaming import QuoteStripper, strip_quotes
+
+
+class AsyncLumoraAssistant:
+    """
+    asyncio front end to a LumoraAssistant, for serving many patients from one event loop.
+
+    Model calls use the client's async API, and prompt building and memory
+    I/O run in worker threads, so the loop keeps serving other patients
+    while one waits. Turns of the same patient run one at a time, in the
+    order they arrive. An optional ``limiter`` (an asyncio.Semaphore shared
+    by all patients) caps concurrent outbound model requests. Calls go
+    through the assistant's ``chat_calls`` policy, falling back to a local
+    reply when it gives up. ``cleanup``, if given, is called in the worker
+    thread after each piece of work, e.g. to close stale database connections.
+    """
+
+    def __init__(self, assistant, limiter=None, cleanup=None):
+        self.assistant = assistant
+        self.limiter = limiter
+        self.cleanup = cleanup
+        self._turn_lock = asyncio.Lock()
+
+    def _clean_call(self, func, *args):
+        try:
+            return func(*args)
+        finally:
+            if self.cleanup is not None:
+                self.cleanup()
+
+    async def _in_thread(self, func, *args):
+        """Run ``func(*args)`` in a worker thread, then clean up after it there"""
+        return await asyncio.to_thread(self._clean_call, func, *args)
+
+    async def _model_call(self, prompt, stream=False):
+        calls = self.assistant.chat_calls
+        if self.limiter is None:
+            return await calls.call_async(self.assistant._chat_attempt_async, prompt, stream)
+        async with self.limiter:
+            return await calls.call_async(self.assistant._chat_attempt_async, prompt, stream)
+
+    async def _build_prompt(self, trace, message):
+        with trace.span("prompt_build") as span:
+            prompt = await self._in_thread(self.assistant.prompts.build, message)
+            span.set(estimated_tokens=self.assistant.prompts.last_turn.get("total", 0))
+        return prompt
+
+    async def send_message(self, message):
+        """Send a message to Lumora and return the reply"""
+        async with self._turn_lock:
+            started = time.perf_counter()
+            # spans here are opened across awaits, so the trace is never a thread's current one
+            with self.assistant.tracer.trace("turn") as trace:
+                try:
+                    cached = await self._in_thread(self.assistant.cached_reply, message)
+                    if cached is not None:
+                        trace.set(cached=True)
+                        return cached
+                    prompt = await self._build_prompt(trace, message)
+                    with trace.span("chat_call") as span:
+                        chat, response = await self._model_call(prompt)
+                        response_text = strip_quotes(response.text)
+                        span.set(**self.assistant._call_payload(prompt, response, response_text))
+                    self.assistant.chat = chat
+                except ModelCallError:
+                    return await self._in_thread(self.assistant.fallback_reply, message)
+                except Exception as e:
+                    return f"I'm having a little trouble understanding right now. Could you please repeat that? (Error: {str(e)})"
+
+                elapsed = time.perf_counter() - started
+                self.assistant.last_latency = {"first_token": elapsed, "total": elapsed}
+                await self._in_thread(self.assistant.record_turn, message, response, response_text, trace)
+                return response_text
+
+    async def send_message_stream(self, message):
+        """Send a message to Lumora and yield the reply in chunks as they arrive"""
+        async with self._turn_lock:
+            started = time.perf_counter()
+            first_token = None
+            parts = []
+            with self.assistant.tracer.trace("turn", stream=True) as trace:
+                try:
+                    cached = await self._in_thread(self.assistant.cached_reply, message)
+                    if cached is not None:
+                        trace.set(cached=True)
+                        yield cached
+                        return
+                    prompt = await self._build_prompt(trace, message)
+                    with trace.span("chat_call") as span:
+                        # the concurrency cap covers the request, not the time the
+                        # patient spends reading the streamed reply; reading it is
+                        # bounded by the call policy's stream deadline
+                        chat, response = await self._model_call(prompt, stream=True)
+
+                        stripper = QuoteStripper()
+                        async for chunk in self.assistant.chat_calls.read_async(response):
+                            text = stripper.feed(chunk.text)
+                            if text:
+                                if first_token is None:
+                                    first_token = time.perf_counter() - started
+                                parts.append(text)
+                                yield text
+                        tail = stripper.finish()
+                        if tail:
+                            parts.append(tail)
+                            yield tail
+                        span.set(**self.assistant._call_payload(prompt, response, "".join(parts)))
+                except ModelCallError:
+                    if parts:
+                        await self._in_thread(self.assistant.update_memory, message, "".join(parts))
+                    else:
+                        yield await self._in_thread(self.assistant.fallback_reply, message)
+                    return
+                except Exception as e:
+                    yield f"I'm having a little trouble understanding right now. Could you please repeat that? (Error: {str(e)})"
+                    return
+
+                self.assistant.chat = chat
+                total = time.perf_counter() - started
+                self.assistant.last_latency = {
+                    "first_token": first_token if first_token is not None else total,
+                    "total": total,
+                }
+                await self._in_thread(self.assistant.record_turn, message, response, "".join(parts), trace)
+
+    async def end_session(self):
+        """Extract whatever is still buffered for this patient"""
+        async with self._turn_lock:
+            await self._in_thread(self.assistant.end_session)
+
+    async def close(self):
+        """Finish pending work and release the patient's memory files"""
+        async with self._turn_lock:
+            await self._in_thread(self.assistant.close)
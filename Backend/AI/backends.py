@@ -0,0 +1,338 @@
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+
+
+class ModelBackend(ABC):
+    """
+    What LumoraAssistant needs from a language model.
+
+    ``start_chat`` returns a chat session, seeded with ``history`` if given,
+    with ``send_message(prompt, stream=False)``, its async twin
+    ``send_message_async`` and a settable ``history`` list. ``generate`` is a one-off call used for memory
+    extraction. Responses have a ``text`` attribute; streamed responses can
+    also be iterated (or async-iterated) for chunks with a ``text`` attribute.
+    ``upstream`` names the service behind the backend; every assistant
+    calling the same upstream shares one call policy and circuit breaker.
+    A backend missing either method can't be instantiated.
+    """
+
+    upstream = "model"
+
+    @abstractmethod
+    def start_chat(self, system_instruction=None, history=None):
+        """A chat session, seeded with ``history``"""
+
+    @abstractmethod
+    def generate(self, prompt, json_output=False):
+        """One response to ``prompt``, JSON text if ``json_output``"""
+
+    async def generate_async(self, prompt, json_output=False):
+        return await asyncio.to_thread(self.generate, prompt, json_output)
+
+
+class GeminiBackend(ModelBackend):
+    """Google Gemini through google.generativeai"""
+
+    def __init__(self, model_name="gemini-1.5-pro", api_key=None):
+        import google.generativeai as genai
+
+        self.genai = genai
+        self.model_name = model_name
+        self.upstream = f"gemini/{model_name}"
+        if api_key:
+            genai.configure(api_key=api_key)
+        self._models = {}
+
+    def _model(self, system_instruction=None, json_output=False):
+        key = (system_instruction, json_output)
+        if key not in self._models:
+            self._models[key] = self.genai.GenerativeModel(
+                self.model_name,
+                system_instruction=system_instruction,
+                generation_config={"response_mime_type": "application/json"} if json_output else None,
+            )
+        return self._models[key]
+
+    def start_chat(self, system_instruction=None, history=None):
+        return self._model(system_instruction).start_chat(history=history)
+
+    def generate(self, prompt, json_output=False):
+        return self._model(json_output=json_output).generate_content(prompt)
+
+    async def generate_async(self, prompt, json_output=False):
+        return await self._model(json_output=json_output).generate_content_async(prompt)
+
+
+# ---------------------------------------------------------------------------
+# Local stand-in
+
+
+class SimulatedChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class SimulatedUsage:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+
+
+class SimulatedResponse:
+    """A reply that can be read whole or streamed, with simulated per-chunk latency"""
+
+    def __init__(self, text, chunk_chars=20, chunk_latency=0.0, prompt_tokens=0):
+        self.text = text
+        self.chunk_chars = chunk_chars
+        self.chunk_latency = chunk_latency
+        self.usage_metadata = SimulatedUsage(prompt_tokens, len(text) // 4)
+
+    def _chunks(self):
+        return [self.text[i:i + self.chunk_chars] for i in range(0, len(self.text), self.chunk_chars)]
+
+    def __iter__(self):
+        for chunk in self._chunks():
+            if self.chunk_latency:
+                time.sleep(self.chunk_latency)
+            yield SimulatedChunk(chunk)
+
+    async def __aiter__(self):
+        for chunk in self._chunks():
+            if self.chunk_latency:
+                await asyncio.sleep(self.chunk_latency)
+            yield SimulatedChunk(chunk)
+
+
+class SimulatedChat:
+    def __init__(self, backend, system_instruction=None, history=None):
+        self.backend = backend
+        self.system_instruction = system_instruction
+        self.history = list(history or [])
+
+    def _reply(self, prompt):
+        sent = sum(len(part) for part in self.history) + len(prompt) + len(self.system_instruction or "")
+        text = self.backend.reply_text(prompt)
+        self.history = self.history + [prompt, text]
+        return self.backend.response(text, prompt_tokens=sent // 4)
+
+    def send_message(self, prompt, stream=False):
+        self.backend.wait()
+        return self._reply(prompt)
+
+    async def send_message_async(self, prompt, stream=False):
+        await self.backend.wait_async()
+        return self._reply(prompt)
+
+
+WORDS = (
+    "dear lovely remember garden family sunshine tea morning walk story daughter "
+    "flowers music photo smile today warm gentle together friend home"
+).split()
+
+
+class SimulatedBackend(ModelBackend):
+    """
+    Deterministic local model for benchmarks and offline runs.
+
+    Replies are ``response_chars`` long, built from the prompt's hash, and
+    every call waits ``latency`` seconds (plus up to ``jitter``) before
+    answering; streamed replies then wait ``chunk_latency`` per chunk. A
+    ``slow_rate`` fraction of calls take ``slow_latency`` seconds instead and
+    a ``failure_rate`` fraction raise, to exercise timeouts and retries.
+    Extraction calls get a well-formed JSON array with one entry per exchange.
+    Give separate runs their own ``upstream`` to keep their call stats apart.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, response_chars=200, chunk_chars=20,
+                 chunk_latency=0.0, seed=0, slow_rate=0.0, slow_latency=0.0, failure_rate=0.0,
+                 upstream="simulated"):
+        self.upstream = upstream
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.failure_rate = failure_rate
+        self.response_chars = response_chars
+        self.chunk_chars = chunk_chars
+        self.chunk_latency = chunk_latency
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _delay(self):
+        with self._lock:
+            self.calls += 1
+            failed = self.failure_rate and self._random.random() < self.failure_rate
+            if self.slow_rate and self._random.random() < self.slow_rate:
+                return self.slow_latency, failed
+            return self.latency + (self._random.random() * self.jitter if self.jitter else 0.0), failed
+
+    def wait(self):
+        delay, failed = self._delay()
+        if delay:
+            time.sleep(delay)
+        if failed:
+            raise RuntimeError("Simulated model failure")
+
+    async def wait_async(self):
+        delay, failed = self._delay()
+        if delay:
+            await asyncio.sleep(delay)
+        if failed:
+            raise RuntimeError("Simulated model failure")
+
+    def reply_text(self, prompt):
+        rng = random.Random(hashlib.sha1(prompt.encode()).hexdigest())
+        words = []
+        length = 0
+        while length < self.response_chars:
+            word = rng.choice(WORDS)
+            words.append(word)
+            length += len(word) + 1
+        return (" ".join(words)[:self.response_chars].rstrip() + ".").capitalize()
+
+    def response(self, text, prompt_tokens=0):
+        return SimulatedResponse(text, self.chunk_chars, self.chunk_latency, prompt_tokens)
+
+    def start_chat(self, system_instruction=None, history=None):
+        return SimulatedChat(self, system_instruction, history)
+
+    def _extraction_text(self, prompt):
+        exchanges = max(1, prompt.count("\nPatient: "))
+        rng = random.Random(hashlib.sha1(prompt.encode()).hexdigest())
+        return json.dumps([
+            {
+                "personal_info": {},
+                "memories": [f"Talked about the {rng.choice(WORDS)}"] if rng.random() < 0.3 else [],
+                "preferences": {"likes": rng.choice(WORDS)} if rng.random() < 0.2 else {},
+                "topics": [rng.choice(WORDS)],
+                "emotional_state": rng.choice(["calm", "happy", "confused", "sad"]),
+            }
+            for _ in range(exchanges)
+        ])
+
+    def generate(self, prompt, json_output=False):
+        self.wait()
+        text = self._extraction_text(prompt) if json_output else self.reply_text(prompt)
+        return self.response(text, prompt_tokens=len(prompt) // 4)
+
+    async def generate_async(self, prompt, json_output=False):
+        await self.wait_async()
+        text = self._extraction_text(prompt) if json_output else self.reply_text(prompt)
+        return self.response(text, prompt_tokens=len(prompt) // 4)
+
+
+# ---------------------------------------------------------------------------
+# Record / replay
+
+
+class RecordingBackend(ModelBackend):
+    """Passes calls through to ``backend`` and appends every prompt and reply to a transcript file"""
+
+    def __init__(self, backend, transcript_file):
+        self.backend = backend
+        self.upstream = backend.upstream
+        self.transcript_file = transcript_file
+        self._lock = threading.Lock()
+
+    def record(self, kind, prompt, text):
+        with self._lock, open(self.transcript_file, 'a') as f:
+            f.write(json.dumps({"kind": kind, "prompt": prompt, "text": text}) + "\n")
+
+    def start_chat(self, system_instruction=None, history=None):
+        return RecordingChat(self, self.backend.start_chat(system_instruction, history))
+
+    def generate(self, prompt, json_output=False):
+        response = self.backend.generate(prompt, json_output)
+        self.record("generate", prompt, response.text)
+        return response
+
+    async def generate_async(self, prompt, json_output=False):
+        response = await self.backend.generate_async(prompt, json_output)
+        self.record("generate", prompt, response.text)
+        return response
+
+
+class RecordingChat:
+    def __init__(self, recorder, chat):
+        self.recorder = recorder
+        self.chat = chat
+
+    @property
+    def history(self):
+        return self.chat.history
+
+    @history.setter
+    def history(self, value):
+        self.chat.history = value
+
+    def send_message(self, prompt, stream=False):
+        response = self.chat.send_message(prompt, stream=stream)
+        if stream:
+            # the full text is only known once the stream has been read
+            chunks = [chunk.text for chunk in response]
+            text = "".join(chunks)
+            self.recorder.record("chat", prompt, text)
+            return SimulatedResponse(text)
+        self.recorder.record("chat", prompt, response.text)
+        return response
+
+    async def send_message_async(self, prompt, stream=False):
+        response = await self.chat.send_message_async(prompt, stream=stream)
+        if stream:
+            chunks = [chunk.text async for chunk in response]
+            text = "".join(chunks)
+            self.recorder.record("chat", prompt, text)
+            return SimulatedResponse(text)
+        self.recorder.record("chat", prompt, response.text)
+        return response
+
+
+class ReplayBackend(SimulatedBackend):
+    """
+    Answers from a transcript written by RecordingBackend.
+
+    A prompt seen in the transcript gets its recorded reply; any other
+    prompt gets the next unused recorded reply of the same kind, so a replay
+    still works when prompts drift slightly (e.g. timestamps). Latency
+    settings work as in SimulatedBackend.
+    """
+
+    def __init__(self, transcript_file, **kwargs):
+        super().__init__(**kwargs)
+        self._by_prompt = {}
+        self._in_order = {"chat": deque(), "generate": deque()}
+        with open(transcript_file, 'r') as f:
+            for line in f:
+                record = json.loads(line)
+                self._by_prompt.setdefault((record["kind"], record["prompt"]), deque()).append(record["text"])
+                self._in_order[record["kind"]].append(record["text"])
+
+    def _recorded(self, kind, prompt):
+        with self._lock:
+            answers = self._by_prompt.get((kind, prompt))
+            if answers:
+                return answers[0] if len(answers) == 1 else answers.popleft()
+            queue = self._in_order[kind]
+            if not queue:
+                raise LookupError(f"Transcript has no more {kind} replies")
+            text = queue.popleft()
+            queue.append(text)
+            return text
+
+    def reply_text(self, prompt):
+        return self._recorded("chat", prompt)
+
+    def generate(self, prompt, json_output=False):
+        self.wait()
+        return self.response(self._recorded("generate", prompt), prompt_tokens=len(prompt) // 4)
+
+    async def generate_async(self, prompt, json_output=False):
+        await self.wait_async()
+        return self.response(self._recorded("generate", prompt), prompt_tokens=len(prompt) // 4)
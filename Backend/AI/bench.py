@@ -0,0 +1,222 @@
+"""
+Offline benchmarks for the Lumora chat turn pipeline.
+
+Runs against SimulatedBackend (or a recorded transcript with --replay), so no
+API key or network is needed:
+
+    python bench.py turns --sizes 10 1000 100000 --latency 0.2
+    python bench.py turns --sizes 100 --latency 0.2 --slow-rate 0.05 --slow-latency 30
+    python bench.py concurrent --sessions 200 --turns 5 --latency 0.5
+    python bench.py startup --runs 5
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+import datetime
+import tempfile
+import statistics
+
+from backends import SimulatedBackend, ReplayBackend
+from memory_store import empty_memory
+
+
+MESSAGES = [
+    "hi",
+    "My daughter Sarah came to visit me today",
+    "I used to work at the bakery on Main Street",
+    "What did I do yesterday?",
+    "I love the roses in the garden",
+    "how are you?",
+    "Do you remember my husband John?",
+    "I feel a bit lonely this afternoon",
+]
+
+
+def make_memory_file(path, turns, now=None):
+    """Write a memory snapshot with ``turns`` past exchanges, one every ten minutes up to now"""
+    now = now or datetime.datetime.now()
+    memory = empty_memory()
+    memory["personal_info"] = {"name": "Margaret", "daughter": "Sarah", "husband": "John"}
+    memory["preferences"] = {"flowers": "roses", "drink": "tea"}
+    memory["important_memories"] = [f"Memory number {i} about the garden" for i in range(min(turns, 200))]
+    memory["conversation_history"] = [
+        {
+            "timestamp": (now - datetime.timedelta(minutes=10 * (turns - i))).strftime("%Y-%m-%d %H:%M:%S"),
+            "patient": MESSAGES[i % len(MESSAGES)],
+            "lumora": "That sounds lovely, tell me more.",
+        }
+        for i in range(turns)
+    ]
+    with open(path, 'w') as f:
+        json.dump(memory, f)
+
+
+def summarize(samples):
+    """mean / p50 / p95 / max of a list of seconds, in milliseconds"""
+    if not samples:
+        return "-"
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return (f"mean {1000 * statistics.mean(ordered):8.2f}  p50 {1000 * statistics.median(ordered):8.2f}  "
+            f"p95 {1000 * p95:8.2f}  max {1000 * ordered[-1]:8.2f} ms")
+
+
+def make_backend(args, upstream="simulated"):
+    # model calls to one upstream share their stats and breaker, so each run gets its own
+    options = dict(latency=args.latency, jitter=args.jitter, response_chars=args.response_chars,
+                   slow_rate=args.slow_rate, slow_latency=args.slow_latency, failure_rate=args.failure_rate,
+                   upstream=upstream)
+    if args.replay:
+        return ReplayBackend(args.replay, **options)
+    return SimulatedBackend(**options)
+
+
+def bench_turns(args):
+    from chat import LumoraAssistant
+
+    for size in args.sizes:
+        directory = tempfile.mkdtemp(prefix="lumora-bench-")
+        memory_file = os.path.join(directory, "patient_memory.json")
+        make_memory_file(memory_file, size)
+
+        started = time.perf_counter()
+        lumora = LumoraAssistant(memory_file=memory_file, backend=make_backend(args, f"simulated-{size}"))
+        load = time.perf_counter() - started
+
+        phases = {"prompt_build": [], "chat_call": [], "persist": [], "turn": []}
+        prompt_tokens = []
+        for i in range(args.turns):
+            started = time.perf_counter()
+            lumora.send_message(MESSAGES[i % len(MESSAGES)])
+            phases["turn"].append(time.perf_counter() - started)
+            for phase in ("prompt_build", "chat_call", "persist"):
+                phases[phase].append(lumora.last_timings.get(phase, 0.0))
+            prompt_tokens.append(lumora.prompts.last_turn.get("total", 0))
+
+        started = time.perf_counter()
+        lumora.end_session()
+        flush = time.perf_counter() - started
+        stats = lumora.extraction.stats
+        calls = lumora.chat_calls
+        cache = lumora.responses
+        lumora.close()
+
+        print(f"\n== {size} stored turns ({args.turns} turns, model latency {args.latency}s)")
+        print(f"  load          {1000 * load:10.2f} ms")
+        for phase, samples in phases.items():
+            print(f"  {phase:<13} {summarize(samples)}")
+        extraction_calls = max(stats["batches"], 1)
+        print(f"  extraction    {stats['batches']} calls for {stats['extracted']} exchanges, "
+              f"{1000 * stats['extract_seconds'] / extraction_calls:.2f} ms/call, "
+              f"max lag {stats['max_lag']:.2f} s, final flush {1000 * flush:.2f} ms")
+        print(f"  prompt tokens mean {statistics.mean(prompt_tokens):.0f} (local estimate)")
+        latency = calls.histogram.snapshot()
+        print(f"  chat calls    p50 <= {latency['p50']}s  p95 <= {latency['p95']}s  p99 <= {latency['p99']}s  "
+              f"timeouts {calls.stats['timeouts']}  errors {calls.stats['errors']}  retries {calls.stats['retries']}  "
+              f"hedges {calls.stats['hedges']}  rejected {calls.stats['rejected']}  fallbacks {lumora.fallbacks}")
+        print(f"  reply cache   hit rate {100 * cache.hit_rate:.0f}% ({cache.stats['hits']} hits, "
+              f"{cache.stats['near_hits']} near, {cache.stats['misses']} misses, {cache.stats['expired']} expired)")
+
+
+async def _run_sessions(args):
+    from chat import LumoraAssistant
+    from async_chat import AsyncLumoraAssistant
+
+    directory = tempfile.mkdtemp(prefix="lumora-bench-")
+    backend = make_backend(args)
+    limiter = asyncio.Semaphore(args.max_model_calls) if args.max_model_calls else None
+
+    sessions = []
+    for i in range(args.sessions):
+        memory_file = os.path.join(directory, f"patient_{i}.json")
+        make_memory_file(memory_file, args.history)
+        assistant = await asyncio.to_thread(LumoraAssistant, memory_file=memory_file, backend=backend)
+        sessions.append(AsyncLumoraAssistant(assistant, limiter=limiter))
+
+    latencies = []
+
+    async def converse(index, session):
+        for turn in range(args.turns):
+            started = time.perf_counter()
+            await session.send_message(MESSAGES[(index + turn) % len(MESSAGES)])
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(converse(i, session) for i, session in enumerate(sessions)))
+    elapsed = time.perf_counter() - started
+
+    await asyncio.gather(*(session.close() for session in sessions))
+    return elapsed, latencies
+
+
+def bench_concurrent(args):
+    elapsed, latencies = asyncio.run(_run_sessions(args))
+    total = args.sessions * args.turns
+    print(f"\n== {args.sessions} concurrent sessions x {args.turns} turns "
+          f"(model latency {args.latency}s, cap {args.max_model_calls or 'none'})")
+    print(f"  throughput    {total / elapsed:10.1f} turns/s ({total} turns in {elapsed:.2f} s)")
+    print(f"  turn latency  {summarize(latencies)}")
+
+
+def bench_startup(args):
+    """Time-to-prompt of the CLI, measured in fresh processes with the simulated model"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    phases = {}
+    for _ in range(args.runs):
+        directory = tempfile.mkdtemp(prefix="lumora-bench-")
+        make_memory_file(os.path.join(directory, "patient_memory.json"), args.history)
+        started = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, script, "--simulated", "--profile-startup"],
+            input="exit\n", capture_output=True, text=True, cwd=directory, check=True,
+        ).stdout
+        phases.setdefault("process total", []).append(time.perf_counter() - started)
+        for line in output.splitlines():
+            name, _, value = line.strip().rpartition(" ")
+            if value == "ms" and name:
+                name, _, ms = name.rpartition(" ")
+                phases.setdefault(name.strip(), []).append(float(ms) / 1000)
+
+    print(f"\n== CLI startup ({args.runs} runs, {args.history} stored turns)")
+    for name, samples in phases.items():
+        print(f"  {name:<16} {summarize(samples)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated model latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency, up to this many seconds")
+    parser.add_argument("--response-chars", type=int, default=200, help="length of simulated replies")
+    parser.add_argument("--replay", help="answer from a transcript written by RecordingBackend")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of model calls that stall")
+    parser.add_argument("--slow-latency", type=float, default=30.0, help="latency of a stalled call in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of model calls that fail")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    turns = commands.add_parser("turns", help="per-turn latency breakdown by memory size")
+    turns.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000])
+    turns.add_argument("--turns", type=int, default=50)
+    turns.set_defaults(run=bench_turns)
+
+    concurrent = commands.add_parser("concurrent", help="throughput of concurrent async sessions")
+    concurrent.add_argument("--sessions", type=int, default=100)
+    concurrent.add_argument("--turns", type=int, default=5)
+    concurrent.add_argument("--history", type=int, default=100, help="stored turns per patient")
+    concurrent.add_argument("--max-model-calls", type=int, default=None)
+    concurrent.set_defaults(run=bench_concurrent)
+
+    startup = commands.add_parser("startup", help="CLI time-to-prompt")
+    startup.add_argument("--runs", type=int, default=5)
+    startup.add_argument("--history", type=int, default=1000, help="stored turns in the memory file")
+    startup.set_defaults(run=bench_startup)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,94 @@
 import os
-import json
+import time
 import datetime
-import google.generativeai as genai
 from dotenv import load_dotenv
+from backends import GeminiBackend
+from model_calls import ModelCallError, shared_caller
+from memory_store import MemoryStore, empty_memory
+from extraction import ExtractionPipeline, MemoryExtractor
+from prefilter import ExtractionGate
+from retention import HistoryArchive, HistoryRetention
+from retrieval import MemoryIndex
+from time_index import TimeIndex, resolve_time_window
+from prompts import PromptBuilder
+from response_cache import ResponseCache
+from mood import MoodLog
+from topics import normalize
+from streaming import QuoteStripper, strip_quotes
+from tracing import NULL_SPAN, TRACER
+
+# Said when the model can't answer in time, so the patient is never left waiting
+FALLBACK_REPLIES = [
+    "I'm right here with you{name}. Could you tell me that again in a moment?",
+    "I'm listening{name}. Give me a moment, and tell me a little more?",
+    "That's nice to hear{name}. Would you say a bit more about it?",
+]
 
 class LumoraAssistant:
-    def __init__(self, memory_file="patient_memory.json"):
-        # Load environment variables
-        load_dotenv()
-        
-        # Get API key from environment variables
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY not found in .env file")
+    def __init__(self, memory_file="patient_memory.json", backend=None, store=None, archive=None, moods=None,
+                 tracer=None, persist_index=True, thread_cleanup=None):
+        if backend is None:
+            # Load environment variables
+            load_dotenv()
+
+            # Get API key from environment variables
+            api_key = os.getenv("GEMINI_API_KEY")
+            if not api_key:
+                raise ValueError("GEMINI_API_KEY not found in .env file")
+            backend = GeminiBackend("gemini-1.5-pro", api_key=api_key)
+        self.backend = backend
         
-        # Memory file path
+        # Memory file path; with a store and archive passed in (e.g. the
+        # database ones) it only names the local search index, and not even
+        # that without persist_index: the index is then rebuilt from memory
+        # in this process, as it must be when other processes share the memory
         self.memory_file = memory_file
+        self.store = store
         
         # Load existing memory or create new
         self.patient_memory = self._load_memory()
+
+        # Keep only recent turns inline; older ones are summarized and archived
+        if archive is None:
+            archive = HistoryArchive(os.path.splitext(memory_file)[0] + "_archive")
+        self.retention = HistoryRetention(self.store, archive)
+        self.retention.enforce()
+        self.time_index = TimeIndex(self.store, self.retention.archive)
+
+        # the emotional state extracted from each exchange, as a mood time series
+        if moods is None:
+            moods = MoodLog(os.path.splitext(memory_file)[0] + "_moods.csv")
+        self.moods = moods
+
+        # Only the memories relevant to each message go into its prompt
+        self.index = MemoryIndex(memory_file + ".index" if persist_index else None)
+        if not self.index.docs:
+            self._index_memory()
+        self.prompts = PromptBuilder(self.store, self.index, self.time_index)
+
+        # Exchanges kept in the live chat session; older ones are dropped so
+        # the history re-sent with every message stays bounded
+        self.max_chat_turns = 10
+
+        # seconds to the first shown text and to the complete reply, last turn
+        self.last_latency = {}
+        # seconds spent in each phase of the last turn
+        self.last_timings = {}
+        # every turn and extraction batch is timed span by span (see tracing.py)
+        self.tracer = tracer or TRACER
+
+        # model calls get a deadline, retries and a circuit breaker; a chat
+        # call still running after a few seconds is hedged with a second one,
+        # and a streamed reply has a minute to arrive in full.
+        # Every assistant on the same upstream shares these.
+        self.chat_calls = shared_caller("chat", backend.upstream, timeout=15.0, retries=1, hedge_after=5.0,
+                                        stream_timeout=60.0)
+        self.extraction_calls = shared_caller("extraction", backend.upstream, timeout=60.0, retries=2)
+        self.fallbacks = 0
+
+        # repeated questions are answered from earlier replies until a fact
+        # the reply could depend on changes
+        self.responses = ResponseCache()
         
         # Define Lumora's personality and context
         self.system_prompt = """
@@ -40,194 +110,294 @@ class LumoraAssistant:
         Always adapt your responses based on their current emotional state and needs.
         """
         
-        # initialize model and chat session
-        self.model = genai.GenerativeModel("gemini-1.5-pro")
+        # initialize chat session; the persona is sent once as the system
+        # instruction instead of with every message
         self.start_new_chat()
 
+        # memory extraction happens in batches on a background thread, and
+        # small talk is filtered out locally before it costs a model call;
+        # thread_cleanup runs on that thread after each batch, e.g. to close
+        # the database connections a database store opened there
+        self.extraction = ExtractionPipeline(MemoryExtractor(self.backend, self.extraction_calls),
+                                             self._apply_extraction, tracer=self.tracer,
+                                             cleanup=thread_cleanup)
+        self.extraction_gate = ExtractionGate()
+
     
     def _load_memory(self):
-        """Load patient memory from file or create new if not exists"""
-        try:
-            with open(self.memory_file, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            # return empty memory structure if file doesn't exist or is invalid
-            return {
-                "personal_info": {},
-                "important_memories": [],
-                "preferences": {},
-                "conversation_history": [],
-                "topics_discussed": {}
-            }
+        """Open the journaled memory store (unless one was given) and return the current patient memory"""
+        if self.store is None:
+            self.store = MemoryStore(self.memory_file)
+        return self.store.state
     
     def _save_memory(self):
-        """Save patient memory to file"""
-        with open(self.memory_file, 'w') as f:
-            json.dump(self.patient_memory, f, indent=4)
+        """Flush journaled memory changes to disk (compaction runs in the background)"""
+        self.store.flush()
     
     def start_new_chat(self):
         """Start a new chat session with Lumora's personality"""
-        self.chat = self.model.start_chat()
+        if hasattr(self, "extraction"):
+            # the previous session ends here, so get its memories in first
+            self.end_session()
 
-        system_message = f"{self.system_prompt}\n\nPlease follow these guidelines strictly."
-        self.chat.send_message(system_message)
+        self.chat = self.backend.start_chat(self.system_prompt)
 
-        history = []
-        #system_instruction=self.system_prompt
-        
-        # Add memory context if available
-        if self.patient_memory["personal_info"] or self.patient_memory["important_memories"]:
-            memory_context = "Patient memory context:\n"
-            
-            if self.patient_memory["personal_info"]:
-                memory_context += "Personal information:\n"
-                for key, value in self.patient_memory["personal_info"].items():
-                    memory_context += f"- {key}: {value}\n"
-            
-            if self.patient_memory["important_memories"]:
-                memory_context += "\nImportant memories shared:\n"
-                for memory in self.patient_memory["important_memories"]:
-                    memory_context += f"- {memory}\n"
-                    
-            if self.patient_memory["preferences"]:
-                memory_context += "\nPreferences:\n"
-                for key, value in self.patient_memory["preferences"].items():
-                    memory_context += f"- {key}: {value}\n"
-            
-            # Add memory context to system prompt
-            history.append({
-                "role": "system",
-                "parts": [memory_context]
-            })
-        
-    
-    def update_memory(self, user_message, response):
-        """Update patient memory based on conversation"""
+    def _chat_attempt(self, prompt, stream=False):
+        """One model call on a copy of the chat session, so retried or hedged calls never share a history"""
+        chat = self.backend.start_chat(self.system_prompt, history=list(self.chat.history))
+        return chat, chat.send_message(prompt, stream=stream)
+
+    async def _chat_attempt_async(self, prompt, stream=False):
+        chat = self.backend.start_chat(self.system_prompt, history=list(self.chat.history))
+        return chat, await chat.send_message_async(prompt, stream=stream)
+
+    def fallback_reply(self, message):
+        """Local reply for when the model is down or too slow; the turn is still remembered"""
+        self.fallbacks += 1
+        name = self.patient_memory["personal_info"].get("name")
+        reply = FALLBACK_REPLIES[self.fallbacks % len(FALLBACK_REPLIES)].format(name=f", {name}" if name else "")
+        self.update_memory(message, reply)
+        return reply
+
+    def _index_memory(self):
+        """Index everything already in patient memory (first run with an existing memory file)"""
+        with self.store.lock:
+            for key, value in self.patient_memory["personal_info"].items():
+                self._index_fact("personal_info", key, value)
+            for key, value in self.patient_memory["preferences"].items():
+                self._index_fact("preferences", key, value)
+            for memory in self.patient_memory["important_memories"]:
+                self._index_fact("memory", None, memory)
+            for turn in self.patient_memory["conversation_history"]:
+                self._index_turn(turn)
+
+    def _index_fact(self, kind, key, value):
+        if kind == "memory":
+            self.index.add(f"memory:{value}", str(value), kind)
+        elif kind == "preferences":
+            self.index.add(f"preferences:{key}", f"Preference - {key}: {value}", kind)
+        else:
+            self.index.add(f"{kind}:{key}", f"{key}: {value}", kind)
+
+    def _index_turn(self, turn):
+        self.index.add(
+            f"turn:{turn['timestamp']}",
+            f"On {turn['timestamp']} the patient said: {turn['patient']}",
+            "turn"
+        )
+
+    def update_memory(self, user_message, response, extract=True):
+        """Record the exchange and queue it for background memory extraction"""
         # Add to conversation history
         timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.patient_memory["conversation_history"].append({
+        turn = {
             "timestamp": timestamp,
             "patient": user_message,
             "lumora": response
-        })
-        
-        # Ask Gemini to extract important information from this exchange
-        try:
-            extraction_prompt = f"""
-            Based on this conversation exchange with a patient with dementia, extract any important information to remember:
-            
-            Patient: {user_message}
-            Lumora: {response}
-            
-            Extract and categorize the following (respond in JSON format only):
-            1. Personal information (name, family members, occupation, etc.)
-            2. Important memories or stories shared
-            3. Preferences mentioned (likes/dislikes)
-            4. Topics discussed
-            5. Emotional state
-            
-            JSON format:
-            {{
-                "personal_info": {{}},
-                "memories": [],
-                "preferences": {{}},
-                "topics": [],
-                "emotional_state": ""
-            }}
-            """
-            
-            extraction_model = genai.GenerativeModel("gemini-1.5-pro")
-            extraction_chat = extraction_model.start_chat()
-            extraction_response = extraction_chat.send_message(extraction_prompt)
-            
-            try:
-                # Parse the extraction results
-                extracted_data = json.loads(extraction_response.text)
-                
-                # Update personal info
-                for key, value in extracted_data.get("personal_info", {}).items():
-                    self.patient_memory["personal_info"][key] = value
-                
-                # Update important memories
-                for memory in extracted_data.get("memories", []):
-                    if memory not in self.patient_memory["important_memories"]:
-                        self.patient_memory["important_memories"].append(memory)
-                
-                # Update preferences
-                for key, value in extracted_data.get("preferences", {}).items():
-                    self.patient_memory["preferences"][key] = value
-                
-                # Update topics discussed
-                for topic in extracted_data.get("topics", []):
-                    if topic in self.patient_memory["topics_discussed"]:
-                        self.patient_memory["topics_discussed"][topic] += 1
-                    else:
-                        self.patient_memory["topics_discussed"][topic] = 1
-            
-            except json.JSONDecodeError:
-                # If response isn't valid JSON, just continue without updating
-                pass
-                
-        except Exception as e:
-            # If extraction fails, just log and continue
-            print(f"Memory extraction error: {str(e)}")
-        
+        }
+        self.store.append(("conversation_history",), turn)
+        self._index_turn(turn)
+        self.retention.enforce()
+        self._save_memory()
+
+        # Extraction runs off the response path, several exchanges per model call
+        if extract and self.extraction_gate.should_extract(user_message, response):
+            self.extraction.submit(user_message, response)
+
+    def _apply_extraction(self, extracted_data):
+        """Merge one exchange's extracted information into patient memory"""
+        # Update personal info
+        # unchanged facts are skipped so they don't invalidate cached replies
+        for key, value in extracted_data.get("personal_info", {}).items():
+            if self.patient_memory["personal_info"].get(key) != value:
+                self.store.set(("personal_info", key), value)
+                self._index_fact("personal_info", key, value)
+
+        # Update important memories
+        for memory in extracted_data.get("memories", []):
+            if memory not in self.patient_memory["important_memories"]:
+                self.store.append(("important_memories",), memory)
+                self._index_fact("memory", None, memory)
+
+        # Update preferences
+        for key, value in extracted_data.get("preferences", {}).items():
+            if self.patient_memory["preferences"].get(key) != value:
+                self.store.set(("preferences", key), value)
+                self._index_fact("preferences", key, value)
+
+        # Update topics discussed, under their normalized name so "Family" and "family members" add up
+        for topic in dict.fromkeys(filter(None, map(normalize, extracted_data.get("topics", [])))):
+            self.store.incr(("topics_discussed", topic))
+
+        # Record the mood; extraction lags the exchange by seconds, not enough to move it to another day
+        if extracted_data.get("emotional_state"):
+            self.moods.record(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), extracted_data["emotional_state"])
+
         # Save updated memory
         self._save_memory()
+
+    def end_session(self):
+        """Extract whatever is still buffered, e.g. before a new chat or on exit"""
+        self.extraction.flush()
     
-    def send_message(self, message):
-        try:
+    def _memory_version(self):
+        """Changes whenever a fact a reply could draw on changes"""
+        return tuple(self.store.version(section) for section in ("personal_info", "preferences", "important_memories"))
 
-            full_prompt = f"""
-            System Instruction: {self.system_prompt}
-            
-            Patient: {message}
-            Lumora:
-            """
-            response = self.chat.send_message(full_prompt)
-            response_text = response.text
+    def _cacheable(self, message):
+        # replies about "yesterday" or "this morning" depend on the clock, not just memory
+        return resolve_time_window(message) is None
 
-            while response_text.startswith(("\"", "'")) and response_text.endswith(("\"", "'")):
-                response_text = response_text[1:-1].strip()
+    def cached_reply(self, message):
+        """Earlier reply to a repeated message, recorded as this turn without extraction; None on a miss"""
+        started = time.perf_counter()
+        if not self._cacheable(message):
+            return None
+        reply = self.responses.get(message, self._memory_version())
+        if reply is None:
+            return None
+        elapsed = time.perf_counter() - started
+        self.last_latency = {"first_token": elapsed, "total": elapsed}
+        self.last_timings = {"cache_lookup": elapsed}
+        self.update_memory(message, reply, extract=False)
+        return reply
 
-            # Ensure no residual quotation marks remain
-            response_text = response_text.replace('\\"', '"').replace("\\'", "'")
+    def _build_prompt(self, trace, message):
+        with trace.span("prompt_build") as span:
+            prompt = self.prompts.build(message)
+            span.set(estimated_tokens=self.prompts.last_turn.get("total", 0))
+        return prompt
 
-            # Update memory
-            self.update_memory(message, response_text)
+    def _call_payload(self, prompt, response, response_text):
+        """A chat call's payload sizes and the model's own token counts, for its span"""
+        attributes = {"bytes_out": len(prompt.encode()), "bytes_in": len(response_text.encode())}
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            attributes["prompt_tokens"] = getattr(usage, "prompt_token_count", 0) or 0
+            attributes["reply_tokens"] = getattr(usage, "candidates_token_count", 0) or 0
+        return attributes
+
+    def send_message(self, message):
+        started = time.perf_counter()
+        try:
+            with self.tracer.trace("turn", current=True) as trace:
+                cached = self.cached_reply(message)
+                if cached is not None:
+                    trace.set(cached=True)
+                    return cached
+                prompt = self._build_prompt(trace, message)
+                with trace.span("chat_call") as span:
+                    chat, response = self.chat_calls.call(self._chat_attempt, prompt)
+                    response_text = strip_quotes(response.text)
+                    span.set(**self._call_payload(prompt, response, response_text))
+                self.chat = chat
+
+                elapsed = time.perf_counter() - started
+                self.last_latency = {"first_token": elapsed, "total": elapsed}
+                self.record_turn(message, response, response_text, trace)
 
             return response_text
+        except ModelCallError:
+            return self.fallback_reply(message)
         except Exception as e:
             return f"I'm having a little trouble understanding right now. Could you please repeat that? (Error: {str(e)})"
 
-        """
-        Send a message to Lumora and get the response
-        try:
-            response = self.chat.send_message(message)
-            response_text = response.text
-            
-            # Update memory with this exchange
+    def send_message_stream(self, message):
+        """Send a message to Lumora and yield the reply in chunks as they arrive"""
+        started = time.perf_counter()
+        first_token = None
+        parts = []
+        # not current=True: the trace stays open across yields to the caller
+        with self.tracer.trace("turn", stream=True) as trace:
+            try:
+                cached = self.cached_reply(message)
+                if cached is not None:
+                    trace.set(cached=True)
+                    yield cached
+                    return
+                prompt = self._build_prompt(trace, message)
+                with trace.span("chat_call") as span:
+                    chat, response = self.chat_calls.call(self._chat_attempt, prompt, stream=True)
+
+                    stripper = QuoteStripper()
+                    for chunk in self.chat_calls.read(response):
+                        text = stripper.feed(chunk.text)
+                        if text:
+                            if first_token is None:
+                                first_token = time.perf_counter() - started
+                            parts.append(text)
+                            yield text
+                    tail = stripper.finish()
+                    if tail:
+                        parts.append(tail)
+                        yield tail
+                    span.set(**self._call_payload(prompt, response, "".join(parts)))
+            except ModelCallError:
+                if parts:
+                    # the stream stalled partway; remember what the patient was shown
+                    self.update_memory(message, "".join(parts))
+                else:
+                    yield self.fallback_reply(message)
+                return
+            except Exception as e:
+                yield f"I'm having a little trouble understanding right now. Could you please repeat that? (Error: {str(e)})"
+                return
+
+            # the session copy holds the finished exchange once the stream is read
+            self.chat = chat
+            total = time.perf_counter() - started
+            self.last_latency = {"first_token": first_token if first_token is not None else total, "total": total}
+            self.record_turn(message, response, "".join(parts), trace)
+
+    def record_turn(self, message, response, response_text, trace=None):
+        """Bookkeeping once a reply is complete: token usage, chat history and memory"""
+        self._record_usage(response)
+        self._trim_chat_history()
+        if self._cacheable(message):
+            self.responses.put(message, self._memory_version(), response_text)
+
+        # Update memory
+        with trace.span("persist") if trace is not None else NULL_SPAN:
             self.update_memory(message, response_text)
-            
-            return response_text
-        except Exception as e:
-            return f"I'm having a little trouble understanding right now. Could you please repeat that? (Error: {str(e)})"
-        """
-        
-    
+        if trace is not None:
+            # seconds spent in each phase of the turn
+            self.last_timings = dict(trace.durations)
+
+    def _record_usage(self, response):
+        """Keep the model's own prompt token count next to the local estimate"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            self.prompts.last_turn["reported_prompt_tokens"] = usage.prompt_token_count
+
+    def _trim_chat_history(self):
+        """Drop the oldest exchanges from the live chat session beyond max_chat_turns"""
+        history = self.chat.history
+        if len(history) > 2 * self.max_chat_turns:
+            self.chat.history = history[-2 * self.max_chat_turns:]
+
+    def recall_history(self, start_day, end_day):
+        """Turns between two days, loading archived days only when needed"""
+        return self.time_index.turns_between(start_day, end_day)
+
     def get_patient_memory(self):
         """Get the current patient memory"""
         return self.patient_memory
     
     def reset_memory(self):
         """Reset patient memory (use with caution)"""
-        self.patient_memory = {
-            "personal_info": {},
-            "important_memories": [],
-            "preferences": {},
-            "conversation_history": [],
-            "topics_discussed": {}
-        }
+        self.extraction.flush()
+        self.store.replace(empty_memory())
+        self.retention.archive.clear()
+        self.moods.clear()
+        self.index.clear()
+        self.responses.clear()
         self._save_memory()
         self.start_new_chat()
-        return "Patient memory has been reset."
\ No newline at end of file
+        return "Patient memory has been reset."
+
+    def close(self):
+        """Finish pending extraction, compact the memory journal and release the memory files"""
+        self.extraction.close()
+        self.index.close()
+        self.moods.close()
+        self.store.close()
\ No newline at end of file
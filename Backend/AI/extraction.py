@@ -0,0 +1,223 @@
+import json
+import time
+import threading
+
+import tracing
+from tracing import TRACER
+
+
+EXTRACTION_PROMPT = """
+Based on these conversation exchanges with a patient with dementia, extract any important information to remember.
+
+{exchanges}
+
+For each exchange, extract and categorize the following:
+1. Personal information (name, family members, occupation, etc.)
+2. Important memories or stories shared
+3. Preferences mentioned (likes/dislikes)
+4. Topics discussed
+5. Emotional state
+
+Respond with a JSON array only, one object per exchange and in the same order:
+[
+    {{
+        "personal_info": {{}},
+        "memories": [],
+        "preferences": {{}},
+        "topics": [],
+        "emotional_state": ""
+    }}
+]
+"""
+
+
+def parse_extraction(text):
+    """Parse the extractor's JSON reply, tolerating markdown code fences around it"""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0]
+    return json.loads(text)
+
+
+class MemoryExtractor:
+    """Extracts structured memory from several exchanges with a single model call"""
+
+    def __init__(self, backend, calls=None):
+        # one backend for the lifetime of the assistant instead of a model per exchange
+        self.backend = backend
+        # optional ModelCaller applying deadlines, retries and a circuit breaker
+        self.calls = calls
+
+    def __call__(self, exchanges):
+        """Return one extraction dict per exchange (empty dicts when the reply is unusable)"""
+        formatted = "\n\n".join(
+            f"Exchange {i}:\nPatient: {exchange['patient']}\nLumora: {exchange['lumora']}"
+            for i, exchange in enumerate(exchanges, 1)
+        )
+        prompt = EXTRACTION_PROMPT.format(exchanges=formatted)
+        with tracing.span("extraction_call") as span:
+            if self.calls is None:
+                response = self.backend.generate(prompt, json_output=True)
+            else:
+                response = self.calls.call(self.backend.generate, prompt, json_output=True)
+            span.set(bytes_out=len(prompt.encode()), bytes_in=len(response.text.encode()))
+            usage = getattr(response, "usage_metadata", None)
+            if usage is not None:
+                span.set(prompt_tokens=getattr(usage, "prompt_token_count", 0) or 0,
+                         reply_tokens=getattr(usage, "candidates_token_count", 0) or 0)
+
+        with tracing.span("parse") as span:
+            try:
+                results = parse_extraction(response.text)
+            except json.JSONDecodeError:
+                span.set(unusable=True)
+                return [{} for _ in exchanges]
+
+        if isinstance(results, dict):
+            results = [results]
+        results = [r if isinstance(r, dict) else {} for r in results]
+        # pad or cut so results always line up with the exchanges sent
+        return (results + [{} for _ in exchanges])[:len(exchanges)]
+
+
+class ExtractionPipeline:
+    """
+    Buffers conversation exchanges and extracts memory from them off the response path.
+
+    A background thread hands ``extract`` a batch once ``batch_size`` exchanges
+    are waiting, once the oldest has waited ``flush_interval`` seconds, or when
+    ``flush()`` is called (e.g. at the end of a session). Each exchange's result
+    is passed to ``apply``. Each batch is an "extraction" trace of ``tracer``,
+    which spans opened by ``extract`` join. ``cleanup``, if given, is called on
+    the background thread after each batch and before it exits, e.g. to close
+    the database connections the batch opened.
+    """
+
+    def __init__(self, extract, apply, batch_size=5, flush_interval=30.0, tracer=None, cleanup=None):
+        self.extract = extract
+        self.apply = apply
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.tracer = tracer or TRACER
+        self.cleanup = cleanup
+
+        self._pending = []
+        self._in_flight = 0
+        self._flush_requested = False
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self.stats = {
+            "submitted": 0,
+            "extracted": 0,
+            "batches": 0,
+            "failed_batches": 0,
+            "last_lag": 0.0,
+            "max_lag": 0.0,
+            "last_extract_seconds": 0.0,
+            "extract_seconds": 0.0,
+        }
+
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    @property
+    def queue_depth(self):
+        """Number of exchanges waiting for, or going through, extraction"""
+        with self._cond:
+            return len(self._pending) + self._in_flight
+
+    def submit(self, user_message, response):
+        """Queue one exchange for extraction"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Extraction pipeline is closed")
+            self._pending.append((time.monotonic(), {"patient": user_message, "lumora": response}))
+            self.stats["submitted"] += 1
+            self._cond.notify()
+
+    def flush(self, timeout=None):
+        """Extract everything queued so far and wait for it to be applied"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify()
+            while self._pending or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """Flush remaining exchanges and stop the worker"""
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._worker.join(timeout)
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                if self._pending:
+                    waited = time.monotonic() - self._pending[0][0]
+                    if (self._flush_requested or self._closed
+                            or len(self._pending) >= self.batch_size
+                            or waited >= self.flush_interval):
+                        batch = self._pending[:self.batch_size]
+                        del self._pending[:self.batch_size]
+                        self._in_flight = len(batch)
+                        return batch
+                    self._cond.wait(self.flush_interval - waited)
+                elif self._closed:
+                    return None
+                else:
+                    self._flush_requested = False
+                    self._cond.wait()
+
+    def _run(self):
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                self._process(batch)
+        finally:
+            self._clean_up()
+
+    def _process(self, batch):
+        started = time.perf_counter()
+        try:
+            with self.tracer.trace("extraction", current=True, exchanges=len(batch)) as trace:
+                results = self.extract([exchange for _, exchange in batch])
+                with trace.span("persist"):
+                    for result in results:
+                        self.apply(result)
+            self.stats["extracted"] += len(batch)
+        except Exception as e:
+            # If extraction fails, just log and continue
+            self.stats["failed_batches"] += 1
+            print(f"Memory extraction error: {str(e)}")
+        finally:
+            self._clean_up()
+
+        elapsed = time.perf_counter() - started
+        lag = time.monotonic() - batch[0][0]
+        with self._cond:
+            self.stats["last_extract_seconds"] = elapsed
+            self.stats["extract_seconds"] += elapsed
+            self.stats["batches"] += 1
+            self.stats["last_lag"] = lag
+            self.stats["max_lag"] = max(self.stats["max_lag"], lag)
+            self._in_flight = 0
+            self._cond.notify_all()
+
+    def _clean_up(self):
+        if self.cleanup is None:
+            return
+        try:
+            self.cleanup()
+        except Exception as e:
+            print(f"Memory extraction cleanup error: {str(e)}")
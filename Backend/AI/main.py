@@ -1,17 +1,90 @@
-from chat import LumoraAssistant
+import time
+STARTED = time.perf_counter()
+
 import sys
 import os
+import json
+import argparse
 import datetime
-import google.generativeai as genai
+import threading
 from dotenv import load_dotenv
+from chat import LumoraAssistant
+from topics import top_topics
 load_dotenv()
 
-api_key = os.environ.get('GEMINI_API_KEY')
+# Model listing is a network call, so it only happens on request and is cached
+MODEL_CATALOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".model_catalog.json")
+MODEL_CATALOG_TTL = 24 * 60 * 60
+
+
+class StartupProfile:
+    """Timestamps of the startup phases, printed with --profile-startup"""
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.marks = [("process start", STARTED)]
+
+    def mark(self, name):
+        self.marks.append((name, time.perf_counter()))
+
+    def report(self):
+        if not self.enabled:
+            return
+        print("\n----- STARTUP PROFILE -----")
+        for name, at in self.marks[1:]:
+            print(f"  {name:<28} {1000 * (at - STARTED):8.1f} ms")
+        print("  (run with python -X importtime for a per-module import breakdown)")
+        print("---------------------------")
+
+
+def list_models(refresh=False):
+    """Print the available Gemini models, from the cached catalog when it is fresh"""
+    catalog = None
+    try:
+        if not refresh and time.time() - os.path.getmtime(MODEL_CATALOG_FILE) < MODEL_CATALOG_TTL:
+            with open(MODEL_CATALOG_FILE, 'r') as f:
+                catalog = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        catalog = None
+
+    if catalog is None:
+        import google.generativeai as genai
+        genai.configure(api_key=os.environ.get('GEMINI_API_KEY'))
+        catalog = [
+            {"name": model.name, "methods": list(model.supported_generation_methods)}
+            for model in genai.list_models()
+        ]
+        with open(MODEL_CATALOG_FILE, 'w') as f:
+            json.dump(catalog, f, indent=4)
 
-genai.configure(api_key=api_key)
-models = genai.list_models()
-for model in models:
-    print(model.name, "-", model.supported_generation_methods)
+    for model in catalog:
+        print(model["name"], "-", model["methods"])
+
+
+def start_assistant(simulated=False):
+    """Build the assistant on a background thread; returns a function that waits for it"""
+    result = {}
+
+    def load():
+        try:
+            if simulated:
+                from backends import SimulatedBackend
+                result["lumora"] = LumoraAssistant(backend=SimulatedBackend())
+            else:
+                result["lumora"] = LumoraAssistant()
+        except Exception as e:
+            result["error"] = e
+
+    loader = threading.Thread(target=load, daemon=True)
+    loader.start()
+
+    def wait():
+        loader.join()
+        if "error" in result:
+            raise result["error"]
+        return result["lumora"]
+
+    return wait
 
 def print_header():
     print("\n" + "="*60)
@@ -26,26 +99,28 @@ def print_header():
     print("  'reset memory' - Clear all patient memory (use with caution)")
     print("-"*60 + "\n")
 
-def format_response(text):
-    # Add some light formatting to make responses more readable
-    paragraphs = text.split('\n')
-    formatted = []
-    for p in paragraphs:
-        if p.strip():
-            # Wrap long lines
-            formatted.append(p)
-        else:
-            formatted.append("")
-    return "\n".join(formatted)
+def parse_args():
+    parser = argparse.ArgumentParser(description="Chat with Lumora from the terminal.")
+    parser.add_argument("--list-models", action="store_true", help="list available Gemini models and exit")
+    parser.add_argument("--refresh-models", action="store_true", help="refresh the cached model list")
+    parser.add_argument("--profile-startup", action="store_true", help="print how long each startup phase took")
+    parser.add_argument("--simulated", action="store_true", help="use the local simulated model (no API key)")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
+    if args.list_models or args.refresh_models:
+        list_models(refresh=args.refresh_models)
+        return
+
+    profile = StartupProfile(args.profile_startup)
+    profile.mark("imports done")
+
+    # Initialize Lumora in the background while the welcome is shown
+    wait_for_lumora = start_assistant(simulated=args.simulated)
     print_header()
     
     try:
-        # Initialize Lumora
-        print("Initializing Lumora...")
-        lumora = LumoraAssistant()
-        
         # Get current time for greeting
         current_hour = datetime.datetime.now().hour
         time_greeting = "Good morning" if 5 <= current_hour < 12 else "Good afternoon" if 12 <= current_hour < 18 else "Good evening"
@@ -53,14 +128,23 @@ def main():
         # Welcome message
         welcome_message = f"{time_greeting}! I'm Lumora, your companion. How are you feeling today?"
         print(f"\nLumora: {welcome_message}")
-        
+        profile.mark("welcome shown")
+
+        lumora = None
         while True:
             # Get user input
+            if lumora is None:
+                profile.mark("time to prompt")
             user_input = input("\nYou: ")
+            if lumora is None:
+                lumora = wait_for_lumora()
+                profile.mark("assistant ready")
+                profile.report()
             
             # Process special commands
             if user_input.lower() in ['exit', 'quit']:
                 print("\nLumora: It was lovely spending time with you. I'll be here when you need me again. Take care!")
+                lumora.close()
                 break
                 
             elif user_input.lower() == 'new session':
@@ -90,7 +174,7 @@ def main():
                         
                 if memory["topics_discussed"]:
                     print("\nFrequently Discussed Topics:")
-                    for topic, count in sorted(memory["topics_discussed"].items(), key=lambda x: x[1], reverse=True):
+                    for topic, count in top_topics(memory["topics_discussed"], 10):
                         print(f"  - {topic}: {count} times")
                 
                 print("\n--------------------------")
@@ -106,9 +190,11 @@ def main():
                 continue
             
             # Regular conversation - send message to Lumora
-            print("\nLumora: ", end="")
-            response = lumora.send_message(user_input)
-            print(format_response(response))
+            # Show the reply as it streams in rather than after it is complete
+            print("\nLumora: ", end="", flush=True)
+            for chunk in lumora.send_message_stream(user_input):
+                print(chunk, end="", flush=True)
+            print()
             
     except Exception as e:
         print(f"\nError: {str(e)}")
@@ -0,0 +1,285 @@
+import os
+import json
+import datetime
+import threading
+
+
+def empty_memory():
+    """Return a fresh, empty patient memory structure"""
+    return {
+        "personal_info": {},
+        "important_memories": [],
+        "preferences": {},
+        "conversation_history": [],
+        "conversation_summaries": {},
+        "topics_discussed": {}
+    }
+
+
+class MemoryStore:
+    """
+    Patient memory persisted as a compacted JSON snapshot plus an append-only journal.
+
+    Every change is one JSON line appended to ``<memory_file>.journal``. The
+    snapshot (the memory file itself) is only rewritten by compaction, which
+    runs on a background thread once enough records have piled up. Each record
+    carries a sequence number and the snapshot stores the last sequence number
+    it contains, so a crash between writing the snapshot and trimming the
+    journal replays nothing twice.
+    """
+
+    def __init__(self, memory_file, compact_every=200, durable=False):
+        self.memory_file = memory_file
+        self.journal_file = memory_file + ".journal"
+        self.compact_every = compact_every
+        # fsync every journal record, not just flush it to the OS
+        self.durable = durable
+
+        # held while the state changes; readers on other threads take it too
+        self.lock = threading.RLock()
+        self._journal = None
+        self._compactor = None
+        self._compacting = threading.Lock()
+        self._seq = 0
+        self._snapshot_seq = 0
+        # bumped whenever a top-level section changes, so caches built from
+        # a section know when they are stale
+        self.versions = {}
+
+        self.state = self._load()
+
+    # ------------------------------------------------------------------ loading
+
+    def _load(self):
+        """Rebuild the current memory from the snapshot and the journal tail"""
+        state = self._read_snapshot()
+        seq = state.pop("_seq", 0)
+        self._snapshot_seq = seq
+
+        for record in self._read_journal():
+            if record["seq"] <= seq:
+                # already folded into the snapshot by an interrupted compaction
+                continue
+            self._apply(state, record)
+            seq = record["seq"]
+
+        self._seq = seq
+        return state
+
+    def _read_snapshot(self):
+        try:
+            with open(self.memory_file, 'r') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return empty_memory()
+        except json.JSONDecodeError:
+            # Snapshots are replaced atomically, so this file was damaged outside
+            # of the store. Keep it for recovery instead of overwriting it.
+            stamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+            corrupt_file = f"{self.memory_file}.corrupt-{stamp}"
+            os.replace(self.memory_file, corrupt_file)
+            print(f"Memory snapshot {self.memory_file} is unreadable, moved to {corrupt_file}")
+            return empty_memory()
+
+        for key, value in empty_memory().items():
+            state.setdefault(key, value)
+        return state
+
+    @staticmethod
+    def _parse(line):
+        """The record on one journal line, or None if it can't be read"""
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return None
+        return record if isinstance(record, dict) and "seq" in record else None
+
+    def _read_journal(self):
+        """
+        Yield journal records. A torn final record left by a crash is truncated;
+        an unreadable record with others after it is skipped, not the end of the journal.
+        """
+        try:
+            f = open(self.journal_file, 'rb')
+        except FileNotFoundError:
+            return
+
+        offset = 0
+        # offset and line number of an unreadable line, until we know whether it's the last
+        bad = None
+        with f:
+            for number, line in enumerate(f, 1):
+                if bad is not None:
+                    print(f"Skipping unreadable record on line {bad[1]} of {self.journal_file}")
+                    bad = None
+                record = self._parse(line) if line.endswith(b"\n") else None
+                if record is None:
+                    bad = (offset, number)
+                else:
+                    yield record
+                offset += len(line)
+
+        if bad is not None:
+            with open(self.journal_file, 'r+b') as f:
+                f.truncate(bad[0])
+
+    # ------------------------------------------------------------------ changes
+
+    def set(self, path, value):
+        """Set the value at ``path`` (a tuple of keys), e.g. ("personal_info", "name")"""
+        self._record({"op": "set", "path": list(path), "value": value})
+
+    def append(self, path, value):
+        """Append ``value`` to the list at ``path``"""
+        self._record({"op": "append", "path": list(path), "value": value})
+
+    def incr(self, path, amount=1):
+        """Add ``amount`` to the counter at ``path``"""
+        self._record({"op": "incr", "path": list(path), "value": amount})
+
+    def trim(self, path, count):
+        """Drop the first ``count`` entries of the list at ``path``"""
+        self._record({"op": "trim", "path": list(path), "value": count})
+
+    def delete(self, path):
+        """Remove the key at ``path`` if it exists"""
+        self._record({"op": "delete", "path": list(path), "value": None})
+
+    def replace(self, state):
+        """Replace the whole memory, e.g. when it is reset"""
+        self._record({"op": "replace", "path": [], "value": state})
+
+    def _record(self, record):
+        with self.lock:
+            self._seq += 1
+            record["seq"] = self._seq
+            line = json.dumps(record) + "\n"
+            self._apply(self.state, record)
+            self._bump(record)
+
+            if self._journal is None:
+                self._journal = open(self.journal_file, 'a')
+            self._journal.write(line)
+            self._journal.flush()
+            if self.durable:
+                os.fsync(self._journal.fileno())
+
+            if self._seq - self._snapshot_seq >= self.compact_every:
+                self._start_compaction()
+
+    def _bump(self, record):
+        if record["op"] == "replace":
+            sections = set(self.versions) | set(self.state)
+        else:
+            sections = [record["path"][0]]
+        for section in sections:
+            self.versions[section] = self.versions.get(section, 0) + 1
+
+    def version(self, section):
+        """Change counter of one top-level section, e.g. "personal_info" """
+        return self.versions.get(section, 0)
+
+    @staticmethod
+    def _apply(state, record):
+        op = record["op"]
+        value = record["value"]
+
+        if op == "replace":
+            # mutate in place so callers holding a reference to the state see it
+            state.clear()
+            state.update(json.loads(json.dumps(value)))
+            return
+
+        *parents, key = record["path"]
+        target = state
+        for part in parents:
+            target = target.setdefault(part, {})
+
+        if op == "set":
+            target[key] = value
+        elif op == "append":
+            target.setdefault(key, []).append(value)
+        elif op == "incr":
+            target[key] = target.get(key, 0) + value
+        elif op == "trim":
+            del target.setdefault(key, [])[:value]
+        elif op == "delete":
+            target.pop(key, None)
+        else:
+            raise ValueError(f"Unknown memory journal operation: {op}")
+
+    # --------------------------------------------------------------- compaction
+
+    def _start_compaction(self):
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._compactor = threading.Thread(target=self.compact, daemon=True)
+        self._compactor.start()
+
+    def compact(self):
+        """Fold the journal into a new snapshot and drop the records it now contains"""
+        with self._compacting:
+            with self.lock:
+                seq = self._seq
+                if seq == self._snapshot_seq:
+                    return
+                # serializing under the lock gives a consistent view; the disk
+                # write below happens without blocking new records
+                data = json.dumps(dict(self.state, _seq=seq), indent=4)
+
+            self._write_snapshot(data)
+
+            with self.lock:
+                self._trim_journal(seq)
+                self._snapshot_seq = seq
+
+    def _write_snapshot(self, data):
+        tmp_file = self.memory_file + ".tmp"
+        with open(tmp_file, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.memory_file)
+
+    def _trim_journal(self, seq):
+        """Rewrite the journal keeping only records newer than ``seq``"""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+        try:
+            with open(self.journal_file, 'r') as f:
+                tail = [line for line in f if (self._parse(line) or {"seq": 0})["seq"] > seq]
+        except FileNotFoundError:
+            return
+
+        tmp_file = self.journal_file + ".tmp"
+        with open(tmp_file, 'w') as f:
+            f.writelines(tail)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.journal_file)
+
+    # ---------------------------------------------------------------- lifecycle
+
+    def flush(self):
+        """
+        Make sure every recorded change has reached the OS, and with ``durable``
+        the disk; without it a power loss can cost the last few records
+        """
+        with self.lock:
+            if self._journal is not None:
+                self._journal.flush()
+                if self.durable:
+                    os.fsync(self._journal.fileno())
+
+    def close(self):
+        """Wait for background compaction, compact what is left and close the journal"""
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+        self.compact()
+        with self.lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
@@ -0,0 +1,147 @@
+import threading
+from bisect import bisect_left
+
+
+# Upper bounds in seconds, from a fast local step to a slow model call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram, cheap enough to observe every call"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def quantile(self, q):
+        """Estimated ``q`` quantile (upper bound of the bucket it falls in)"""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank = q * self.count
+            seen = 0
+            for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+                seen += count
+                if seen >= rank:
+                    return bound
+        return float("inf")
+
+    def cumulative(self):
+        """(bucket upper bounds, observations at or below each, count, sum), read together"""
+        with self._lock:
+            counts, seen = [], 0
+            for count in self.counts[:-1]:
+                seen += count
+                counts.append(seen)
+            return self.buckets, counts, self.count, self.sum
+
+    def snapshot(self):
+        """Count, sum and p50/p95/p99 estimates"""
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+def _labels(labels, extra=()):
+    pairs = tuple(labels) + tuple(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _number(value):
+    return "+Inf" if value == float("inf") else repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """
+    Named histograms and counters, one series per set of label values,
+    rendered in the Prometheus text format. Labels are passed as a tuple of
+    (name, value) pairs, always in the same order for a metric.
+    """
+
+    def __init__(self):
+        self.help = {}
+        self._histograms = {}   # (name, labels) -> LatencyHistogram
+        self._counters = {}     # (name, labels) -> value
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def histogram(self, name, labels=(), buckets=DEFAULT_BUCKETS):
+        """The series' histogram, created on first use"""
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, LatencyHistogram(buckets))
+        return histogram
+
+    def observe(self, name, labels, value, buckets=DEFAULT_BUCKETS):
+        self.histogram(name, labels, buckets).observe(value)
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def add_collector(self, collect):
+        """``collect()`` returns [(name, type, labels, value)], read when the metrics are rendered"""
+        if collect not in self._collectors:
+            self._collectors.append(collect)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render(self):
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        collected = sorted(sample for collect in self._collectors for sample in collect())
+
+        lines, described = [], set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), histogram in histograms:
+            header(name, "histogram")
+            bounds, counts, count, total = histogram.cumulative()
+            for bound, seen in zip(bounds, counts):
+                lines.append(f"{name}_bucket{_labels(labels, [('le', _number(float(bound)))])} {seen}")
+            lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        for name, kind, labels, value in collected:
+            header(name, kind)
+            lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# The process's metrics, shown at the API's /metrics
+REGISTRY = Registry()
@@ -0,0 +1,314 @@
+import time
+import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from metrics import LatencyHistogram, REGISTRY
+
+
+class ModelCallError(Exception):
+    """A model call failed after its retries, ran out of time, or was refused by the circuit breaker"""
+
+
+class CircuitOpenError(ModelCallError):
+    pass
+
+
+# Blocking model calls run here so the caller can stop waiting at the deadline.
+# A call that overruns keeps its thread until the client gives up on it.
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="model-call")
+# what ``read`` gets from next() once a stream is exhausted
+_END = object()
+
+REGISTRY.describe("lumora_model_call_seconds", "Time per model call attempt, by call and upstream")
+REGISTRY.describe("lumora_model_circuit_state", "1 for the state each upstream's circuit breaker is in")
+
+# ModelCallers shared by every session, by (call name, upstream)
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream that keeps failing.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    calls are refused for ``reset_timeout`` seconds. Then one trial call is
+    let through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class ModelCaller:
+    """
+    Runs model calls with a per-attempt deadline, jittered retries, optional
+    hedging and a circuit breaker.
+
+    Each attempt gets ``timeout`` seconds. Failed attempts are retried up to
+    ``retries`` times after a random wait of up to ``backoff * 2**attempt``
+    seconds (capped at ``max_backoff``). With ``hedge_after`` set, a second
+    copy of an attempt still running after that many seconds (or after the
+    observed p95, if later) is started and whichever finishes first wins, so
+    the function must be safe to run twice. Streamed replies are read through
+    ``read``/``read_async``: each chunk must arrive within ``timeout``
+    seconds and the whole reply within ``stream_timeout``. Latency of every attempt goes
+    into ``histogram``; outcomes are counted in ``stats``. With a ``registry``
+    both show up there, labelled with the call name and ``upstream``.
+    """
+
+    def __init__(self, name, timeout=20.0, retries=2, backoff=0.5, max_backoff=4.0,
+                 hedge_after=None, breaker=None, upstream=None, registry=None, stream_timeout=120.0):
+        self.name = name
+        self.upstream = upstream
+        self.timeout = timeout
+        self.stream_timeout = stream_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_after = hedge_after
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = {"calls": 0, "successes": 0, "timeouts": 0, "errors": 0,
+                      "retries": 0, "hedges": 0, "rejected": 0}
+        self._stats_lock = threading.Lock()
+        if registry is None:
+            self.histogram = LatencyHistogram()
+        else:
+            self.histogram = registry.histogram("lumora_model_call_seconds", self._labels())
+            registry.add_collector(self.collect)
+
+    def _labels(self):
+        return (("call", self.name), ("upstream", self.upstream or ""))
+
+    def collect(self):
+        """Outcome counters and breaker state, as registry samples"""
+        labels = self._labels()
+        with self._stats_lock:
+            stats = dict(self.stats)
+        samples = [("lumora_model_calls_total" if key == "calls" else f"lumora_model_call_{key}_total",
+                    "counter", labels, value) for key, value in stats.items()]
+        state = self.breaker.state
+        samples += [("lumora_model_circuit_state", "gauge", labels + (("state", name),), int(name == state))
+                    for name in ("closed", "half_open", "open")]
+        return samples
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _hedge_delay(self):
+        if self.hedge_after is None:
+            return None
+        delay = self.hedge_after
+        if self.histogram.count >= 20:
+            # hedge only the slowest few percent, not every call on a slow day
+            delay = max(delay, self.histogram.quantile(0.95))
+        return delay if delay < self.timeout else None
+
+    def _admit(self):
+        self._count("calls")
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise CircuitOpenError(f"{self.name} circuit is open")
+
+    def _finish(self, started, error=None):
+        self.histogram.observe(time.perf_counter() - started)
+        if error is None:
+            self.breaker.record_success()
+            self._count("successes")
+        else:
+            self.breaker.record_failure()
+            self._count("timeouts" if isinstance(error, TimeoutError) else "errors")
+
+    def _stream_failed(self, error):
+        # the call already counted as a success when the stream opened
+        self.breaker.record_failure()
+        self._count("timeouts" if isinstance(error, TimeoutError) else "errors")
+        return ModelCallError(f"{self.name} stream failed: {error or 'timed out'}")
+
+    def _read_limit(self, deadline):
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            raise TimeoutError(f"{self.name} stream took over {self.stream_timeout}s")
+        return min(self.timeout, remaining)
+
+    # ---------------------------------------------------------------- blocking
+
+    def _attempt(self, fn, args, kwargs):
+        started = time.perf_counter()
+        futures = [_executor.submit(fn, *args, **kwargs)]
+        deadline = started + self.timeout
+        try:
+            hedge_after = self._hedge_delay()
+            if hedge_after is not None:
+                done, _ = wait(futures, timeout=hedge_after)
+                if not done:
+                    self._count("hedges")
+                    futures.append(_executor.submit(fn, *args, **kwargs))
+
+            while True:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise TimeoutError(f"{self.name} call timed out after {self.timeout}s")
+                done, _ = wait(futures, timeout=remaining, return_when=FIRST_COMPLETED)
+                if not done:
+                    continue
+                for future in done:
+                    if future.exception() is None:
+                        result = future.result()
+                        self._finish(started)
+                        return result
+                # the first copy to finish failed; wait for the other one if any
+                futures = [future for future in futures if future not in done]
+                if not futures:
+                    raise next(iter(done)).exception()
+        except Exception as e:
+            for future in futures:
+                future.cancel()
+            self._finish(started, e)
+            raise
+
+    def call(self, fn, *args, **kwargs):
+        """Run ``fn(*args, **kwargs)`` under the call policy and return its result"""
+        self._admit()
+        for attempt in range(self.retries + 1):
+            try:
+                return self._attempt(fn, args, kwargs)
+            except Exception as e:
+                if attempt == self.retries or not self.breaker.allow():
+                    raise ModelCallError(f"{self.name} call failed: {e}") from e
+                self._count("retries")
+                time.sleep(self._delay(attempt))
+
+    def read(self, stream):
+        """Yield the chunks of a streamed reply, raising ModelCallError if it stalls or breaks"""
+        iterator = iter(stream)
+        deadline = time.perf_counter() + self.stream_timeout
+        while True:
+            future = None
+            try:
+                limit = self._read_limit(deadline)
+                future = _executor.submit(next, iterator, _END)
+                chunk = future.result(timeout=limit)
+            except Exception as e:
+                if future is not None:
+                    future.cancel()
+                raise self._stream_failed(e) from e
+            if chunk is _END:
+                return
+            yield chunk
+
+    # ------------------------------------------------------------------ asyncio
+
+    async def _attempt_async(self, fn, args, kwargs):
+        started = time.perf_counter()
+        tasks = [asyncio.ensure_future(fn(*args, **kwargs))]
+        try:
+            hedge_after = self._hedge_delay()
+            if hedge_after is not None:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+                if not done:
+                    self._count("hedges")
+                    tasks.append(asyncio.ensure_future(fn(*args, **kwargs)))
+
+            deadline = started + self.timeout
+            while tasks:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise TimeoutError(f"{self.name} call timed out after {self.timeout}s")
+                done, _ = await asyncio.wait(tasks, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self._finish(started)
+                        return task.result()
+                tasks = [task for task in tasks if task not in done]
+                if not tasks:
+                    raise next(iter(done)).exception()
+        except Exception as e:
+            self._finish(started, e)
+            raise
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def call_async(self, fn, *args, **kwargs):
+        """Await ``fn(*args, **kwargs)`` (a coroutine function) under the call policy"""
+        self._admit()
+        for attempt in range(self.retries + 1):
+            try:
+                return await self._attempt_async(fn, args, kwargs)
+            except Exception as e:
+                if attempt == self.retries or not self.breaker.allow():
+                    raise ModelCallError(f"{self.name} call failed: {e}") from e
+                self._count("retries")
+                await asyncio.sleep(self._delay(attempt))
+
+    async def read_async(self, stream):
+        """Async twin of ``read``, for responses that are async-iterated"""
+        iterator = stream.__aiter__()
+        deadline = time.perf_counter() + self.stream_timeout
+        while True:
+            try:
+                chunk = await asyncio.wait_for(iterator.__anext__(), self._read_limit(deadline))
+            except StopAsyncIteration:
+                return
+            except Exception as e:
+                raise self._stream_failed(e) from e
+            yield chunk
+
+
+def shared_caller(name, upstream, **policy):
+    """
+    The process's ModelCaller for ``name`` calls to ``upstream``, created with
+    ``policy`` on first use. Sharing it across sessions means an outage opens
+    one breaker for every patient and hedging learns from everyone's calls;
+    its histogram and counters are on /metrics.
+    """
+    key = (name, upstream)
+    with _shared_lock:
+        caller = _shared.get(key)
+        if caller is None:
+            caller = _shared[key] = ModelCaller(name, upstream=upstream, registry=REGISTRY, **policy)
+    return caller
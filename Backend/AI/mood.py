@@ -0,0 +1,75 @@
+import os
+import re
+import threading
+
+
+# Moods an emotional_state description is sorted into: (label, valence from
+# -2 to 2, words that point to it). A mood is stored as its index here.
+MOODS = [
+    ("happy", 2, "happy joy joyful cheerful delighted excited glad pleased laughing amused"),
+    ("calm", 1, "calm content relaxed peaceful comfortable settled serene nostalgic fond warm"),
+    ("neutral", 0, "neutral fine okay ok steady"),
+    ("tired", -1, "tired sleepy exhausted weary drowsy fatigued"),
+    ("confused", -1, "confused disoriented lost uncertain unsure forgetful puzzled"),
+    ("lonely", -1, "lonely isolated alone missing"),
+    ("sad", -2, "sad unhappy down tearful crying grieving depressed low upset"),
+    ("anxious", -2, "anxious worried nervous scared afraid fearful frightened uneasy restless"),
+    ("agitated", -2, "agitated angry irritable frustrated annoyed aggressive"),
+]
+
+MOOD_LABELS = [label for label, _, _ in MOODS]
+VALENCES = [valence for _, valence, _ in MOODS]
+_WORDS = {word: index for index, (_, _, words) in enumerate(MOODS) for word in words.split()}
+_NEGATIONS = {"not", "no", "never", "isn't", "wasn't", "less"}
+
+
+def classify(text):
+    """
+    The index in MOODS of the first mood word in an emotional_state
+    description ("a bit confused but happy to talk" -> confused), skipping
+    negated ones ("not sad"); None when nothing matches
+    """
+    words = re.findall(r"[a-z']+", (text or "").lower())
+    for position, word in enumerate(words):
+        index = _WORDS.get(word)
+        if index is not None and not (position and words[position - 1] in _NEGATIONS):
+            return index
+    return None
+
+
+class MoodLog:
+    """
+    Moods observed in a patient's conversations, one "timestamp,mood index"
+    line each, appended to a small text file next to their memory file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, timestamp, emotional_state):
+        """Log the mood in an extracted emotional_state; returns its MOODS index, or None if there is none"""
+        mood = classify(emotional_state)
+        if mood is None:
+            return None
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(f"{timestamp},{mood}\n")
+        return mood
+
+    def clear(self):
+        """Forget every logged mood, e.g. when patient memory is reset"""
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def read(self):
+        """(timestamp, mood index) pairs, oldest first"""
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding="utf-8") as f:
+            return [(timestamp, int(mood)) for timestamp, mood in
+                    (line.rstrip("\n").split(",") for line in f if line.strip())]
+
+    def close(self):
+        pass
@@ -0,0 +1,196 @@
+import os
+import re
+import sys
+import math
+
+
+# Cue words that suggest the patient is sharing something worth remembering
+FAMILY_WORDS = {
+    "mother", "mom", "mum", "mama", "father", "dad", "papa", "wife", "husband",
+    "son", "daughter", "sister", "brother", "grandson", "granddaughter",
+    "grandchildren", "grandkids", "grandmother", "grandfather", "grandma",
+    "grandpa", "aunt", "uncle", "cousin", "niece", "nephew", "family", "friend",
+    "children", "kids", "baby", "dog", "cat", "neighbor", "neighbour",
+}
+PREFERENCE_WORDS = {
+    "like", "likes", "love", "loves", "loved", "enjoy", "enjoyed", "favorite",
+    "favourite", "prefer", "hate", "hated", "dislike", "fond", "miss", "missed",
+}
+MEMORY_WORDS = {
+    "remember", "remembered", "used", "when", "ago", "years", "young", "childhood",
+    "school", "married", "wedding", "born", "grew", "lived", "worked", "job",
+    "war", "church", "farm", "house", "home", "trip", "holiday", "vacation",
+}
+EMOTION_WORDS = {
+    "sad", "happy", "lonely", "scared", "afraid", "worried", "angry", "upset",
+    "tired", "confused", "anxious", "glad", "miss", "hurt", "pain",
+}
+PERSONAL_PATTERNS = re.compile(
+    r"\b(my name|i am|i'm|i was|i used to|i worked|i live|i lived|my \w+ (is|was))\b"
+)
+GREETINGS = {
+    "hi", "hello", "hey", "good", "morning", "afternoon", "evening", "night",
+    "thanks", "thank", "you", "ok", "okay", "yes", "no", "bye", "goodbye",
+    "lumora", "how", "are", "fine", "well", "i'm", "im", "and", "doing",
+}
+
+WORD_RE = re.compile(r"[a-z']+")
+
+# Weights of the tiny logistic classifier over the features below, tuned so
+# greetings and small talk score far below 0.5 and any single strong cue
+# (a family word, "I used to ...", a year) lands above it.
+WEIGHTS = {
+    "bias": -2.2,
+    "family": 2.6,
+    "preference": 2.4,
+    "memory": 1.6,
+    "emotion": 1.8,
+    "personal": 2.8,
+    "proper_noun": 1.5,
+    "number": 1.2,
+    "first_person": 0.6,
+    "length": 0.9,
+    "greeting_only": -3.0,
+}
+
+
+def features(message):
+    """Cheap lexical and entity features of a patient message"""
+    lowered = message.lower()
+    words = WORD_RE.findall(lowered)
+    word_set = set(words)
+
+    # capitalised words that don't start a sentence are usually names or places
+    tokens = message.split()
+    proper_nouns = sum(
+        1 for i, token in enumerate(tokens)
+        if i > 0 and token[:1].isupper() and not tokens[i - 1].endswith((".", "!", "?"))
+        and token.strip(".,!?") not in ("I", "I'm", "Lumora")
+    )
+
+    return {
+        "bias": 1.0,
+        "family": 1.0 if word_set & FAMILY_WORDS else 0.0,
+        "preference": 1.0 if word_set & PREFERENCE_WORDS else 0.0,
+        "memory": min(len(word_set & MEMORY_WORDS), 2) / 2,
+        "emotion": 1.0 if word_set & EMOTION_WORDS else 0.0,
+        "personal": 1.0 if PERSONAL_PATTERNS.search(lowered) else 0.0,
+        "proper_noun": 1.0 if proper_nouns else 0.0,
+        "number": 1.0 if re.search(r"\d", message) else 0.0,
+        "first_person": 1.0 if word_set & {"i", "my", "me", "we", "our", "i'm", "i've"} else 0.0,
+        "length": min(len(words), 30) / 30,
+        "greeting_only": 1.0 if words and word_set <= GREETINGS else 0.0,
+    }
+
+
+class ExtractionGate:
+    """
+    Decides locally whether an exchange could hold anything worth extracting.
+
+    Exchanges scoring below ``threshold`` never reach the extraction model.
+    Lower the threshold to trade more model calls for better recall.
+    """
+
+    def __init__(self, threshold=0.5):
+        self.threshold = threshold
+        self.stats = {"checked": 0, "passed": 0, "skipped": 0}
+
+    def score(self, user_message):
+        """Probability-like score that the patient message carries memory"""
+        z = sum(WEIGHTS[name] * value for name, value in features(user_message).items())
+        return 1 / (1 + math.exp(-z))
+
+    def should_extract(self, user_message, response=None):
+        """Return True if the exchange should be sent to the extractor"""
+        passed = self.score(user_message) >= self.threshold
+        self.stats["checked"] += 1
+        self.stats["passed" if passed else "skipped"] += 1
+        return passed
+
+    @property
+    def calls_saved(self):
+        """Extraction model calls avoided, counting one call per exchange"""
+        return self.stats["skipped"]
+
+
+def has_memory(extracted_data):
+    """True if an extraction result holds anything that would change patient memory"""
+    return bool(
+        extracted_data.get("personal_info")
+        or extracted_data.get("memories")
+        or extracted_data.get("preferences")
+    )
+
+
+def evaluate(history, extract, threshold=0.5, batch_size=5):
+    """
+    Replay stored conversation history through the gate and the full extractor.
+
+    Recall is the share of exchanges the extractor found memory in that the
+    gate would also have let through.
+    """
+    gate = ExtractionGate(threshold)
+    decisions = [gate.should_extract(turn["patient"], turn["lumora"]) for turn in history]
+
+    informative = []
+    for start in range(0, len(history), batch_size):
+        batch = history[start:start + batch_size]
+        informative.extend(has_memory(result) for result in extract(batch))
+
+    relevant = sum(informative)
+    caught = sum(1 for passed, found in zip(decisions, informative) if passed and found)
+    missed = [
+        turn["patient"] for turn, passed, found in zip(history, decisions, informative)
+        if found and not passed
+    ]
+    return {
+        "exchanges": len(history),
+        "with_memory": relevant,
+        "passed": gate.stats["passed"],
+        "skipped": gate.stats["skipped"],
+        "recall": caught / relevant if relevant else 1.0,
+        "missed": missed,
+    }
+
+
+def stored_history(memory_file):
+    """Every turn stored for a patient: the archived days, then the inline history"""
+    from memory_store import MemoryStore
+    from retention import HistoryArchive
+
+    archive = HistoryArchive(os.path.splitext(memory_file)[0] + "_archive")
+    history = [turn for day in archive.days() for turn in archive.load_day(day)]
+    # read only; the store opens its journal for writing on the first change
+    store = MemoryStore(memory_file)
+    # turns archived just before a crash can still be inline too
+    archived = {(turn["timestamp"], turn["patient"]) for turn in history}
+    history.extend(turn for turn in store.state["conversation_history"]
+                   if (turn["timestamp"], turn["patient"]) not in archived)
+    return history
+
+
+def main():
+    """Offline evaluation: python prefilter.py [memory_file] [threshold]"""
+    memory_file = sys.argv[1] if len(sys.argv) > 1 else "patient_memory.json"
+    threshold = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+
+    history = stored_history(memory_file)
+
+    from dotenv import load_dotenv
+    from backends import GeminiBackend
+    from extraction import MemoryExtractor
+
+    load_dotenv()
+    backend = GeminiBackend(api_key=os.getenv("GEMINI_API_KEY"))
+
+    report = evaluate(history, MemoryExtractor(backend), threshold)
+    print(f"Exchanges replayed:     {report['exchanges']}")
+    print(f"Extractor found memory: {report['with_memory']}")
+    print(f"Gate passed / skipped:  {report['passed']} / {report['skipped']}")
+    print(f"Recall:                 {report['recall']:.1%}")
+    for message in report["missed"]:
+        print(f"  missed: {message}")
+
+
+if __name__ == "__main__":
+    main()
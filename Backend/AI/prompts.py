@@ -0,0 +1,90 @@
+from retrieval import estimate_tokens
+from time_index import resolve_time_window
+
+
+class PromptBuilder:
+    """
+    Assembles the per-turn prompt sent alongside Lumora's system instruction.
+
+    Each prompt holds the patient profile (personal info and preferences),
+    the memories relevant to the message, the exchanges from any time window
+    the message refers to, and the message itself. The rendered profile
+    sections are cached and each is re-rendered only when its section's
+    version in the memory store changes.
+    """
+
+    PROFILE_SECTIONS = (
+        ("personal_info", "Personal information"),
+        ("preferences", "Preferences"),
+    )
+
+    def __init__(self, store, index, time_index, profile_token_budget=150,
+                 context_token_budget=300, time_token_budget=400):
+        self.store = store
+        self.index = index
+        self.time_index = time_index
+        self.profile_token_budget = profile_token_budget
+        self.context_token_budget = context_token_budget
+        self.time_token_budget = time_token_budget
+
+        self._profile_cache = {}
+        self.last_turn = {}
+        self.stats = {"turns": 0, "prompt_tokens": 0, "profile_renders": 0}
+
+    def _section(self, section, title):
+        version = self.store.version(section)
+        cached = self._profile_cache.get(section)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        with self.store.lock:
+            items = list(self.store.state.get(section, {}).items())
+        lines = []
+        used = 0
+        for key, value in items:
+            line = f"- {key}: {value}"
+            used += estimate_tokens(line)
+            if used > self.profile_token_budget:
+                break
+            lines.append(line)
+        rendered = f"{title}:\n" + "\n".join(lines) + "\n" if lines else ""
+
+        self._profile_cache[section] = (version, rendered)
+        self.stats["profile_renders"] += 1
+        return rendered
+
+    def profile(self):
+        """What Lumora always knows about the patient, from cache when unchanged"""
+        return "".join(self._section(section, title) for section, title in self.PROFILE_SECTIONS)
+
+    def relevant(self, message):
+        """Memories and past exchanges relevant to this message, within the token budget"""
+        docs = self.index.select(
+            message, token_budget=self.context_token_budget, kinds=("memory", "turn")
+        )
+        if not docs:
+            return ""
+        lines = "\n".join(f"- {doc['text']}" for doc in docs)
+        return f"Things the patient has shared before that may be relevant:\n{lines}\n"
+
+    def build(self, message):
+        """The prompt for one patient message; token counts land in ``last_turn``"""
+        parts = {
+            "profile": self.profile(),
+            "relevant": self.relevant(message),
+            "time": "",
+            "message": f"Patient: {message}",
+        }
+
+        # "What did I do yesterday?" pulls in just that window's exchanges
+        window = resolve_time_window(message)
+        if window:
+            parts["time"] = self.time_index.context(*window, token_budget=self.time_token_budget)
+
+        prompt = "\n".join(part for part in parts.values() if part)
+
+        self.last_turn = {name: estimate_tokens(part) if part else 0 for name, part in parts.items()}
+        self.last_turn["total"] = estimate_tokens(prompt)
+        self.stats["turns"] += 1
+        self.stats["prompt_tokens"] += self.last_turn["total"]
+        return prompt
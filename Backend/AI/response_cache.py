@@ -0,0 +1,141 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+
+
+CONTRACTIONS = [
+    (re.compile(r"\b(what|where|who|when|how|it|that|there|here|he|she)'s\b"), r"\1 is"),
+    (re.compile(r"\bcan't\b"), "cannot"),
+    (re.compile(r"n't\b"), " not"),
+    (re.compile(r"'m\b"), " am"),
+    (re.compile(r"'re\b"), " are"),
+    (re.compile(r"'ll\b"), " will"),
+    (re.compile(r"'ve\b"), " have"),
+    (re.compile(r"'d\b"), " would"),
+]
+
+
+def normalize(message):
+    """Lowercase, expand contractions and drop punctuation, so trivial rephrasings share a key"""
+    text = message.lower().replace("\u2019", "'")
+    for pattern, replacement in CONTRACTIONS:
+        text = pattern.sub(replacement, text)
+    # what's left is possessive: "daughter's" and "daughters" match
+    return " ".join(re.findall(r"[a-z0-9]+", text.replace("'", "")))
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    """Jaccard similarity of two trigram sets"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ResponseCache:
+    """
+    Per-patient cache of Lumora's replies to repeated messages.
+
+    Entries are keyed on the normalized message and stamped with a version of
+    the patient's memory; a lookup with a different version misses, so a
+    reply never outlives the facts it was written from. A message without an
+    exact match can still hit an entry whose trigram similarity reaches
+    ``near_threshold``. Entries expire after ``ttl`` seconds and the least
+    recently used go first beyond ``max_entries``.
+
+    Up to ``variants`` replies are collected per entry: until an entry has
+    that many, ``get`` misses so the model writes another, and after that hits
+    rotate through them so the patient doesn't hear the same words every time.
+    """
+
+    def __init__(self, max_entries=256, ttl=3600.0, near_threshold=0.8, variants=2):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.near_threshold = near_threshold
+        self.variants = variants
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "near_hits": 0, "misses": 0, "stores": 0, "expired": 0, "evictions": 0}
+
+    @property
+    def hit_rate(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _live(self, key, entry, version, now):
+        if now - entry["stored"] > self.ttl or entry["version"] != version:
+            del self._entries[key]
+            self.stats["expired"] += 1
+            return False
+        return True
+
+    def _find(self, key, version, now):
+        entry = self._entries.get(key)
+        if entry is not None and self._live(key, entry, version, now):
+            return key, entry, False
+        if self.near_threshold is None or not key:
+            return None, None, False
+
+        grams = trigrams(key)
+        best, best_score = None, self.near_threshold
+        for other, candidate in list(self._entries.items()):
+            if not self._live(other, candidate, version, now):
+                continue
+            score = similarity(grams, candidate["trigrams"])
+            if score >= best_score:
+                best, best_score = other, score
+        if best is None:
+            return None, None, False
+        return best, self._entries[best], True
+
+    def get(self, message, version, now=None):
+        """A cached reply for ``message`` under memory ``version``, or None"""
+        now = time.time() if now is None else now
+        with self._lock:
+            key, entry, near = self._find(normalize(message), version, now)
+            if entry is None or len(entry["replies"]) < self.variants:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            reply = entry["replies"][entry["next"] % len(entry["replies"])]
+            entry["next"] += 1
+            self.stats["hits"] += 1
+            if near:
+                self.stats["near_hits"] += 1
+            return reply
+
+    def put(self, message, version, reply, now=None):
+        """Remember ``reply`` as one of the answers to ``message`` under memory ``version``"""
+        now = time.time() if now is None else now
+        with self._lock:
+            key, entry, _ = self._find(normalize(message), version, now)
+            if entry is None:
+                key = normalize(message)
+                if not key:
+                    return
+                entry = self._entries[key] = {
+                    "version": version,
+                    "stored": now,
+                    "trigrams": trigrams(key),
+                    "replies": [],
+                    "next": 0,
+                }
+            if reply not in entry["replies"] and len(entry["replies"]) < self.variants:
+                entry["replies"].append(reply)
+                self.stats["stores"] += 1
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
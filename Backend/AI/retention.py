@@ -0,0 +1,208 @@
+import os
+import gzip
+import json
+import shutil
+import datetime
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def turn_day(turn):
+    """The "YYYY-MM-DD" day a conversation turn belongs to"""
+    return turn["timestamp"][:10]
+
+
+def digest(turns, limit=400):
+    """Local summary of a run of turns: what the patient said, shortened to ``limit`` characters"""
+    said = "; ".join(turn["patient"].strip() for turn in turns if turn["patient"].strip())
+    return said if len(said) <= limit else said[:limit - 3].rstrip() + "..."
+
+
+class HistoryArchive:
+    """
+    Archived conversation turns in gzip-compressed, day-partitioned JSON-lines segments.
+
+    Each day lives in ``<directory>/YYYY-MM-DD.jsonl.gz``. New turns are added
+    as an extra gzip member at the end of the segment, so archiving never
+    rewrites old data. Segments are only read when recall asks for that day,
+    and the most recently used ones are kept decoded in a small cache.
+    """
+
+    def __init__(self, directory, cache_days=14):
+        self.directory = directory
+        self.cache_days = cache_days
+        self._cache = OrderedDict()
+        self._days = None
+
+    def _segment(self, day):
+        return os.path.join(self.directory, f"{day}.jsonl.gz")
+
+    def write(self, turns):
+        """Append turns to their day segments"""
+        by_day = OrderedDict()
+        for turn in turns:
+            by_day.setdefault(turn_day(turn), []).append(turn)
+
+        days = self.days()
+        os.makedirs(self.directory, exist_ok=True)
+        for day, day_turns in by_day.items():
+            with gzip.open(self._segment(day), 'at', encoding='utf-8') as f:
+                f.writelines(json.dumps(turn) + "\n" for turn in day_turns)
+                f.flush()
+            self._cache.pop(day, None)
+            # usually a new latest day; keep the list sorted either way
+            if not days or days[-1] < day:
+                days.append(day)
+            elif days[bisect_left(days, day)] != day:
+                insort(days, day)
+
+    def days(self):
+        """Sorted list of days that have archived turns (listed from disk once)"""
+        if self._days is None:
+            try:
+                names = os.listdir(self.directory)
+            except FileNotFoundError:
+                names = []
+            self._days = sorted(name[:10] for name in names if name.endswith(".jsonl.gz"))
+        return self._days
+
+    def load_day(self, day):
+        """All archived turns of one day, oldest first"""
+        if day in self._cache:
+            self._cache.move_to_end(day)
+            return self._cache[day]
+
+        turns = []
+        seen = set()
+        try:
+            with gzip.open(self._segment(day), 'rt', encoding='utf-8') as f:
+                for line in f:
+                    turn = json.loads(line)
+                    # a crash between archiving and trimming history archives
+                    # the same turns twice; keep the first copy
+                    key = (turn["timestamp"], turn["patient"])
+                    if key not in seen:
+                        seen.add(key)
+                        turns.append(turn)
+        except FileNotFoundError:
+            pass
+        except (EOFError, gzip.BadGzipFile):
+            # the last gzip member was cut short by a crash; keep what was read
+            pass
+
+        self._cache[day] = turns
+        if len(self._cache) > self.cache_days:
+            self._cache.popitem(last=False)
+        return turns
+
+    def clear(self):
+        """Delete every archived day, e.g. when the patient's memory is reset"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self._cache.clear()
+        self._days = None
+
+class HistoryRetention:
+    """
+    Keeps the inline conversation history bounded.
+
+    Only the last ``max_turns`` turns, and none older than ``max_days``, stay in
+    ``conversation_history``. Older turns are moved to the archive in chunks
+    of at least ``archive_batch`` (so it doesn't happen on every turn) and
+    folded into per-day entries in ``conversation_summaries``. Day summaries of
+    past months are folded again into one entry per month once there are more
+    than ``max_day_summaries`` of them.
+    """
+
+    def __init__(self, store, archive, max_turns=200, max_days=30, archive_batch=50,
+                 max_day_summaries=62, summarize=digest):
+        self.store = store
+        self.archive = archive
+        self.max_turns = max_turns
+        self.max_days = max_days
+        self.archive_batch = archive_batch
+        self.max_day_summaries = max_day_summaries
+        self.summarize = summarize
+
+    def _expired(self, history, now):
+        """Number of leading turns that fall outside the retention window"""
+        count = max(0, len(history) - self.max_turns)
+        if self.max_days is not None:
+            cutoff = (now - datetime.timedelta(days=self.max_days)).strftime(TIMESTAMP_FORMAT)
+            while count < len(history) and history[count]["timestamp"] < cutoff:
+                count += 1
+        return count
+
+    def enforce(self, now=None, force=False):
+        """Archive and summarize turns outside the retention window; returns how many moved"""
+        now = now or datetime.datetime.now()
+        with self.store.lock:
+            history = self.store.state["conversation_history"]
+            count = self._expired(history, now)
+            if count == 0 or (count < self.archive_batch and not force):
+                return 0
+            old_turns = history[:count]
+
+        # archive first: if we crash before trimming, the turns are still inline
+        self.archive.write(old_turns)
+
+        with self.store.lock:
+            summaries = self.store.state.setdefault("conversation_summaries", {})
+            by_day = OrderedDict()
+            for turn in old_turns:
+                by_day.setdefault(turn_day(turn), []).append(turn)
+            for day, turns in by_day.items():
+                self.store.set(("conversation_summaries", day), self._merge(summaries.get(day), turns))
+
+            self.store.trim(("conversation_history",), count)
+            self._fold_months(now)
+        return count
+
+    def _merge(self, existing, turns):
+        summary = self.summarize(turns)
+        if existing:
+            return {
+                "turns": existing["turns"] + len(turns),
+                "first": existing["first"],
+                "last": turns[-1]["timestamp"],
+                "summary": self.summarize([{"patient": existing["summary"]}, {"patient": summary}]),
+            }
+        return {
+            "turns": len(turns),
+            "first": turns[0]["timestamp"],
+            "last": turns[-1]["timestamp"],
+            "summary": summary,
+        }
+
+    def _fold_months(self, now):
+        summaries = self.store.state["conversation_summaries"]
+        days = sorted(period for period in summaries if len(period) == 10)
+        if len(days) <= self.max_day_summaries:
+            return
+
+        current_month = now.strftime("%Y-%m")
+        by_month = OrderedDict()
+        for day in days:
+            if day[:7] != current_month:
+                by_month.setdefault(day[:7], []).append(day)
+
+        for month, month_days in by_month.items():
+            entry = summaries.get(month)
+            for day in month_days:
+                day_entry = summaries[day]
+                if entry is None:
+                    entry = dict(day_entry)
+                else:
+                    entry = {
+                        "turns": entry["turns"] + day_entry["turns"],
+                        "first": min(entry["first"], day_entry["first"]),
+                        "last": max(entry["last"], day_entry["last"]),
+                        "summary": self.summarize(
+                            [{"patient": entry["summary"]}, {"patient": day_entry["summary"]}]
+                        ),
+                    }
+            self.store.set(("conversation_summaries", month), entry)
+            for day in month_days:
+                self.store.delete(("conversation_summaries", day))
@@ -0,0 +1,211 @@
+import os
+import re
+import json
+import math
+import threading
+from collections import Counter, OrderedDict
+
+
+WORD_RE = re.compile(r"[a-z0-9']+")
+
+STOP_WORDS = {
+    "a", "an", "the", "and", "or", "but", "if", "of", "to", "in", "on", "at", "for",
+    "with", "by", "from", "is", "am", "are", "was", "were", "be", "been", "it", "its",
+    "this", "that", "these", "those", "do", "did", "does", "so", "as", "me", "my",
+    "i", "you", "your", "we", "our", "he", "she", "they", "them", "his", "her",
+    "what", "who", "how", "can", "could", "would", "will", "just", "about", "there",
+}
+
+
+def tokenize(text):
+    """Lowercased content words with a light plural strip, e.g. "Roses" -> "rose" """
+    terms = []
+    for word in WORD_RE.findall(text.lower()):
+        word = word.strip("'")
+        if not word or word in STOP_WORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+def estimate_tokens(text):
+    """Rough model token count (about four characters per token)"""
+    return max(1, len(text) // 4)
+
+
+class MemoryIndex:
+    """
+    BM25 index over patient memories and past exchanges, updated one document at a time.
+
+    Changes are appended to ``index_file`` as JSON lines holding each
+    document's term counts, so loading never re-tokenizes and adding a memory
+    never rebuilds the index. The file is rewritten only once superseded
+    records outnumber live ones. Only the most recent ``max_turns`` exchanges
+    stay indexed so the index stays bounded along with inline history.
+    """
+
+    def __init__(self, index_file=None, k1=1.5, b=0.75, max_turns=2000):
+        self.index_file = index_file
+        self.k1 = k1
+        self.b = b
+        self.max_turns = max_turns
+
+        self._lock = threading.RLock()
+        self.docs = {}
+        self.postings = {}
+        self.total_length = 0
+        self._turns = OrderedDict()
+        self._records = 0
+        self._file = None
+
+        if index_file:
+            self._load()
+
+    # ------------------------------------------------------------------ updates
+
+    def add(self, doc_id, text, kind):
+        """Index (or re-index) one document; ``kind`` is e.g. "memory" or "turn" """
+        terms = Counter(tokenize(text))
+        with self._lock:
+            self._add(doc_id, text, kind, dict(terms))
+            self._persist({"op": "add", "id": doc_id, "kind": kind, "text": text, "terms": terms})
+            if kind == "turn":
+                self._turns[doc_id] = None
+                while len(self._turns) > self.max_turns:
+                    self.remove(next(iter(self._turns)))
+
+    def remove(self, doc_id):
+        """Drop a document from the index"""
+        with self._lock:
+            if self._remove(doc_id):
+                self._persist({"op": "remove", "id": doc_id})
+
+    def clear(self):
+        """Empty the index, e.g. when patient memory is reset"""
+        with self._lock:
+            self.docs.clear()
+            self.postings.clear()
+            self._turns.clear()
+            self.total_length = 0
+            if self.index_file:
+                self._rewrite()
+
+    def _add(self, doc_id, text, kind, terms):
+        self._remove(doc_id)
+        length = sum(terms.values())
+        self.docs[doc_id] = {"text": text, "kind": kind, "length": length, "terms": terms}
+        self.total_length += length
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+
+    def _remove(self, doc_id):
+        doc = self.docs.pop(doc_id, None)
+        if doc is None:
+            return False
+        self.total_length -= doc["length"]
+        self._turns.pop(doc_id, None)
+        for term in doc["terms"]:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.postings[term]
+        return True
+
+    # ---------------------------------------------------------------- searching
+
+    def search(self, query, k=8, kinds=None):
+        """Top ``k`` documents for ``query`` as (score, doc_id, doc), best first"""
+        with self._lock:
+            n = len(self.docs)
+            if n == 0:
+                return []
+            avg_length = self.total_length / n or 1
+
+            scores = {}
+            for term in set(tokenize(query)):
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                for doc_id, tf in posting.items():
+                    doc = self.docs[doc_id]
+                    if kinds is not None and doc["kind"] not in kinds:
+                        continue
+                    length = doc["length"]
+                    norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+
+            best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            return [(score, doc_id, self.docs[doc_id]) for doc_id, score in best]
+
+    def select(self, query, token_budget=300, k=8, kinds=None):
+        """The best matching documents whose text fits within ``token_budget`` tokens"""
+        selected = []
+        used = 0
+        for _, doc_id, doc in self.search(query, k, kinds):
+            cost = estimate_tokens(doc["text"])
+            if used + cost > token_budget:
+                continue
+            selected.append(doc)
+            used += cost
+        return selected
+
+    # -------------------------------------------------------------- persistence
+
+    def _load(self):
+        try:
+            with open(self.index_file, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # torn last record from a crash; the document is re-added later
+                        break
+                    self._records += 1
+                    if record["op"] == "add":
+                        self._add(record["id"], record["text"], record["kind"], record["terms"])
+                        if record["kind"] == "turn":
+                            self._turns[record["id"]] = None
+                    else:
+                        self._remove(record["id"])
+        except FileNotFoundError:
+            return
+
+        if self._records > 2 * max(len(self.docs), 100):
+            self._rewrite()
+
+    def _persist(self, record):
+        if not self.index_file:
+            return
+        if self._file is None:
+            self._file = open(self.index_file, 'a')
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        self._records += 1
+        if self._records > 2 * max(len(self.docs), 100):
+            self._rewrite()
+
+    def _rewrite(self):
+        """Replace the index file with one add record per live document"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file, 'w') as f:
+            for doc_id, doc in self.docs.items():
+                f.write(json.dumps({
+                    "op": "add", "id": doc_id, "kind": doc["kind"],
+                    "text": doc["text"], "terms": doc["terms"]
+                }) + "\n")
+        os.replace(tmp_file, self.index_file)
+        self._records = len(self.docs)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,48 @@
+QUOTES = ("\"", "'")
+
+
+def unescape_quotes(text):
+    """Ensure no residual escaped quotation marks remain"""
+    return text.replace('\\"', '"').replace("\\'", "'")
+
+
+def strip_quotes(text):
+    """Remove quotation marks the model sometimes wraps its whole reply in"""
+    while text.startswith(QUOTES) and text.endswith(QUOTES):
+        text = text[1:-1].strip()
+    return unescape_quotes(text)
+
+
+class QuoteStripper:
+    """
+    Applies strip_quotes to a reply that arrives in chunks, with the same result.
+
+    Most replies don't start with a quote, so strip_quotes leaves them as they
+    are apart from escaped quotes; those stream through, holding back only
+    trailing backslashes until we see what they escape. A reply that does
+    start with a quote is held back whole: only its end tells whether the
+    quote wraps the reply ("Hi there") or opens a line in it ("Hi," she said.).
+    """
+
+    def __init__(self):
+        self._quoted = None
+        self._held = ""
+
+    def feed(self, chunk):
+        """Take the next chunk and return the text that is safe to show now"""
+        text = self._held + chunk
+        if self._quoted is None and text:
+            self._quoted = text.startswith(QUOTES)
+        if self._quoted is not False:
+            self._held = text
+            return ""
+
+        keep = len(text.rstrip("\\"))
+        self._held = text[keep:]
+        return unescape_quotes(text[:keep])
+
+    def finish(self):
+        """Return whatever was held back once the reply is complete"""
+        text = self._held
+        self._held = ""
+        return strip_quotes(text) if self._quoted else text
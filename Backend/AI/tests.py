@@ -0,0 +1,645 @@
+"""
+Unit tests for the assistant's building blocks; run from this directory with
+``python -m unittest tests``. Nothing here calls a real model.
+"""
+import os
+import json
+import time
+import asyncio
+import datetime
+import shutil
+import tempfile
+import threading
+import unittest
+
+from backends import ModelBackend, RecordingBackend, ReplayBackend, SimulatedBackend, SimulatedResponse
+from extraction import ExtractionPipeline, parse_extraction
+from memory_store import MemoryStore
+from metrics import Registry
+from model_calls import CircuitBreaker, CircuitOpenError, ModelCallError, ModelCaller, shared_caller
+from prefilter import ExtractionGate, evaluate, stored_history
+from prompts import PromptBuilder
+from response_cache import ResponseCache, normalize as normalize_message
+from retention import HistoryArchive, HistoryRetention
+from retrieval import MemoryIndex, tokenize
+from streaming import QuoteStripper, strip_quotes
+from time_index import TimeIndex, resolve_time_window
+
+
+class TempDirTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+
+class MemoryStoreTests(TempDirTestCase):
+    def _store(self, **kwargs):
+        store = MemoryStore(self.path("memory.json"), **kwargs)
+        self.addCleanup(store.close)
+        return store
+
+    def test_journal_replays_without_a_snapshot(self):
+        store = self._store()
+        store.set(("personal_info", "name"), "Rose")
+        store.append(("important_memories",), "Grew up on a farm")
+        store.incr(("topics_discussed", "farm"), 2)
+
+        state = MemoryStore(self.path("memory.json")).state
+        self.assertEqual(state["personal_info"], {"name": "Rose"})
+        self.assertEqual(state["important_memories"], ["Grew up on a farm"])
+        self.assertEqual(state["topics_discussed"], {"farm": 2})
+
+    def test_torn_last_line_is_truncated(self):
+        store = self._store()
+        store.set(("personal_info", "name"), "Rose")
+        store.flush()
+        with open(store.journal_file, "a") as f:
+            f.write('{"op": "set", "path": ["personal_info", "age"], "va')
+
+        reopened = MemoryStore(self.path("memory.json"))
+        self.assertEqual(reopened.state["personal_info"], {"name": "Rose"})
+        with open(store.journal_file) as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+    def test_bad_line_in_the_middle_is_skipped(self):
+        store = self._store()
+        store.set(("personal_info", "name"), "Rose")
+        store.flush()
+        with open(store.journal_file, "a") as f:
+            f.write("not json\n")
+        store.set(("personal_info", "age"), 82)
+        store.flush()
+
+        reopened = MemoryStore(self.path("memory.json"))
+        self.assertEqual(reopened.state["personal_info"], {"name": "Rose", "age": 82})
+
+    def test_corrupt_snapshot_is_kept_aside(self):
+        with open(self.path("memory.json"), "w") as f:
+            f.write("{ not json")
+        store = self._store()
+        self.assertEqual(store.state["personal_info"], {})
+        self.assertTrue(any(name.startswith("memory.json.corrupt-") for name in os.listdir(self.dir)))
+
+    def test_records_in_the_snapshot_are_not_replayed(self):
+        store = self._store()
+        store.incr(("topics_discussed", "garden"))
+        store.flush()
+        with open(store.journal_file) as f:
+            journal = f.read()
+        store.compact()
+        store.incr(("topics_discussed", "garden"))
+        store.flush()
+        # as if a crash had come between writing the snapshot and trimming the journal
+        with open(store.journal_file) as f:
+            tail = f.read()
+        with open(store.journal_file, "w") as f:
+            f.write(journal + tail)
+
+        state = MemoryStore(self.path("memory.json")).state
+        self.assertEqual(state["topics_discussed"], {"garden": 2})
+        with open(self.path("memory.json")) as f:
+            self.assertEqual(json.load(f)["_seq"], 1)
+
+
+class ExtractionPipelineTests(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+        self.applied = []
+
+    def _pipeline(self, extract=None, **kwargs):
+        def record(exchanges):
+            self.batches.append([exchange["patient"] for exchange in exchanges])
+            return [{"topics": [exchange["patient"]]} for exchange in exchanges]
+
+        pipeline = ExtractionPipeline(extract or record, self.applied.append, **kwargs)
+        self.addCleanup(pipeline.close)
+        return pipeline
+
+    def test_flush_extracts_in_batches(self):
+        pipeline = self._pipeline(batch_size=2, flush_interval=60)
+        for message in ("one", "two", "three"):
+            pipeline.submit(message, "reply")
+        self.assertTrue(pipeline.flush(timeout=5))
+
+        self.assertEqual(sorted(sum(self.batches, [])), ["one", "three", "two"])
+        self.assertTrue(all(len(batch) <= 2 for batch in self.batches))
+        self.assertEqual([result["topics"] for result in self.applied], [["one"], ["two"], ["three"]])
+        self.assertEqual(pipeline.queue_depth, 0)
+
+    def test_close_flushes_and_refuses_more(self):
+        pipeline = self._pipeline(batch_size=10, flush_interval=60)
+        pipeline.submit("one", "reply")
+        pipeline.close(timeout=5)
+
+        self.assertEqual(self.batches, [["one"]])
+        self.assertFalse(pipeline._worker.is_alive())
+        with self.assertRaises(RuntimeError):
+            pipeline.submit("two", "reply")
+
+    def test_a_failed_batch_does_not_stop_the_worker(self):
+        calls = []
+
+        def extract(exchanges):
+            calls.append(len(exchanges))
+            if len(calls) == 1:
+                raise ValueError("model down")
+            return [{} for _ in exchanges]
+
+        pipeline = self._pipeline(extract, batch_size=1)
+        pipeline.submit("one", "reply")
+        pipeline.submit("two", "reply")
+        self.assertTrue(pipeline.flush(timeout=5))
+        self.assertEqual(pipeline.stats["failed_batches"], 1)
+        self.assertEqual(pipeline.stats["extracted"], 1)
+
+    def test_flush_times_out_on_a_stuck_batch(self):
+        release = threading.Event()
+
+        def extract(exchanges):
+            release.wait(5)
+            return [{} for _ in exchanges]
+
+        pipeline = self._pipeline(extract)
+        pipeline.submit("one", "reply")
+        self.assertFalse(pipeline.flush(timeout=0.05))
+        release.set()
+        self.assertTrue(pipeline.flush(timeout=5))
+
+    def test_cleanup_runs_on_the_worker_after_each_batch(self):
+        threads = []
+        pipeline = self._pipeline(batch_size=1, cleanup=lambda: threads.append(threading.current_thread()))
+        pipeline.submit("one", "reply")
+        pipeline.submit("two", "reply")
+        self.assertTrue(pipeline.flush(timeout=5))
+        self.assertEqual(threads, [pipeline._worker] * 2)
+        pipeline.close(timeout=5)
+        self.assertEqual(threads, [pipeline._worker] * 3)
+
+    def test_parse_tolerates_code_fences(self):
+        self.assertEqual(parse_extraction('```json\n[{"topics": ["garden"]}]\n```'), [{"topics": ["garden"]}])
+
+
+def turn(day, patient, lumora="That sounds lovely."):
+    return {"timestamp": f"{day} 10:00:00", "patient": patient, "lumora": lumora}
+
+
+class PrefilterTests(TempDirTestCase):
+    def test_small_talk_is_skipped(self):
+        gate = ExtractionGate()
+        for message in ("Hello Lumora", "I'm fine, thanks", "ok", "Good morning, how are you?"):
+            self.assertFalse(gate.should_extract(message), message)
+        for message in ("My daughter Anna visits on Sundays", "I used to work at the mill",
+                        "I love roses", "We married in 1962"):
+            self.assertTrue(gate.should_extract(message), message)
+        self.assertEqual(gate.stats, {"checked": 8, "passed": 4, "skipped": 4})
+        self.assertEqual(gate.calls_saved, 4)
+
+    def test_evaluate_reports_missed_memories(self):
+        history = [turn("2024-03-01", "Hello"), turn("2024-03-01", "My son is called Tom"),
+                   turn("2024-03-01", "ok")]
+        # the extractor finds something in the first two
+        found = {"Hello": {"personal_info": {"greeting": "hello"}},
+                 "My son is called Tom": {"personal_info": {"son": "Tom"}}}
+        report = evaluate(history, lambda batch: [found.get(t["patient"], {}) for t in batch])
+        self.assertEqual((report["with_memory"], report["passed"], report["skipped"]), (2, 1, 2))
+        self.assertEqual(report["recall"], 0.5)
+        self.assertEqual(report["missed"], ["Hello"])
+
+    def test_stored_history_includes_archived_turns(self):
+        memory_file = self.path("patient_memory.json")
+        archive = HistoryArchive(self.path("patient_memory_archive"))
+        archive.write([turn("2024-03-01", "Old"), turn("2024-03-02", "Both")])
+        store = MemoryStore(memory_file)
+        store.append(("conversation_history",), turn("2024-03-02", "Both"))
+        store.append(("conversation_history",), turn("2024-03-03", "New"))
+        store.close()
+
+        self.assertEqual([t["patient"] for t in stored_history(memory_file)], ["Old", "Both", "New"])
+
+
+class RetentionTests(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = MemoryStore(self.path("memory.json"))
+        self.addCleanup(self.store.close)
+        self.archive = HistoryArchive(self.path("archive"))
+
+    def _add_days(self, start, days, per_day=2):
+        for offset in range(days):
+            day = (start + datetime.timedelta(days=offset)).isoformat()
+            for i in range(per_day):
+                self.store.append(("conversation_history",), turn(day, f"{day} #{i}"))
+
+    def test_old_turns_roll_over_to_the_archive(self):
+        self._add_days(datetime.date(2024, 3, 1), 5)
+        retention = HistoryRetention(self.store, self.archive, max_turns=4, max_days=None, archive_batch=4)
+        self.assertEqual(retention.enforce(now=datetime.datetime(2024, 3, 5, 12)), 6)
+
+        history = self.store.state["conversation_history"]
+        self.assertEqual([t["patient"] for t in history][0], "2024-03-04 #0")
+        self.assertEqual(self.archive.days(), ["2024-03-01", "2024-03-02", "2024-03-03"])
+        self.assertEqual([t["patient"] for t in self.archive.load_day("2024-03-02")],
+                         ["2024-03-02 #0", "2024-03-02 #1"])
+        self.assertEqual(self.store.state["conversation_summaries"]["2024-03-03"]["turns"], 2)
+        # another process sees the same segments
+        self.assertEqual(HistoryArchive(self.path("archive")).days(), self.archive.days())
+
+    def test_small_overflows_wait_for_a_batch(self):
+        self._add_days(datetime.date(2024, 3, 1), 3)
+        retention = HistoryRetention(self.store, self.archive, max_turns=4, max_days=None, archive_batch=50)
+        self.assertEqual(retention.enforce(now=datetime.datetime(2024, 3, 3, 12)), 0)
+        self.assertEqual(retention.enforce(now=datetime.datetime(2024, 3, 3, 12), force=True), 2)
+
+    def test_day_summaries_fold_into_months(self):
+        self._add_days(datetime.date(2024, 1, 30), 5, per_day=1)
+        retention = HistoryRetention(self.store, self.archive, max_turns=0, max_days=None, archive_batch=1,
+                                     max_day_summaries=2)
+        retention.enforce(now=datetime.datetime(2024, 2, 3, 12))
+
+        summaries = self.store.state["conversation_summaries"]
+        self.assertEqual(sorted(summaries), ["2024-01", "2024-02-01", "2024-02-02", "2024-02-03"])
+        self.assertEqual(summaries["2024-01"]["turns"], 2)
+        self.assertEqual(summaries["2024-01"]["first"], "2024-01-30 10:00:00")
+
+    def test_a_segment_cut_short_keeps_what_was_read(self):
+        self.archive.write([turn("2024-03-01", "First")])
+        segment = self.archive._segment("2024-03-01")
+        first_member = os.path.getsize(segment)
+        self.archive.write([turn("2024-03-01", "Second")])
+        # a crash halfway through appending the second gzip member
+        with open(segment, "r+b") as f:
+            f.truncate(first_member + 12)
+
+        turns = HistoryArchive(self.path("archive")).load_day("2024-03-01")
+        self.assertEqual([t["patient"] for t in turns], ["First"])
+
+
+class MemoryIndexTests(TempDirTestCase):
+    def _index(self, **kwargs):
+        index = MemoryIndex(self.path("memory.index"), **kwargs)
+        self.addCleanup(index.close)
+        return index
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize("What about my Roses and the garden?"), ["rose", "garden"])
+
+    def test_ranks_relevant_documents_first(self):
+        index = self._index()
+        index.add("memory:1", "Grew roses in the garden behind the farmhouse", "memory")
+        index.add("memory:2", "Worked as a nurse at the county hospital", "memory")
+        index.add("preferences:food", "Preference - food: apple pie", "preferences")
+
+        results = index.search("Tell me about your roses")
+        self.assertEqual([doc_id for _, doc_id, _ in results], ["memory:1"])
+        self.assertEqual(index.search("hospital nurse", kinds={"preferences"}), [])
+        self.assertEqual([doc["text"] for doc in index.select("roses garden nurse", token_budget=12)],
+                         ["Grew roses in the garden behind the farmhouse"])
+
+    def test_readds_replace_and_the_file_reloads(self):
+        index = self._index()
+        index.add("personal_info:pet", "pet: a dog called Rex", "personal_info")
+        index.add("personal_info:pet", "pet: a cat called Tibbles", "personal_info")
+        index.add("memory:1", "Went fishing with grandpa", "memory")
+        index.remove("memory:1")
+        index.close()
+
+        reloaded = self._index()
+        self.assertEqual(list(reloaded.docs), ["personal_info:pet"])
+        self.assertEqual(reloaded.search("dog"), [])
+        self.assertEqual(reloaded.search("cat")[0][1], "personal_info:pet")
+
+    def test_only_recent_turns_stay_indexed(self):
+        index = self._index(max_turns=3)
+        for i in range(5):
+            index.add(f"turn:{i}", f"On day {i} the patient talked about boats", "turn")
+        self.assertEqual(sorted(index.docs), ["turn:2", "turn:3", "turn:4"])
+        self.assertEqual(len(index.search("boats")), 3)
+
+
+class TimeIndexTests(TempDirTestCase):
+    # a Wednesday
+    NOW = datetime.datetime(2024, 3, 13, 15)
+
+    def test_resolve_time_window(self):
+        day = datetime.date
+        for text, window in [
+            ("What did I do yesterday?", (day(2024, 3, 12), day(2024, 3, 12))),
+            ("Who came to see me three days ago?", (day(2024, 3, 10), day(2024, 3, 10))),
+            ("What did we talk about last week", (day(2024, 3, 4), day(2024, 3, 10))),
+            ("last month was nice", (day(2024, 2, 1), day(2024, 2, 29))),
+            ("on Monday", (day(2024, 3, 11), day(2024, 3, 11))),
+            ("last Wednesday", (day(2024, 3, 6), day(2024, 3, 6))),
+            ("What happened on 2024-01-05?", (day(2024, 1, 5), day(2024, 1, 5))),
+        ]:
+            self.assertEqual(resolve_time_window(text, self.NOW), window, text)
+        self.assertIsNone(resolve_time_window("Tell me about roses", self.NOW))
+
+    def test_turns_between_reads_archive_and_inline_history(self):
+        store = MemoryStore(self.path("memory.json"))
+        self.addCleanup(store.close)
+        archive = HistoryArchive(self.path("archive"))
+        archive.write([turn("2024-03-01", "Archived"), turn("2024-03-02", "Both")])
+        for t in (turn("2024-03-02", "Both"), turn("2024-03-03", "Inline"), turn("2024-03-05", "Later")):
+            store.append(("conversation_history",), t)
+        store.set(("conversation_summaries", "2024-02"), {"turns": 9, "first": "", "last": "", "summary": "Snow"})
+        index = TimeIndex(store, archive)
+
+        self.assertEqual([t["patient"] for t in index.turns_between("2024-03-01", "2024-03-03")],
+                         ["Archived", "Both", "Inline"])
+        self.assertEqual(index.turns_between(datetime.date(2024, 3, 4), datetime.date(2024, 3, 4)), [])
+        self.assertIn("Snow", index.context("2024-02-10", "2024-02-11"))
+        self.assertIn("no record", index.context("2023-01-01", "2023-01-02"))
+
+
+class ResetTests(TempDirTestCase):
+    def test_reset_forgets_archived_turns(self):
+        from chat import LumoraAssistant
+
+        lumora = LumoraAssistant(memory_file=self.path("patient_memory.json"),
+                                 backend=SimulatedBackend(chunk_latency=0, upstream="tests/reset"))
+        self.addCleanup(lumora.close)
+        lumora.retention.max_turns, lumora.retention.archive_batch = 3, 1
+        for i in range(8):
+            lumora.send_message(f"Message number {i}")
+        today = datetime.date.today()
+        self.assertEqual(lumora.retention.archive.days(), [today.isoformat()])
+        self.assertEqual(len(lumora.time_index.turns_between(today, today)), 8)
+
+        lumora.reset_memory()
+        self.assertEqual(lumora.retention.archive.days(), [])
+        self.assertEqual(lumora.time_index.turns_between(today, today), [])
+        self.assertEqual(HistoryArchive(self.path("patient_memory_archive")).days(), [])
+        self.assertEqual(stored_history(self.path("patient_memory.json")), [])
+
+
+class PromptBuilderTests(TempDirTestCase):
+    def test_profile_is_rendered_again_only_when_it_changes(self):
+        store = MemoryStore(self.path("memory.json"))
+        self.addCleanup(store.close)
+        store.set(("personal_info", "name"), "Margaret")
+        prompts = PromptBuilder(store, MemoryIndex(), TimeIndex(store, HistoryArchive(self.path("archive"))))
+
+        first = prompts.build("Hello")
+        self.assertEqual(prompts.build("Hello"), first)
+        # one render per profile section, then cache hits
+        self.assertEqual(prompts.stats["profile_renders"], 2)
+
+        store.incr(("topics_discussed", "garden"))
+        prompts.build("Hello")
+        self.assertEqual(prompts.stats["profile_renders"], 2)
+
+        store.set(("personal_info", "name"), "Maggie")
+        self.assertIn("- name: Maggie", prompts.build("Hello"))
+        self.assertEqual(prompts.stats["profile_renders"], 3)
+
+
+class BackendTests(TempDirTestCase):
+    def test_a_backend_missing_a_method_cannot_be_made(self):
+        class ChatOnly(ModelBackend):
+            def start_chat(self, system_instruction=None, history=None):
+                return None
+
+        with self.assertRaises(TypeError):
+            ChatOnly()
+
+    def test_recorded_replies_replay(self):
+        transcript = self.path("transcript.jsonl")
+        recorder = RecordingBackend(SimulatedBackend(upstream="tests/record"), transcript)
+        chat = recorder.start_chat("Be kind")
+        said = [chat.send_message("Hello").text,
+                "".join(chunk.text for chunk in chat.send_message("Tell me a story", stream=True))]
+        extracted = recorder.generate("Patient: I love roses", json_output=True).text
+
+        replay = ReplayBackend(transcript, response_chars=5)
+        chat = replay.start_chat("Be kind")
+        self.assertEqual([chat.send_message("Hello").text, chat.send_message("Tell me a story").text], said)
+        self.assertEqual(replay.generate("Patient: I love roses", json_output=True).text, extracted)
+        # a prompt that drifted gets the next recorded reply of its kind
+        self.assertEqual(chat.send_message("Hello at 10:02").text, said[0])
+
+        async def replay_async():
+            return (await replay.generate_async("Patient: something else")).text
+
+        self.assertEqual(asyncio.run(replay_async()), extracted)
+
+
+class StreamDeadlineTests(TempDirTestCase):
+    def _stalling(self, chunks, stall):
+        for i, chunk in enumerate(chunks):
+            if i == stall:
+                time.sleep(1)
+            yield chunk
+
+    def test_a_stalled_stream_fails_the_call(self):
+        caller = ModelCaller("test", timeout=0.05, breaker=CircuitBreaker(failure_threshold=1))
+        read = []
+        with self.assertRaises(ModelCallError):
+            for chunk in caller.read(self._stalling(["a", "b", "c"], stall=2)):
+                read.append(chunk)
+        self.assertEqual(read, ["a", "b"])
+        self.assertEqual((caller.stats["timeouts"], caller.breaker.state), (1, "open"))
+
+    def test_the_whole_stream_has_a_deadline(self):
+        caller = ModelCaller("test", timeout=1.0, stream_timeout=0.1)
+        response = SimulatedResponse("x" * 100, chunk_chars=10, chunk_latency=0.03)
+
+        async def read(caller):
+            return [chunk.text async for chunk in caller.read_async(response)]
+
+        with self.assertRaises(ModelCallError):
+            list(caller.read(response))
+        with self.assertRaises(ModelCallError):
+            asyncio.run(read(caller))
+        self.assertEqual(caller.stats["timeouts"], 2)
+        self.assertEqual(len(asyncio.run(read(ModelCaller("test", timeout=1.0)))), 10)
+
+    def test_assistant_falls_back_when_the_stream_stalls(self):
+        from chat import LumoraAssistant
+
+        backend = SimulatedBackend(chunk_latency=0.5, upstream="tests/stall")
+        lumora = LumoraAssistant(memory_file=self.path("patient_memory.json"), backend=backend)
+        self.addCleanup(lumora.close)
+        lumora.chat_calls = ModelCaller("chat", timeout=0.05, retries=0)
+
+        started = time.perf_counter()
+        reply = list(lumora.send_message_stream("Tell me about the garden"))
+        self.assertLess(time.perf_counter() - started, 0.4)
+        self.assertEqual(len(reply), 1)
+        turn = lumora.get_patient_memory()["conversation_history"][-1]
+        self.assertEqual((turn["patient"], turn["lumora"]), ("Tell me about the garden", reply[0]))
+
+
+class AsyncAssistantTests(TempDirTestCase):
+    def test_cleanup_runs_after_each_threaded_step(self):
+        from chat import LumoraAssistant
+        from async_chat import AsyncLumoraAssistant
+
+        lumora = LumoraAssistant(memory_file=self.path("patient_memory.json"),
+                                 backend=SimulatedBackend(chunk_latency=0, upstream="tests/async"))
+        threads = []
+        session = AsyncLumoraAssistant(lumora, cleanup=lambda: threads.append(threading.current_thread()))
+
+        async def talk():
+            reply = await session.send_message("Tell me about the garden")
+            await session.close()
+            return reply
+
+        self.assertTrue(asyncio.run(talk()))
+        # cached reply lookup, prompt, recording the turn and closing
+        self.assertEqual(len(threads), 4)
+        self.assertNotIn(threading.main_thread(), threads)
+
+
+class QuoteStripperTests(unittest.TestCase):
+    REPLIES = [
+        'Hello there, how are you today?',
+        '"Hello there, how are you today?"',
+        '"Hello," she said. How are you?',
+        'She said "hello" to me',
+        "' \"Nested quotes\" '",
+        'He told me \\"no\\" twice',
+        '"Ends with a backslash\\',
+        'Trailing quote"',
+        '""',
+        '',
+    ]
+
+    def _stream(self, reply, size):
+        stripper = QuoteStripper()
+        parts = [stripper.feed(reply[i:i + size]) for i in range(0, len(reply), size)]
+        return parts, "".join(parts) + stripper.finish()
+
+    def test_streamed_replies_match_strip_quotes(self):
+        for reply in self.REPLIES:
+            for size in (1, 2, 3, 7, 100):
+                self.assertEqual(self._stream(reply, size)[1], strip_quotes(reply), (reply, size))
+
+    def test_unquoted_replies_stream_as_they_arrive(self):
+        parts, _ = self._stream("I remember the garden well", 5)
+        self.assertTrue(all(parts))
+
+
+class ModelCallerTests(unittest.TestCase):
+    def _flaky(self, failures, delay=0.0, result="ok"):
+        calls = []
+
+        def call():
+            calls.append(time.perf_counter())
+            if len(calls) <= failures:
+                raise RuntimeError("upstream error")
+            time.sleep(delay)
+            return result
+
+        return call, calls
+
+    def test_retries_then_succeeds(self):
+        caller = ModelCaller("test", retries=2, backoff=0)
+        call, calls = self._flaky(failures=2)
+        self.assertEqual(caller.call(call), "ok")
+        self.assertEqual(len(calls), 3)
+        self.assertEqual((caller.stats["retries"], caller.stats["errors"], caller.stats["successes"]), (2, 2, 1))
+
+    def test_deadline(self):
+        caller = ModelCaller("test", timeout=0.05, retries=0)
+        started = time.perf_counter()
+        with self.assertRaises(ModelCallError):
+            caller.call(time.sleep, 1)
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual(caller.stats["timeouts"], 1)
+
+    def test_slow_call_is_hedged(self):
+        caller = ModelCaller("test", timeout=2.0, retries=0, hedge_after=0.05)
+        delays = [1.0, 0.0]
+
+        def call():
+            time.sleep(delays.pop(0))
+            return "hedged"
+
+        started = time.perf_counter()
+        self.assertEqual(caller.call(call), "hedged")
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual(caller.stats["hedges"], 1)
+
+    def test_breaker_opens_and_lets_one_trial_through(self):
+        caller = ModelCaller("test", retries=0, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0.05))
+        call, calls = self._flaky(failures=2)
+        for _ in range(2):
+            with self.assertRaises(ModelCallError):
+                caller.call(call)
+        with self.assertRaises(CircuitOpenError):
+            caller.call(call)
+        self.assertEqual((len(calls), caller.breaker.state), (2, "open"))
+
+        time.sleep(0.06)
+        self.assertEqual(caller.breaker.state, "half_open")
+        self.assertEqual(caller.call(call), "ok")
+        self.assertEqual(caller.breaker.state, "closed")
+
+    def test_async_calls(self):
+        caller = ModelCaller("test", timeout=0.05, retries=1, backoff=0)
+
+        async def slow():
+            await asyncio.sleep(1)
+
+        async def fast():
+            return "ok"
+
+        self.assertEqual(asyncio.run(caller.call_async(fast)), "ok")
+        with self.assertRaises(ModelCallError):
+            asyncio.run(caller.call_async(slow))
+        self.assertEqual((caller.stats["timeouts"], caller.stats["retries"]), (2, 1))
+
+    def test_sessions_share_a_caller_per_upstream(self):
+        caller = shared_caller("chat", "tests/shared", timeout=1.0)
+        self.assertIs(shared_caller("chat", "tests/shared"), caller)
+        self.assertIsNot(shared_caller("chat", "tests/other"), caller)
+
+        registry = Registry()
+        caller = ModelCaller("chat", upstream="tests/metrics", registry=registry)
+        caller.call(lambda: "ok")
+        text = registry.render()
+        self.assertIn('lumora_model_call_seconds_count{call="chat",upstream="tests/metrics"} 1', text)
+        self.assertIn('lumora_model_call_successes_total{call="chat",upstream="tests/metrics"} 1', text)
+        self.assertIn('lumora_model_circuit_state{call="chat",upstream="tests/metrics",state="closed"} 1', text)
+
+
+class ResponseCacheTests(unittest.TestCase):
+    def test_normalize(self):
+        self.assertEqual(normalize_message("What's my daughter’s name?"), "what is my daughters name")
+        self.assertEqual(normalize_message("I can't remember!"), "i cannot remember")
+
+    def test_hits_rotate_through_variants(self):
+        cache = ResponseCache(variants=2)
+        cache.put("What's my daughter's name?", 1, "Her name is Sarah.", now=0)
+        # one reply is not enough to answer from yet
+        self.assertIsNone(cache.get("what is my daughters name", 1, now=1))
+        cache.put("What is my daughter's name", 1, "She's called Sarah.", now=2)
+        replies = [cache.get("What's my daughter's name?", 1, now=3) for _ in range(3)]
+        self.assertEqual(replies, ["Her name is Sarah.", "She's called Sarah.", "Her name is Sarah."])
+
+    def test_memory_changes_and_age_expire_entries(self):
+        cache = ResponseCache(variants=1, ttl=60)
+        cache.put("Where do I live?", 1, "In Leeds.", now=0)
+        self.assertIsNone(cache.get("Where do I live?", 2, now=1))
+        cache.put("Where do I live?", 2, "In Leeds.", now=1)
+        self.assertIsNone(cache.get("Where do I live?", 2, now=100))
+        self.assertEqual(cache.stats["expired"], 2)
+
+    def test_near_matches_and_eviction(self):
+        cache = ResponseCache(variants=1, max_entries=2)
+        cache.put("Where is my husband John today", 1, "He's at home.", now=0)
+        self.assertEqual(cache.get("Where is my husband John today?!", 1, now=1), "He's at home.")
+        self.assertEqual(cache.get("where's my husband john today", 1, now=1), "He's at home.")
+        self.assertIsNone(cache.get("Where is my cat", 1, now=1))
+
+        cache.put("Tell me a story", 1, "Once upon a time...", now=2)
+        cache.put("Sing me a song", 1, "La la la.", now=3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("Where is my husband John today", 1, now=4))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+import re
+import datetime
+from bisect import bisect_left, bisect_right
+
+from retrieval import estimate_tokens
+
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10, "couple of": 2, "few": 3,
+}
+
+AGO_RE = re.compile(r"\b(\d+|a|an|one|two|three|four|five|six|seven|eight|nine|ten|couple of|few) "
+                    r"(day|week|month)s? ago\b")
+WEEKDAY_RE = re.compile(r"\b(last |this past |on )?(" + "|".join(WEEKDAYS) + r")\b")
+ISO_DATE_RE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+
+
+def _week(day):
+    """Monday..Sunday of the week containing ``day``"""
+    start = day - datetime.timedelta(days=day.weekday())
+    return start, start + datetime.timedelta(days=6)
+
+
+def _month(day):
+    """First..last day of the month containing ``day``"""
+    start = day.replace(day=1)
+    next_month = (start + datetime.timedelta(days=32)).replace(day=1)
+    return start, next_month - datetime.timedelta(days=1)
+
+
+def resolve_time_window(text, now=None):
+    """
+    Resolve a relative date expression in a patient message to a window of days.
+
+    Returns an inclusive ``(start_date, end_date)`` pair, or None when the
+    message doesn't refer to a time, e.g. "What did I do yesterday?" gives
+    (yesterday, yesterday) and "last week" gives last Monday..Sunday.
+    """
+    text = text.lower()
+    today = (now or datetime.datetime.now()).date()
+    one_day = datetime.timedelta(days=1)
+
+    match = ISO_DATE_RE.search(text)
+    if match:
+        try:
+            day = datetime.date(*(int(part) for part in match.groups()))
+            return day, day
+        except ValueError:
+            pass
+
+    if "day before yesterday" in text:
+        return today - 2 * one_day, today - 2 * one_day
+    if "yesterday" in text or "last night" in text:
+        return today - one_day, today - one_day
+
+    match = AGO_RE.search(text)
+    if match:
+        amount, unit = match.groups()
+        amount = int(amount) if amount.isdigit() else NUMBER_WORDS[amount]
+        if unit == "day":
+            day = today - amount * one_day
+            return day, day
+        if unit == "week":
+            return _week(today - datetime.timedelta(weeks=amount))
+        # months: step back one month boundary at a time
+        day = today.replace(day=1)
+        for _ in range(amount):
+            day = (day - one_day).replace(day=1)
+        return _month(day)
+
+    if "last weekend" in text:
+        saturday = _week(today)[0] - 2 * one_day
+        return saturday, saturday + one_day
+    if "last week" in text:
+        return _week(today - datetime.timedelta(weeks=1))
+    if "this week" in text:
+        return _week(today)[0], today
+    if "last month" in text:
+        return _month(today.replace(day=1) - one_day)
+    if "this month" in text:
+        return _month(today)[0], today
+
+    match = WEEKDAY_RE.search(text)
+    if match:
+        prefix, name = match.groups()
+        back = (today.weekday() - WEEKDAYS.index(name)) % 7
+        if back == 0 and prefix and prefix.strip() == "last":
+            back = 7
+        day = today - back * one_day
+        return day, day
+
+    if re.search(r"\b(today|this morning|this afternoon|this evening|tonight|earlier)\b", text):
+        return today, today
+
+    return None
+
+
+class TimeIndex:
+    """
+    Looks up conversation turns by date across inline history and the archive.
+
+    Inline history is already in timestamp order, so a window is two binary
+    searches over it; archived days are a sorted list of day names searched
+    the same way, and a day's segment is only decoded when it falls inside
+    the window. Lookups cost O(log n) plus the size of the answer however
+    many years of history exist.
+    """
+
+    def __init__(self, store, archive):
+        self.store = store
+        self.archive = archive
+
+    def turns_between(self, start_day, end_day):
+        """Turns from ``start_day`` to ``end_day`` inclusive (dates or "YYYY-MM-DD" strings)"""
+        start_day, end_day = str(start_day), str(end_day)
+
+        days = self.archive.days()
+        archived = []
+        for day in days[bisect_left(days, start_day):bisect_right(days, end_day)]:
+            archived.extend(self.archive.load_day(day))
+
+        with self.store.lock:
+            history = self.store.state["conversation_history"]
+            lo = bisect_left(history, start_day, key=lambda turn: turn["timestamp"][:10])
+            hi = bisect_right(history, end_day, key=lambda turn: turn["timestamp"][:10])
+            inline = history[lo:hi]
+
+        # the archive and inline history can overlap after an interrupted trim
+        archived_keys = {(turn["timestamp"], turn["patient"]) for turn in archived}
+        return archived + [t for t in inline if (t["timestamp"], t["patient"]) not in archived_keys]
+
+    def summaries_between(self, start_day, end_day):
+        """Day and month summaries overlapping the window, oldest first"""
+        start_day, end_day = str(start_day), str(end_day)
+        with self.store.lock:
+            summaries = self.store.state.get("conversation_summaries", {})
+            return [
+                (period, summaries[period]) for period in sorted(summaries)
+                if period <= end_day and period >= start_day[:len(period)]
+            ]
+
+    def context(self, start_day, end_day, token_budget=400):
+        """
+        Render what happened in the window for the prompt.
+
+        The most recent turns are kept within ``token_budget``; days whose
+        turns didn't fit are covered by their summaries instead.
+        """
+        turns = self.turns_between(start_day, end_day)
+        lines = []
+        used = 0
+        covered_days = set()
+        for turn in reversed(turns):
+            line = f"- {turn['timestamp']}: the patient said \"{turn['patient']}\""
+            cost = estimate_tokens(line)
+            if used + cost > token_budget:
+                break
+            lines.append(line)
+            covered_days.add(turn["timestamp"][:10])
+            used += cost
+        lines.reverse()
+
+        summary_lines = []
+        for period, entry in self.summaries_between(start_day, end_day):
+            if period in covered_days:
+                continue
+            line = f"- {period} ({entry['turns']} exchanges): {entry['summary']}"
+            cost = estimate_tokens(line)
+            if used + cost > token_budget:
+                break
+            summary_lines.append(line)
+            used += cost
+
+        if not lines and not summary_lines:
+            return f"There is no record of conversations between {start_day} and {end_day}.\n"
+        header = f"What the patient talked about between {start_day} and {end_day}:\n"
+        return header + "\n".join(summary_lines + lines) + "\n"
@@ -0,0 +1,63 @@
+import re
+import heapq
+
+
+# Words that make the same topic look different: "my family", "the family",
+# "family members" and "Family stuff" are all "family"
+_LEADING = {"a", "an", "the", "my", "her", "his", "their", "our", "your", "about"}
+_TRAILING = {"member", "members", "stuff", "things", "matters", "related", "topics"}
+# plurals that don't end in a plain "s" to drop
+_SINGULAR = {"children": "child", "grandchildren": "grandchild", "people": "person", "memories": "memory",
+             "women": "woman", "men": "man", "movies": "movie", "cookies": "cookie"}
+_KEEP_S = ("ss", "us", "is", "news", "series")
+# names and places whose "s" isn't a plural ending
+_PROPER_S = {"james", "charles", "thomas", "nicholas", "douglas", "silas", "agnes", "frances", "gladys", "moses",
+             "jones", "barnes", "holmes", "hastings", "wales", "athens", "texas", "carlos", "jules"}
+
+
+def _singular(word):
+    if word in _PROPER_S:
+        return word
+    if word in _SINGULAR:
+        return _SINGULAR[word]
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("sses", "xes", "ches", "shes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(_KEEP_S):
+        return word[:-1]
+    return word
+
+
+def normalize(topic):
+    """
+    The form a topic is counted under: lowercase, without articles,
+    possessives, filler words and a plural ending ("Family members" ->
+    "family", "Her grandchildren" -> "grandchild"); "" if nothing is left.
+    A capitalised last word after a lowercase one is a name and keeps its
+    "s" ("trip to Athens", "uncle Silas"), as do a few common names
+    """
+    text = re.sub(r"'s\b|[^\w\s-]", " ", str(topic), flags=re.IGNORECASE)
+    text = re.sub(r"\s+in general$", "", text.strip(), flags=re.IGNORECASE)
+    words = text.replace("-", " ").split()
+    while words and words[0].lower() in _LEADING:
+        words.pop(0)
+    while len(words) > 1 and words[-1].lower() in _TRAILING:
+        words.pop()
+    if words:
+        name = words[-1][:1].isupper() and any(word[:1].islower() for word in words[:-1])
+        words = [word.lower() for word in words]
+        if not name:
+            words[-1] = _singular(words[-1])
+    return " ".join(words)
+
+
+def top_topics(counts, k=10):
+    """The ``k`` most frequent topics of a {topic: count} dict, merging ones that normalize alike"""
+    merged = {}
+    for topic, count in counts.items():
+        key = normalize(topic)
+        if key:
+            merged[key] = merged.get(key, 0) + count
+    # a bounded heap rather than sorting every topic ever mentioned
+    return heapq.nlargest(k, merged.items(), key=lambda item: item[1])
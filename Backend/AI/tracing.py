@@ -0,0 +1,186 @@
+"""
+Where a chat turn's time goes.
+
+A turn (or an extraction batch, or an API request) is a trace made of spans:
+prompt build, chat call, extraction call, parse, persist. Every span's
+duration goes into the ``lumora_span_seconds`` histogram, and its token
+counts and payload sizes into counters, so the metrics cover every turn for
+the cost of two clock reads and a histogram update per span.
+
+Beyond that, a ``sample_rate`` share of traces is kept whole, with each
+span's offset and attributes, in ``Tracer.recent``. Sampled traces slower
+than ``slow_threshold`` seconds are also printed. Setting the rate to 0 keeps
+the metrics and skips the rest, so tracing can stay on in production.
+"""
+import time
+import random
+import threading
+from collections import deque
+
+from metrics import DEFAULT_BUCKETS, REGISTRY
+
+
+# numeric span attributes that are also totalled per span, as lumora_span_<name>_total
+COUNTED = ("prompt_tokens", "reply_tokens", "bytes_out", "bytes_in")
+# local phases (prompt build, persist) take around a millisecond
+BUCKETS = (0.0005, 0.001, 0.0025) + DEFAULT_BUCKETS
+
+REGISTRY.describe("lumora_span_seconds", "Time spent in each phase of a chat turn, extraction batch or request")
+REGISTRY.describe("lumora_trace_seconds", "Time from start to end of a chat turn, extraction batch or request")
+REGISTRY.describe("lumora_span_errors_total", "Spans that ended with an exception")
+
+_local = threading.local()
+
+
+def _failed(exc_type):
+    # a generator closed early or a cancelled task is not a failure
+    return exc_type is not None and issubclass(exc_type, Exception)
+
+
+class Span:
+    __slots__ = ("trace", "name", "attributes", "started", "seconds")
+
+    def __init__(self, trace, name, attributes):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+        self.seconds = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self.started
+        self.trace._finished(self, exc_type)
+        return False
+
+
+class Trace:
+    """One turn, batch or request; use as a context manager and open spans with ``span()``"""
+
+    def __init__(self, tracer, name, sampled, attributes, current=False):
+        self.tracer = tracer
+        self.name = name
+        self.sampled = sampled
+        self.attributes = attributes
+        self.current = current
+        self.spans = []
+        # seconds per span name, summed when a name repeats
+        self.durations = {}
+        self.seconds = None
+
+    def span(self, name, **attributes):
+        return Span(self, name, attributes)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def _finished(self, span, exc_type):
+        registry = self.tracer.registry
+        labels = (("span", span.name),)
+        registry.observe("lumora_span_seconds", labels, span.seconds, BUCKETS)
+        for name in COUNTED:
+            value = span.attributes.get(name)
+            if value:
+                registry.inc(f"lumora_span_{name}_total", labels, value)
+        if _failed(exc_type):
+            registry.inc("lumora_span_errors_total", labels)
+            span.attributes["error"] = exc_type.__name__
+        self.durations[span.name] = self.durations.get(span.name, 0.0) + span.seconds
+        if self.sampled:
+            self.spans.append(span)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        if self.current:
+            # spans opened through tracing.span() on this thread join this trace
+            self._previous = getattr(_local, "trace", None)
+            _local.trace = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self.started
+        if self.current:
+            _local.trace = self._previous
+        self.tracer._finished(self, exc_type)
+        return False
+
+    def summary(self):
+        """The trace as a dict: spans with their offset from the start, in milliseconds"""
+        return {
+            "name": self.name,
+            "ms": round(1000 * self.seconds, 3) if self.seconds is not None else None,
+            **self.attributes,
+            "spans": [
+                {"name": span.name, "at_ms": round(1000 * (span.started - self.started), 3),
+                 "ms": round(1000 * span.seconds, 3), **span.attributes}
+                for span in sorted(self.spans, key=lambda span: span.started)
+            ],
+        }
+
+
+class _NullSpan:
+    """What ``tracing.span()`` gives outside a trace: nothing is timed"""
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+def span(name, **attributes):
+    """A span of the trace running on this thread (see ``Tracer.trace(current=True)``), if any"""
+    trace = getattr(_local, "trace", None)
+    return NULL_SPAN if trace is None else trace.span(name, **attributes)
+
+
+class Tracer:
+    def __init__(self, sample_rate=1.0, keep=100, slow_threshold=None, registry=REGISTRY):
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.registry = registry
+        # the latest sampled traces, newest last
+        self.recent = deque(maxlen=keep)
+
+    def configure(self, sample_rate=None, slow_threshold=None, keep=None):
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if slow_threshold is not None:
+            self.slow_threshold = slow_threshold
+        if keep is not None:
+            self.recent = deque(self.recent, maxlen=keep)
+
+    def sampled(self):
+        return self.sample_rate >= 1 or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def trace(self, name, current=False, **attributes):
+        """
+        A new trace. With ``current=True`` it is also the one ``tracing.span()``
+        joins on this thread while it runs; leave that off for traces held
+        open across a generator's yields.
+        """
+        return Trace(self, name, self.sampled(), attributes, current)
+
+    def _finished(self, trace, exc_type):
+        self.registry.observe("lumora_trace_seconds", (("trace", trace.name),), trace.seconds, BUCKETS)
+        if _failed(exc_type):
+            self.registry.inc("lumora_span_errors_total", (("span", trace.name),))
+        if trace.sampled:
+            self.recent.append(trace)
+            if self.slow_threshold is not None and trace.seconds >= self.slow_threshold:
+                print(f"Slow {trace.name}: {trace.summary()}")
+
+
+# The process's tracer; the API configures it from settings
+TRACER = Tracer()
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Memory, Caretaker, Patient
+from .models import Memory, Caretaker, Patient, Routine, Reminder
+from .search import filter_matching
 
 @admin.register(Memory)
 class MemoryAdmin(admin.ModelAdmin):
@@ -7,10 +8,18 @@ class MemoryAdmin(admin.ModelAdmin):
     search_fields = ("title", "description")  
     list_filter = ("created_at",)
 
+    def get_search_results(self, request, queryset, search_term):
+        # the full-text index instead of a LIKE scan over every description
+        if not search_term.strip():
+            return queryset, False
+        return filter_matching(queryset, search_term), False
+
 @admin.register(Caretaker)
 class CaretakerAdmin(admin.ModelAdmin):
     list_display = ("name", "get_email")  
-    search_fields = ("name", "email")
+    search_fields = ("name", "user__email")
+    # get_email reads the user of every row
+    list_select_related = ("user",)
 
     @admin.display(description="Email")
     def get_email(self, obj):
@@ -21,3 +30,14 @@ class PatientAdmin(admin.ModelAdmin):
     list_display = ('name', 'date_of_birth')  
     list_filter = ('date_of_birth',)
 
+@admin.register(Routine)
+class RoutineAdmin(admin.ModelAdmin):
+    list_display = ("title", "patient", "kind", "frequency", "active")
+    list_filter = ("kind", "frequency", "active")
+    list_select_related = ("patient",)
+
+@admin.register(Reminder)
+class ReminderAdmin(admin.ModelAdmin):
+    list_display = ("routine", "patient", "due_at", "status")
+    list_filter = ("status",)
+    list_select_related = ("routine", "patient")
@@ -3,3 +3,16 @@ from django.apps import AppConfig
 class LumoraApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'lumora_api'
+
+    def ready(self):
+        from django.conf import settings
+        from metrics import REGISTRY
+        from tracing import TRACER
+        from . import signals
+        from .sessions import assistant_metrics, session_metrics
+
+        signals.connect()
+        TRACER.configure(sample_rate=settings.LUMORA_TRACE_SAMPLE_RATE,
+                         slow_threshold=settings.LUMORA_TRACE_SLOW_SECONDS)
+        REGISTRY.add_collector(session_metrics)
+        REGISTRY.add_collector(assistant_metrics)
@@ -0,0 +1,155 @@
+"""
+Content-addressed storage for uploaded images, and serving them.
+
+A blob is stored once, at ``<LUMORA_BLOB_ROOT>/ab/cd/<sha256>``, however many
+memories attach it; its thumbnails sit next to it (see ``thumbnails.py``).
+Files never change once written, so they are served with their hash as the
+ETag, a year-long immutable Cache-Control, and single-range requests.
+"""
+import os
+import re
+import hashlib
+import tempfile
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+
+CHUNK_SIZE = 64 * 1024
+SHA256 = re.compile(r"[0-9a-f]{64}\Z")
+RANGE = re.compile(r"bytes=(\d*)-(\d*)\Z")
+
+
+class BlobTooLarge(Exception):
+    pass
+
+
+class UnsupportedImage(Exception):
+    pass
+
+
+def sniff(head):
+    """The image type from a file's first bytes, or None"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def blob_path(sha256, suffix=""):
+    return os.path.join(settings.LUMORA_BLOB_ROOT, sha256[:2], sha256[2:4], sha256 + suffix)
+
+
+def receive(chunks, max_size):
+    """
+    Write ``chunks`` to a temporary file as they arrive, hashing on the way.
+    Returns (sha256, size, content_type, temporary path); ``place`` moves the
+    file to its content address, ``discard`` drops it.
+    """
+    tmp_dir = os.path.join(settings.LUMORA_BLOB_ROOT, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    digest, size, head = hashlib.sha256(), 0, b""
+    fd, tmp = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in chunks:
+                size += len(chunk)
+                if size > max_size:
+                    raise BlobTooLarge(f"images are limited to {max_size} bytes")
+                if len(head) < 16:
+                    head += chunk[:16]
+                digest.update(chunk)
+                out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+
+        content_type = sniff(head)
+        if content_type is None:
+            raise UnsupportedImage("expected a JPEG, PNG, GIF or WebP image")
+        return digest.hexdigest(), size, content_type, tmp
+    except BaseException:
+        discard(tmp)
+        raise
+
+
+def place(sha256, tmp):
+    """Move a received file to its content address; bytes already stored are dropped"""
+    path = blob_path(sha256)
+    if os.path.exists(path):
+        discard(tmp)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp, path)
+
+
+def discard(tmp):
+    """Drop a received file that was not placed"""
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+
+def remove(sha256):
+    """Delete a blob and its thumbnails from disk"""
+    directory = os.path.dirname(blob_path(sha256))
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.startswith(sha256):
+                os.remove(os.path.join(directory, name))
+
+
+def _read(f, length):
+    with f:
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve(request, path, content_type):
+    """
+    The file at ``path``: 304 when ``If-None-Match`` holds its name, 206 for a
+    single ``Range`` (honouring ``If-Range``), 416 when that range is outside
+    the file; multiple ranges get the whole file
+    """
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        raise Http404("No such image")
+    etag = quote_etag(os.path.basename(path))
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        requested = request.headers.get("Range", "")
+        if_range = request.headers.get("If-Range")
+        match = RANGE.match(requested.replace(" ", ""))
+        if match and any(match.groups()) and if_range in (None, etag):
+            first, last = match.groups()
+            if first:
+                start, end = int(first), min(int(last), size - 1) if last else size - 1
+            else:
+                start, end = max(size - int(last), 0), size - 1
+            if start > end or start >= size or (not first and int(last) == 0):
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{size}"
+            else:
+                f = open(path, "rb")
+                f.seek(start)
+                response = StreamingHttpResponse(_read(f, end - start + 1), status=206, content_type=content_type)
+                response["Content-Length"] = str(end - start + 1)
+                response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        else:
+            response = FileResponse(open(path, "rb"), content_type=content_type)
+
+    response["ETag"] = etag
+    response["Accept-Ranges"] = "bytes"
+    response["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
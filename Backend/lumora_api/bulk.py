@@ -0,0 +1,161 @@
+"""
+Bulk import and export of memories as NDJSON (one JSON object per line) or CSV.
+
+Both directions stream: an import reads its input a line at a time and writes
+``bulk_create`` batches, an export walks the table with a chunked iterator,
+so neither holds more than one batch in memory. Rows carry ``title``,
+``description`` and ``patient``; an export adds ``id`` and ``created_at``,
+which an import ignores (imported memories are created now).
+"""
+import io
+import csv
+import json
+
+from django.db import transaction
+from django.core.exceptions import ValidationError
+from rest_framework.fields import DateTimeField
+from rest_framework.renderers import JSONRenderer
+
+from .caching import mark_changed
+from .models import Memory, Patient
+
+
+EXPORT_FIELDS = ("id", "patient", "title", "description", "created_at")
+
+
+class ImportFailed(Exception):
+    """The import was rolled back; ``errors`` lists the bad rows by line number"""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} invalid rows")
+        self.errors = errors
+
+
+def ndjson_rows(lines):
+    """(line number, object) per non-blank line; the object is None when the line is not JSON"""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except json.JSONDecodeError:
+            yield number, None
+
+
+def csv_rows(lines):
+    """(line number, row dict) per record, with the header naming the columns"""
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, row
+
+
+READERS = {"ndjson": ndjson_rows, "csv": csv_rows}
+# request Content-Type -> READERS key
+IMPORT_TYPES = {"application/x-ndjson": "ndjson", "application/jsonl": "ndjson", "text/csv": "csv"}
+
+
+def _memory(row, patient_id):
+    """A Memory for one input row, or its field errors"""
+    if not isinstance(row, dict):
+        return None, {"non_field_errors": ["expected a JSON object"]}
+    patient = row.get("patient") or patient_id
+    if patient in (None, ""):
+        return None, {"patient": ["is required"]}
+    try:
+        patient = int(patient)
+    except (TypeError, ValueError):
+        return None, {"patient": ["must be an integer"]}
+    memory = Memory(title=row.get("title") or "", description=row.get("description") or "", patient_id=patient)
+    try:
+        memory.clean_fields(exclude=["patient"])
+    except ValidationError as error:
+        return None, error.message_dict
+    return memory, None
+
+
+def import_memories(rows, patient_id=None, batch_size=500, max_errors=50):
+    """
+    Create a memory per ``(line, row)`` from one of the READERS, in batches
+    of ``batch_size``. ``patient_id`` is used for rows without a patient. All
+    or nothing: any invalid row rolls the import back and raises ImportFailed
+    with the first ``max_errors`` problems. Returns the number imported.
+    """
+    imported, errors, known = 0, [], set()
+    batch, line = [], 0
+
+    def write():
+        nonlocal imported
+        wanted = {memory.patient_id for _, memory in batch} - known
+        if wanted:
+            known.update(Patient.objects.filter(id__in=wanted).values_list("id", flat=True))
+        for number, memory in batch:
+            if memory.patient_id not in known:
+                errors.append({"line": number, "patient": [f"patient {memory.patient_id} does not exist"]})
+        # past the first error nothing will be kept, so only validation goes on
+        if not errors:
+            Memory.objects.bulk_create([memory for _, memory in batch])
+            imported += len(batch)
+        batch.clear()
+
+    with transaction.atomic():
+        try:
+            for line, row in rows:
+                memory, error = _memory(row, patient_id)
+                if error:
+                    errors.append({"line": line, **error})
+                    if len(errors) >= max_errors:
+                        break
+                    continue
+                batch.append((line, memory))
+                if len(batch) >= batch_size:
+                    write()
+            if batch:
+                write()
+        except (UnicodeDecodeError, csv.Error) as error:
+            errors.append({"line": line + 1, "non_field_errors": [f"unreadable input: {error}"]})
+
+        if errors:
+            transaction.set_rollback(True)
+            raise ImportFailed(errors[:max_errors])
+
+    # bulk_create sends no save signals
+    if imported:
+        mark_changed(Memory._meta.label_lower)
+    return imported
+
+
+def export_memories(queryset, fmt="ndjson", chunk_size=1000):
+    """The memories in ``queryset`` by id as text chunks of ``chunk_size`` rows, for streaming out"""
+    rows = queryset.order_by("id").values_list("id", "patient_id", "title", "description", "created_at")
+    created_at = DateTimeField()
+    out = io.StringIO()
+    writer = csv.writer(out) if fmt == "csv" else None
+    if writer:
+        writer.writerow(EXPORT_FIELDS)
+
+    count = 0
+    for values in rows.iterator(chunk_size=chunk_size):
+        values = values[:4] + (created_at.to_representation(values[4]),)
+        if writer:
+            writer.writerow(values)
+        else:
+            out.write(json.dumps(dict(zip(EXPORT_FIELDS, values))) + "\n")
+        count += 1
+        if count % chunk_size == 0:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    if out.tell():
+        yield out.getvalue()
+
+
+class NDJSONRenderer(JSONRenderer):
+    """Negotiates ``application/x-ndjson`` (``?format=ndjson``); error bodies are a single JSON line"""
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+
+
+class CSVRenderer(JSONRenderer):
+    """Negotiates ``text/csv`` (``?format=csv``) for exports; error bodies are still JSON"""
+    media_type = "text/csv"
+    format = "csv"
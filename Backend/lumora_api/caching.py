@@ -0,0 +1,103 @@
+"""
+HTTP caching for the read endpoints.
+
+Every model a cached endpoint shows has a change token in the
+``LUMORA_API_CACHE`` cache, replaced by the save / delete / m2m signals in
+``signals.py``. A response's ETag is a digest of the request and the tokens of
+the models it shows, so:
+
+* a conditional GET (``If-None-Match`` / ``If-Modified-Since``) whose
+  validators still match is answered 304 without touching the database;
+* otherwise the serialized page or object is served from the cache, and only
+  built (and stored) when one of those models has changed since.
+
+Writes that skip model signals (``bulk_create``, ``QuerySet.update``, raw SQL)
+must call ``mark_changed`` themselves, or cached responses outlive them until
+``LUMORA_API_CACHE_TIMEOUT``.
+"""
+import time
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+
+TOKEN_PREFIX = "lumora:changed:"
+RESPONSE_PREFIX = "lumora:response:"
+
+
+def api_cache():
+    """The cache holding change tokens and responses, or None when caching is off"""
+    alias = getattr(settings, "LUMORA_API_CACHE", "default")
+    return caches[alias] if alias else None
+
+
+def mark_changed(*labels):
+    """Every cached response showing these models (``app_label.model``) goes stale"""
+    cache = api_cache()
+    if cache is not None:
+        now = time.time()
+        cache.set_many({TOKEN_PREFIX + label: now for label in labels}, timeout=None)
+
+
+def change_tokens(cache, labels):
+    """The current token of each model; one is started for models the cache has no record of"""
+    keys = [TOKEN_PREFIX + label for label in labels]
+    tokens = cache.get_many(keys)
+    missing = [key for key in keys if key not in tokens]
+    if missing:
+        # a cold or evicted cache: whatever was cached under an older token is unreachable
+        now = time.time()
+        for key in missing:
+            cache.add(key, now, timeout=None)
+        tokens.update(cache.get_many(missing))
+    return [tokens[key] for key in keys]
+
+
+class CachedResponseMixin:
+    """
+    Conditional GET and a server-side cache for a viewset's read actions.
+    ``cache_dependencies`` lists every model the responses show, nested ones
+    included; ``list`` and ``retrieve`` are cached, other GET actions opt in
+    through ``cached_response``.
+    """
+    cache_dependencies = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
+
+    def cached_response(self, request, build, *args, **kwargs):
+        cache = api_cache()
+        if cache is None:
+            return build(request, *args, **kwargs)
+
+        tokens = change_tokens(cache, self.cache_dependencies)
+        key = "|".join([request.get_full_path(), str(request.user.pk), *map(repr, tokens)])
+        etag = quote_etag(hashlib.sha1(key.encode()).hexdigest())
+        last_modified = int(max(tokens))
+
+        conditional = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if conditional is not None:
+            # 304 Not Modified (or 412 for a failed If-Match)
+            response = Response(status=conditional.status_code)
+        else:
+            data = cache.get(RESPONSE_PREFIX + etag)
+            if data is None:
+                response = build(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                cache.set(RESPONSE_PREFIX + etag, response.data, settings.LUMORA_API_CACHE_TIMEOUT)
+            else:
+                response = Response(data)
+
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        # clients keep the body but revalidate it every time, which costs a 304
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
@@ -0,0 +1,75 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+
+from lumora_api.caching import api_cache
+from lumora_api.models import Memory, Patient, Caretaker
+from lumora_api.views import MemoryViewSet, PatientViewSet, CaretakerViewSet
+
+
+class Command(BaseCommand):
+    help = "Requests per second on the read endpoints without the response cache, from it, and as 304s (rows are rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--caretakers", type=int, default=20)
+        parser.add_argument("--patients", type=int, default=5, help="patients per caretaker")
+        parser.add_argument("--memories", type=int, default=20, help="memories per patient")
+        parser.add_argument("--seconds", type=float, default=2.0, help="time spent on each measurement")
+
+    def _populate(self, options):
+        User = get_user_model()
+        count = options["caretakers"] * (1 + options["patients"])
+        users = iter(User.objects.bulk_create([
+            User(**{User.USERNAME_FIELD: f"bench-cache-{i}@example.com"}) for i in range(count)
+        ]))
+        caretakers = Caretaker.objects.bulk_create([
+            Caretaker(user=next(users), name=f"Caretaker {i}") for i in range(options["caretakers"])
+        ])
+        patients = Patient.objects.bulk_create([
+            Patient(user=next(users), name=f"Patient {i}") for i in range(options["caretakers"] * options["patients"])
+        ])
+        Caretaker.patients.through.objects.bulk_create([
+            Caretaker.patients.through(caretaker=caretaker, patient=patients[i * options["patients"] + j])
+            for i, caretaker in enumerate(caretakers) for j in range(options["patients"])
+        ])
+        Memory.objects.bulk_create([
+            Memory(patient=patient, title=f"Memory {i}", description="The roses she planted every spring. " * 8)
+            for patient in patients for i in range(options["memories"])
+        ])
+
+    def _rate(self, view, path, seconds, headers=None):
+        factory = APIRequestFactory()
+        done, status = 0, None
+        started = time.perf_counter()
+        while time.perf_counter() - started < seconds:
+            response = view(factory.get(path, HTTP_HOST="localhost", **(headers or {})))
+            response.render()
+            done, status = done + 1, response.status_code
+        return done / (time.perf_counter() - started), status
+
+    def handle(self, *args, **options):
+        seconds = options["seconds"]
+        with transaction.atomic():
+            self._populate(options)
+            api_cache().clear()
+
+            for name, viewset in (("memories", MemoryViewSet), ("patients", PatientViewSet),
+                                  ("caretakers", CaretakerViewSet)):
+                view = viewset.as_view({"get": "list"})
+                path = f"/{name}/"
+                self.stdout.write(f"\n== GET {path}")
+                with override_settings(LUMORA_API_CACHE=None):
+                    uncached, _ = self._rate(view, path, seconds)
+                self.stdout.write(f"  uncached            {uncached:9.0f} req/s")
+
+                etag = view(APIRequestFactory().get(path, HTTP_HOST="localhost"))["ETag"]
+                cached, _ = self._rate(view, path, seconds)
+                self.stdout.write(f"  from cache          {cached:9.0f} req/s   x{cached / uncached:.1f}")
+                revalidated, status = self._rate(view, path, seconds, {"HTTP_IF_NONE_MATCH": etag})
+                self.stdout.write(f"  If-None-Match ({status}) {revalidated:9.0f} req/s   x{revalidated / uncached:.1f}")
+
+            transaction.set_rollback(True)
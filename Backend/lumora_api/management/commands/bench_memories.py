@@ -0,0 +1,82 @@
+import time
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+
+from lumora_api.models import Memory
+from lumora_api.views import MemoryViewSet
+
+
+DESCRIPTION = "We talked about the garden behind the house and the roses she planted every spring. " * 12
+
+
+class Command(BaseCommand):
+    help = "Time and size of the memories list endpoint as the table grows (rows are rolled back afterwards)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+        parser.add_argument("--pages", type=int, default=20, help="pages to follow for the deep-page timing")
+        parser.add_argument("--unpaginated-max", type=int, default=100000,
+                            help="skip the unpaginated baseline above this many rows")
+
+    def _insert(self, count, start):
+        """Insert memories one minute apart going back from ``start``, bypassing auto_now_add"""
+        table = Memory._meta.db_table
+        rows = [
+            (f"Memory {i}", DESCRIPTION, start - datetime.timedelta(minutes=i))
+            for i in range(count)
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {table} (title, description, created_at) VALUES (%s, %s, %s)",
+                [(title, description, connection.ops.adapt_datetimefield_value(created))
+                 for title, description, created in rows],
+            )
+
+    def _get(self, view, params):
+        request = APIRequestFactory().get("/api/memories/", params, HTTP_HOST="localhost")
+        started = time.perf_counter()
+        response = view(request)
+        response.render()
+        return time.perf_counter() - started, len(response.content), response
+
+    def handle(self, *args, **options):
+        paginated = MemoryViewSet.as_view({"get": "list"})
+        unpaginated = MemoryViewSet.as_view({"get": "list"}, pagination_class=None)
+
+        with transaction.atomic():
+            total = 0
+            start = timezone.now()
+            for size in sorted(options["sizes"]):
+                self._insert(size - total, start - datetime.timedelta(minutes=total))
+                total = size
+
+                self.stdout.write(f"\n== {size} memories")
+                if size <= options["unpaginated_max"]:
+                    seconds, length, _ = self._get(unpaginated, {})
+                    self.stdout.write(f"  all rows (no pagination)      {1000 * seconds:10.1f} ms  {length / 1024:10.1f} KiB")
+
+                seconds, length, _ = self._get(paginated, {})
+                self.stdout.write(f"  first page                    {1000 * seconds:10.1f} ms  {length / 1024:10.1f} KiB")
+
+                seconds, length, _ = self._get(paginated, {"fields": "id,title,created_at"})
+                self.stdout.write(f"  first page, fields=id,title   {1000 * seconds:10.1f} ms  {length / 1024:10.1f} KiB")
+
+                week = (start - datetime.timedelta(days=7)).date().isoformat()
+                seconds, length, _ = self._get(paginated, {"created_after": week, "fields": "id,title,created_at"})
+                self.stdout.write(f"  last 7 days, first page       {1000 * seconds:10.1f} ms  {length / 1024:10.1f} KiB")
+
+                # follow next cursors: each page costs the same however deep it is
+                params, timings = {}, []
+                for _ in range(options["pages"]):
+                    seconds, length, response = self._get(paginated, params)
+                    timings.append(seconds)
+                    if not response.data["next"]:
+                        break
+                    params = {"cursor": response.data["next"].split("cursor=")[1].split("&")[0]}
+                self.stdout.write(f"  page {len(timings):<3} via cursors          {1000 * timings[-1]:10.1f} ms")
+
+            transaction.set_rollback(True)
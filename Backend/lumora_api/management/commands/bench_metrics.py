@@ -0,0 +1,49 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client, override_settings
+
+from metrics import REGISTRY
+from tracing import TRACER
+
+from lumora_api.models import Memory, Patient
+
+
+class Command(BaseCommand):
+    help = "Overhead of request metrics and tracing at several sample rates (rows are rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000)
+
+    def _run(self, label, count):
+        client = Client(HTTP_HOST="localhost")
+        client.get("/memories/?fields=id,title")
+        started = time.perf_counter()
+        for _ in range(count):
+            client.get("/memories/?fields=id,title")
+        self.stdout.write(f"{label}: {1e6 * (time.perf_counter() - started) / count:.0f} us per request")
+
+    def handle(self, *args, **options):
+        rate = TRACER.sample_rate
+        with transaction.atomic(), override_settings(LUMORA_API_CACHE=None):
+            user = get_user_model().objects.create(**{get_user_model().USERNAME_FIELD: "bench-metrics@example.com"})
+            patient = Patient.objects.create(user=user, name="Patient")
+            Memory.objects.bulk_create([Memory(patient=patient, title=f"Memory {i}", description="...")
+                                        for i in range(50)])
+
+            middleware = [name for name in settings.MIDDLEWARE if not name.endswith("RequestMetricsMiddleware")]
+            with override_settings(MIDDLEWARE=middleware):
+                self._run("without the metrics middleware", options["requests"])
+            for sample_rate in (0.0, 0.1, 1.0):
+                TRACER.configure(sample_rate=sample_rate)
+                self._run(f"metrics, sample rate {sample_rate}", options["requests"])
+            TRACER.configure(sample_rate=rate)
+
+            started = time.perf_counter()
+            text = REGISTRY.render()
+            self.stdout.write(f"/metrics body: {len(text.splitlines())} lines, "
+                              f"rendered in {1000 * (time.perf_counter() - started):.2f} ms")
+            transaction.set_rollback(True)
@@ -0,0 +1,92 @@
+import time
+import random
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Avg, Count
+from django.db.models.functions import TruncDay
+
+from lumora_api import moods
+from lumora_api.models import MoodObservation, MoodRollup, Patient
+
+from mood import MOODS, VALENCES
+
+
+class Command(BaseCommand):
+    help = "Mood rollups (NumPy vs plain Python) and trend queries vs scanning observations (rows are rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--patients", type=int, default=200)
+        parser.add_argument("--days", type=int, default=365)
+        parser.add_argument("--per-day", type=int, default=15, help="observations per patient per day")
+        parser.add_argument("--dashboard", type=int, default=50, help="patients on one trends query")
+
+    def _populate(self, options):
+        User = get_user_model()
+        users = User.objects.bulk_create([
+            User(**{User.USERNAME_FIELD: f"bench-moods-{i}@example.com"}) for i in range(options["patients"])
+        ])
+        patients = Patient.objects.bulk_create([Patient(user=user, name=f"Patient {i}") for i, user in enumerate(users)])
+
+        adapt = connection.ops.adapt_datetimefield_value
+        first = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=options["days"])
+        step = 86400 / options["per_day"]
+        rng = random.Random(23)
+        with connection.cursor() as cursor:
+            for patient in patients:
+                rows = []
+                for i in range(options["days"] * options["per_day"]):
+                    mood = rng.randrange(len(MOODS))
+                    moment = first + datetime.timedelta(seconds=i * step + rng.random() * step)
+                    rows.append((patient.id, adapt(moment), mood, VALENCES[mood], False))
+                cursor.executemany(
+                    f"INSERT INTO {MoodObservation._meta.db_table} (patient_id, observed_at, mood, valence, rolled_up) "
+                    f"VALUES (%s, %s, %s, %s, %s)", rows,
+                )
+        return [patient.id for patient in patients]
+
+    def _time(self, label, run, repeat=1):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            result = run()
+        self.stdout.write(f"{label}: {1000 * (time.perf_counter() - started) / repeat:.1f} ms")
+        return result
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            started = time.perf_counter()
+            patient_ids = self._populate(options)
+            total = MoodObservation.objects.count()
+            self.stdout.write(f"{total} observations inserted in {time.perf_counter() - started:.1f} s")
+
+            rows = list(MoodObservation.objects.values_list("patient_id", "observed_at", "mood"))
+            patients, moments, observed = map(list, zip(*rows))
+            if moods.np is not None:
+                vectorized = self._time("grouping, NumPy", lambda: moods.aggregate(patients, moments, observed))
+            python = self._time("grouping, plain Python",
+                                lambda: moods.aggregate(patients, moments, observed, vectorized=False))
+            if moods.np is not None:
+                assert vectorized == python, "NumPy and plain Python rollups differ"
+
+            self._time("full rollup (fetch, group, upsert, mark)", moods.rollup)
+            self.stdout.write(f"{MoodRollup.objects.count()} rollup rows")
+
+            MoodObservation.objects.filter(patient_id=patient_ids[0]).update(rolled_up=False)
+            MoodRollup.objects.filter(patient_id=patient_ids[0]).delete()
+            self._time("incremental rollup, one patient's year", moods.rollup)
+
+            dashboard = patient_ids[:options["dashboard"]]
+            end = datetime.date.today()
+            start = end - datetime.timedelta(days=365)
+            self._time(f"daily trends of {len(dashboard)} patients from rollups",
+                       lambda: moods.trends(dashboard, "day", start, end), repeat=5)
+            self._time(f"weekly trends of {len(dashboard)} patients from rollups",
+                       lambda: moods.trends(dashboard, "week", start, end), repeat=5)
+            self._time(f"daily means of {len(dashboard)} patients scanning observations",
+                       lambda: list(MoodObservation.objects.filter(patient_id__in=dashboard, observed_at__date__gte=start)
+                                    .annotate(day=TruncDay("observed_at")).values("patient_id", "day")
+                                    .annotate(count=Count("id"), mean=Avg("valence")).order_by("patient_id", "day")),
+                       repeat=5)
+            transaction.set_rollback(True)
@@ -0,0 +1,77 @@
+import time
+import datetime
+import threading
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from lumora_api.models import Patient, Routine
+from lumora_api.scheduler import ReminderScheduler
+
+
+UTC = datetime.timezone.utc
+
+
+class Command(BaseCommand):
+    help = "Firing accuracy of the reminder scheduler with many active routines (rows are rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--routines", type=int, default=100000)
+        parser.add_argument("--patients", type=int, default=1000)
+        parser.add_argument("--seconds", type=float, default=20.0, help="routines fall due evenly over this long")
+        parser.add_argument("--burst", type=int, default=5000,
+                            help="of them, this many are due at the same instant (everyone's 08:00 pills)")
+
+    def _populate(self, options, first_due):
+        User = get_user_model()
+        users = User.objects.bulk_create([
+            User(**{User.USERNAME_FIELD: f"bench-scheduler-{i}@example.com"}) for i in range(options["patients"])
+        ])
+        patients = Patient.objects.bulk_create([Patient(user=user, name=f"Patient {i}") for i, user in enumerate(users)])
+
+        count, burst = options["routines"], options["burst"]
+        spread = options["seconds"] / max(count - burst, 1)
+        burst_at = first_due + datetime.timedelta(seconds=options["seconds"] / 2)
+        routines = []
+        for i in range(count):
+            due = burst_at if i < burst else first_due + datetime.timedelta(seconds=(i - burst) * spread)
+            routines.append(Routine(patient=patients[i % len(patients)], title="Pills", kind="medication",
+                                    frequency="once", starts_at=due))
+            if len(routines) == 5000:
+                Routine.objects.bulk_create(routines)
+                routines = []
+        Routine.objects.bulk_create(routines)
+
+    def handle(self, *args, **options):
+        lateness = []
+
+        def fired(reminders):
+            # measured after the reminders are committed, when a patient's app could see them
+            now = time.time()
+            lateness.extend(now - reminder.due_at.timestamp() for reminder in reminders)
+
+        with transaction.atomic():
+            started = time.perf_counter()
+            first_due = datetime.datetime.now(UTC) + datetime.timedelta(seconds=30 + options["routines"] / 5000)
+            self._populate(options, first_due)
+            self.stdout.write(f"{options['routines']} routines inserted in {time.perf_counter() - started:.1f} s")
+
+            scheduler = ReminderScheduler(on_fire=fired)
+            started = time.perf_counter()
+            scheduler.load()
+            self.stdout.write(f"loaded into the heap in {time.perf_counter() - started:.2f} s; "
+                              f"first due in {first_due.timestamp() - time.time():.1f} s")
+
+            stop = threading.Event()
+            deadline = first_due.timestamp() + options["seconds"] + 30
+            while len(lateness) < options["routines"] and time.time() < deadline:
+                scheduler.tick()
+                scheduler.sweep()
+                stop.wait(scheduler.next_wakeup())
+
+            lateness.sort()
+            pick = lambda q: 1000 * lateness[min(int(q * len(lateness)), len(lateness) - 1)]
+            self.stdout.write(f"fired {len(lateness)} in {scheduler.stats['ticks']} ticks; lateness "
+                              f"p50 {pick(0.5):.1f} ms, p99 {pick(0.99):.1f} ms, max {1000 * lateness[-1]:.1f} ms")
+            transaction.set_rollback(True)
@@ -0,0 +1,88 @@
+import time
+import random
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from lumora_api.models import Memory, Patient
+from lumora_api.search import search_memories, filter_matching
+
+
+# a few common words and a long tail, so terms range from frequent to rare
+WORDS = ("garden roses tea daughter sister husband music church bakery wedding summer beach dog "
+         "piano letters picnic harvest lighthouse train market orchard").split()
+
+
+class Command(BaseCommand):
+    help = "Latency of full-text memory search against a LIKE scan as the table grows (rows are rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+        parser.add_argument("--patients", type=int, default=100, help="memories are spread over this many patients")
+        parser.add_argument("--like-max", type=int, default=1000000,
+                            help="skip the LIKE baseline above this many rows")
+
+    def _patients(self, count):
+        User = get_user_model()
+        users = User.objects.bulk_create([
+            User(**{User.USERNAME_FIELD: f"bench-search-{i}@example.com"}) for i in range(count)
+        ])
+        return [patient.id for patient in Patient.objects.bulk_create([
+            Patient(user=user, name=f"Patient {i}") for i, user in enumerate(users)
+        ])]
+
+    def _insert(self, count, rng, patient_ids):
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        rows = []
+        for i in range(count):
+            words = rng.choices(WORDS, weights=range(len(WORDS), 0, -1), k=40)
+            # one memory in ten thousand mentions the rare word
+            if rng.random() < 0.0001:
+                words[rng.randrange(len(words))] = "zeppelin"
+            rows.append((" ".join(words[:4]).capitalize(), " ".join(words), now, patient_ids[i % len(patient_ids)]))
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {Memory._meta.db_table} (title, description, created_at, patient_id) "
+                f"VALUES (%s, %s, %s, %s)", rows
+            )
+
+    def _time(self, fn, repeat=5):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - started)
+        return 1000 * sorted(timings)[len(timings) // 2]
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        with transaction.atomic():
+            patient_ids = self._patients(options["patients"])
+            total = 0
+            for size in sorted(options["sizes"]):
+                started = time.perf_counter()
+                self._insert(size - total, rng, patient_ids)
+                total = size
+                self.stdout.write(f"\n== {size} memories (inserted in {time.perf_counter() - started:.1f} s)")
+
+                for term in ("zeppelin", "lighthouse orchard", "garden"):
+                    hits = filter_matching(Memory.objects.all(), term).count()
+                    ms = self._time(lambda: search_memories(term, limit=20))
+                    self.stdout.write(f"  search {term!r:<22} top 20 of {hits:>8}   {ms:9.2f} ms")
+                    if size <= options["like_max"]:
+                        words = term.split()
+                        like = Q()
+                        for word in words:
+                            like &= Q(title__icontains=word) | Q(description__icontains=word)
+                        ms = self._time(lambda: list(Memory.objects.filter(like).only("id", "title")[:20]), repeat=3)
+                        self.stdout.write(f"  LIKE   {term!r:<22} first 20 (unranked)  {ms:9.2f} ms")
+
+                # a caretaker searching one patient's memories
+                for term in ("lighthouse orchard", "garden"):
+                    ms = self._time(lambda: search_memories(term, patient_id=patient_ids[0], limit=20))
+                    self.stdout.write(f"  search {term!r:<22} one patient          {ms:9.2f} ms")
+
+            transaction.set_rollback(True)
@@ -0,0 +1,50 @@
+import os
+import time
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from lumora_api.thumbnails import Image, render
+
+
+class Command(BaseCommand):
+    help = "Thumbnail throughput for camera-sized JPEGs, one process against the pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--images", type=int, default=24)
+        parser.add_argument("--width", type=int, default=4000)
+        parser.add_argument("--height", type=int, default=3000)
+        parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+
+    def handle(self, *args, **options):
+        if Image is None:
+            raise CommandError("thumbnails need Pillow")
+        root = tempfile.mkdtemp()
+        try:
+            sources = []
+            for i in range(options["images"]):
+                path = os.path.join(root, f"{i}.jpg")
+                # a gradient, so the encoder has something to do
+                image = Image.linear_gradient("L").resize((options["width"], options["height"])).convert("RGB")
+                image.save(path, "JPEG", quality=90)
+                sources.append(path)
+            self.stdout.write(f"{len(sources)} JPEGs of {options['width']}x{options['height']}, "
+                              f"sizes {dict(settings.LUMORA_THUMBNAIL_SIZES)}")
+
+            def jobs():
+                return [(path, {box: f"{path}.{box}.jpg" for box in settings.LUMORA_THUMBNAIL_SIZES.values()})
+                        for path in sources]
+
+            for workers in options["workers"]:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    pool.submit(int).result()  # start the workers outside the timing
+                    started = time.perf_counter()
+                    for future in [pool.submit(render, *job) for job in jobs()]:
+                        future.result()
+                    seconds = time.perf_counter() - started
+                self.stdout.write(f"  {workers} worker(s)   {len(sources) / seconds:7.1f} images/s")
+        finally:
+            shutil.rmtree(root)
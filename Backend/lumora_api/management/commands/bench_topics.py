@@ -0,0 +1,96 @@
+import time
+import random
+import datetime
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from lumora_api import topic_trends
+from lumora_api.models import Patient, TopicBucket, TopicTotal
+
+
+class Command(BaseCommand):
+    help = "Top topics over windows from day/month buckets vs day buckets alone (rows are rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--patients", type=int, default=100)
+        parser.add_argument("--days", type=int, default=365)
+        parser.add_argument("--topics", type=int, default=2000, help="distinct topics, drawn Zipf-like")
+        parser.add_argument("--per-day", type=int, default=20, help="topic mentions per patient per day")
+        parser.add_argument("--dashboard", type=int, default=50, help="patients on one caretaker's dashboard")
+
+    def _populate(self, options, end):
+        User = get_user_model()
+        users = User.objects.bulk_create([
+            User(**{User.USERNAME_FIELD: f"bench-topics-{i}@example.com"}) for i in range(options["patients"])
+        ])
+        patients = Patient.objects.bulk_create([Patient(user=user, name=f"Patient {i}") for i, user in enumerate(users)])
+
+        rng = random.Random(24)
+        weights = [1 / rank for rank in range(1, options["topics"] + 1)]
+        names = [f"topic {i}" for i in range(options["topics"])]
+        totals = {}
+        for patient in patients:
+            buckets = {}
+            for offset in range(options["days"]):
+                day = end - datetime.timedelta(days=offset)
+                counts = Counter(rng.choices(names, weights, k=options["per_day"]))
+                for key in (("day", day), ("month", day.replace(day=1))):
+                    bucket = buckets.setdefault(key, Counter())
+                    bucket.update(counts)
+            TopicBucket.objects.bulk_create([
+                TopicBucket(patient=patient, period=period, start=start, topic=topic, count=count)
+                for (period, start), counts in buckets.items() for topic, count in counts.items()
+            ], batch_size=5000)
+            for key, counts in buckets.items():
+                totals.setdefault(key, Counter()).update(counts)
+        TopicTotal.objects.bulk_create([
+            TopicTotal(period=period, start=start, topic=topic, count=count)
+            for (period, start), counts in totals.items() for topic, count in counts.items()
+        ], batch_size=5000)
+        return [patient.id for patient in patients], names
+
+    def _time(self, label, run, repeat=3):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            result = run()
+        self.stdout.write(f"{label}: {1000 * (time.perf_counter() - started) / repeat:.1f} ms")
+        return result
+
+    def _days_only(self, start, end, k, patient_ids=None):
+        buckets = TopicBucket.objects.filter(period="day", start__range=(start, end))
+        if patient_ids is not None:
+            buckets = buckets.filter(patient_id__in=patient_ids)
+        return [(row["topic"], row["total"]) for row in
+                buckets.values("topic").annotate(total=Sum("count")).order_by("-total", "topic")[:k]]
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            end = datetime.date.today()
+            started = time.perf_counter()
+            patient_ids, names = self._populate(options, end)
+            self.stdout.write(f"{TopicBucket.objects.count()} patient buckets, {TopicTotal.objects.count()} "
+                              f"all-patient buckets inserted in {time.perf_counter() - started:.1f} s")
+
+            self._time("one flush's increments (5 topics)",
+                       lambda: topic_trends.add(patient_ids[0], Counter(names[:5])), repeat=20)
+
+            dashboard = patient_ids[:options["dashboard"]]
+            year = end - datetime.timedelta(days=options["days"] - 1)
+            week = end - datetime.timedelta(days=6)
+            for label, start in (("week", week), ("year", year)):
+                fast = self._time(f"{label}, all patients, day+month buckets",
+                                  lambda: topic_trends.top(start, end, 10))
+                slow = self._time(f"{label}, all patients, summing every patient's day buckets",
+                                  lambda: self._days_only(start, end, 10))
+                assert fast == slow, "bucketed and scanned top topics differ"
+                self._time(f"{label}, {len(dashboard)} patients together",
+                           lambda: topic_trends.top(start, end, 10, dashboard))
+                self._time(f"{label}, {len(dashboard)} patients each, one window query",
+                           lambda: topic_trends.top_per_patient(dashboard, start, end, 10))
+                self._time(f"{label}, {len(dashboard)} patients each, one query per patient",
+                           lambda: [topic_trends.top(start, end, 10, [patient_id]) for patient_id in dashboard])
+            transaction.set_rollback(True)
@@ -0,0 +1,27 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from lumora_api.bulk import export_memories
+from lumora_api.models import Memory
+
+
+class Command(BaseCommand):
+    help = "Write memories out as NDJSON or CSV, a chunk at a time"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+        parser.add_argument("--patient", type=int, help="only this patient's memories")
+        parser.add_argument("-o", "--output", help="file to write (default: stdout)")
+
+    def handle(self, *args, **options):
+        queryset = Memory.objects.all()
+        if options["patient"] is not None:
+            queryset = queryset.filter(patient_id=options["patient"])
+        out = open(options["output"], "w", encoding="utf-8", newline="") if options["output"] else sys.stdout
+        try:
+            for chunk in export_memories(queryset, options["format"]):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout:
+                out.close()
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from lumora_api.bulk import READERS, ImportFailed, import_memories
+
+
+class Command(BaseCommand):
+    help = "Bulk-create memories from an NDJSON or CSV file (all or nothing)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="one JSON object per line, or CSV with a header row")
+        parser.add_argument("--format", choices=sorted(READERS), help="default: from the file extension")
+        parser.add_argument("--patient", type=int, help="patient for rows without one")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        path = options["file"]
+        fmt = options["format"] or ("csv" if path.lower().endswith(".csv") else "ndjson")
+        try:
+            with open(path, encoding="utf-8-sig", newline="") as lines:
+                imported = import_memories(READERS[fmt](lines), patient_id=options["patient"],
+                                           batch_size=options["batch_size"])
+        except OSError as error:
+            raise CommandError(error)
+        except ImportFailed as failed:
+            for error in failed.errors:
+                self.stderr.write(f"line {error.pop('line')}: {error}")
+            raise CommandError(f"{failed}; nothing was imported")
+        self.stdout.write(f"Imported {imported} memories")
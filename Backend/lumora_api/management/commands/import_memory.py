@@ -0,0 +1,60 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from memory_store import MemoryStore
+from retention import HistoryArchive
+
+from lumora_api.memory_db import MEMORY_MODELS, DatabaseMemoryStore
+from lumora_api.models import Patient, TopicBucket
+
+
+class Command(BaseCommand):
+    help = "Import a patient's memory from a Lumora JSON memory file (with its journal and archive) into the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("patient_id", type=int)
+        parser.add_argument("memory_file", help="e.g. AI/patient_memory.json")
+        parser.add_argument("--replace", action="store_true",
+                            help="delete the patient's existing memory in the database first")
+
+    def handle(self, *args, **options):
+        patient_id = options["patient_id"]
+        memory_file = options["memory_file"]
+        if not Patient.objects.filter(pk=patient_id).exists():
+            raise CommandError(f"Patient {patient_id} does not exist")
+        if not os.path.exists(memory_file):
+            raise CommandError(f"{memory_file} not found")
+
+        # anything --replace would delete, topic trend buckets included
+        already = any(model.objects.filter(patient_id=patient_id).exists()
+                      for model in MEMORY_MODELS + (TopicBucket,))
+        if already and not options["replace"]:
+            raise CommandError(f"Patient {patient_id} already has memory in the database; use --replace")
+
+        # the file store replays its journal, so this is the memory as the assistant last saw it
+        state = MemoryStore(memory_file).state
+        archive = HistoryArchive(os.path.splitext(memory_file)[0] + "_archive")
+        inline = {(turn["timestamp"], turn["patient"]) for turn in state["conversation_history"]}
+
+        counts = {"archived turns": 0}
+
+        def archived_turns():
+            for day in archive.days():
+                for turn in archive.load_day(day):
+                    # an interrupted trim can leave a turn both archived and inline
+                    if (turn["timestamp"], turn["patient"]) not in inline:
+                        counts["archived turns"] += 1
+                        yield turn
+
+        DatabaseMemoryStore(patient_id).write_state(state, replace=options["replace"], archived_turns=archived_turns())
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported memory for patient {patient_id}: "
+            f"{len(state['personal_info'])} personal details, "
+            f"{len(state['important_memories'])} memories, "
+            f"{len(state['preferences'])} preferences, "
+            f"{len(state['topics_discussed'])} topics, "
+            f"{len(state['conversation_history'])} recent turns, "
+            f"{counts['archived turns']} archived turns"
+        ))
@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from lumora_api.moods import rollup
+
+
+class Command(BaseCommand):
+    help = "Fold new mood observations into the daily, weekly and monthly rollups (run from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = rollup(batch_size=options["batch_size"])
+        self.stdout.write(f"{count} observations rolled up in {time.perf_counter() - started:.2f} s")
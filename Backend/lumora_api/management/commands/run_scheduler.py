@@ -0,0 +1,28 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from lumora_api.scheduler import ReminderScheduler
+
+
+class Command(BaseCommand):
+    help = "Fire routine reminders as they come due (run exactly one per database)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sync-interval", type=float, default=1.0,
+                            help="seconds between looks for new or edited routines")
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop.set())
+
+        def fired(reminders):
+            due = sum(reminder.status == "fired" for reminder in reminders)
+            self.stdout.write(f"{due} reminders fired, {len(reminders) - due} recorded as missed")
+
+        scheduler = ReminderScheduler(on_fire=fired, sync_interval=options["sync_interval"])
+        self.stdout.write("Scheduler running; Ctrl-C to stop")
+        scheduler.run(stop)
+        self.stdout.write(f"Stopped: {scheduler.stats}")
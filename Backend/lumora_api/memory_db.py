@@ -0,0 +1,328 @@
+import datetime
+import threading
+from itertools import groupby, islice
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from memory_store import MemoryStore, empty_memory
+from mood import VALENCES, classify
+from retention import TIMESTAMP_FORMAT
+
+from . import topic_trends
+from .caching import mark_changed
+from .models import (
+    PersonalInfo, Preference, ImportantMemory, TopicCount, ConversationTurn, ConversationSummary, MoodObservation,
+    MoodRollup, text_digest,
+)
+
+
+# memory sections kept as key -> value rows: (model, key field, value field)
+KEYED_SECTIONS = {
+    "personal_info": (PersonalInfo, "key", "value"),
+    "preferences": (Preference, "key", "value"),
+    "conversation_summaries": (ConversationSummary, "period", "data"),
+}
+
+# every model holding part of a patient's memory; ``write_state(replace=True)`` empties them all
+MEMORY_MODELS = (PersonalInfo, Preference, ConversationSummary, ImportantMemory, TopicCount, ConversationTurn)
+
+
+def to_datetime(timestamp):
+    """Turn timestamp as stored in memory ("2025-03-14 09:30:00", local time) -> aware datetime"""
+    return timezone.make_aware(datetime.datetime.strptime(timestamp, TIMESTAMP_FORMAT))
+
+
+def to_timestamp(value):
+    return timezone.localtime(value).strftime(TIMESTAMP_FORMAT)
+
+
+def turn_dict(turn):
+    return {"timestamp": to_timestamp(turn.timestamp), "patient": turn.message, "lumora": turn.reply}
+
+
+class DatabaseMemoryStore:
+    """
+    Patient memory kept in the lumora_api tables, behind the MemoryStore interface.
+
+    ``state`` is an in-memory copy loaded when the store opens; changes apply to
+    it immediately and are queued, then ``flush()`` writes the queue in one
+    transaction. Consecutive changes to a section become one ``bulk_create``,
+    facts are upserted by key and topic counters are incremented in the
+    database, so workers serving the same patient add to each other's
+    writes instead of overwriting them; a memory both extract is stored
+    once. Trimming the conversation history marks turns up to the last one
+    trimmed archived (whichever worker wrote them) rather than deleting them.
+    """
+
+    def __init__(self, patient_id, batch_size=500):
+        self.patient_id = patient_id
+        self.batch_size = batch_size
+
+        self.lock = threading.RLock()
+        self._flushing = threading.Lock()
+        self._pending = []
+        self.versions = {}
+
+        self.state = self._load()
+
+    def _load(self):
+        state = empty_memory()
+        for section, (model, key_field, value_field) in KEYED_SECTIONS.items():
+            rows = model.objects.filter(patient_id=self.patient_id).values_list(key_field, value_field)
+            state[section] = dict(rows)
+        state["important_memories"] = list(
+            ImportantMemory.objects.filter(patient_id=self.patient_id).order_by("id").values_list("text", flat=True)
+        )
+        state["topics_discussed"] = dict(
+            TopicCount.objects.filter(patient_id=self.patient_id).values_list("topic", "count")
+        )
+        live_turns = ConversationTurn.objects.filter(patient_id=self.patient_id, archived=False)
+        state["conversation_history"] = [turn_dict(turn) for turn in live_turns.order_by("timestamp", "id")]
+        return state
+
+    # ------------------------------------------------------------------ changes
+
+    def set(self, path, value):
+        """Set the value at ``path`` (a tuple of keys), e.g. ("personal_info", "name")"""
+        self._record({"op": "set", "path": list(path), "value": value})
+
+    def append(self, path, value):
+        """Append ``value`` to the list at ``path``"""
+        self._record({"op": "append", "path": list(path), "value": value})
+
+    def incr(self, path, amount=1):
+        """Add ``amount`` to the counter at ``path``"""
+        self._record({"op": "incr", "path": list(path), "value": amount})
+
+    def trim(self, path, count):
+        """Drop the first ``count`` entries of the list at ``path``"""
+        self._record({"op": "trim", "path": list(path), "value": count})
+
+    def delete(self, path):
+        """Remove the key at ``path`` if it exists"""
+        self._record({"op": "delete", "path": list(path), "value": None})
+
+    def replace(self, state):
+        """Replace the whole memory, e.g. when it is reset"""
+        self._record({"op": "replace", "path": [], "value": state})
+
+    def _record(self, record):
+        with self.lock:
+            if record["op"] == "trim" and record["value"]:
+                # this copy of the history may lack other workers' turns, so the
+                # database trims by time: up to the last turn trimmed here
+                trimmed = self.state["conversation_history"][:record["value"]]
+                record["through"] = trimmed[-1]["timestamp"] if trimmed else None
+            MemoryStore._apply(self.state, record)
+            self._bump(record)
+            self._pending.append(record)
+
+    _bump = MemoryStore._bump
+    version = MemoryStore.version
+
+    # ------------------------------------------------------------------ writing
+
+    def flush(self):
+        """Write every queued change to the database"""
+        with self._flushing:
+            with self.lock:
+                records, self._pending = self._pending, []
+            if not records:
+                return
+            try:
+                with transaction.atomic():
+                    # runs of the same operation on the same section are written together
+                    for (op, section), run in groupby(records, key=lambda r: (r["op"], r["path"][:1])):
+                        getattr(self, f"_write_{op}")(section[0] if section else None, list(run))
+            except Exception:
+                # nothing was written; keep the changes for the next flush
+                with self.lock:
+                    self._pending[:0] = records
+                raise
+
+    def _keyed(self, section, op):
+        if section not in KEYED_SECTIONS:
+            raise ValueError(f"Can't {op} keys in memory section: {section}")
+        return KEYED_SECTIONS[section]
+
+    def _write_set(self, section, records):
+        model, key_field, value_field = self._keyed(section, "set")
+        # the last write to a key wins, as it would in the dict
+        latest = {r["path"][1]: r["value"] for r in records}
+        update_fields = [value_field] + (["updated_at"] if hasattr(model, "updated_at") else [])
+        model.objects.bulk_create(
+            [model(patient_id=self.patient_id, **{key_field: key, value_field: value}) for key, value in latest.items()],
+            batch_size=self.batch_size,
+            update_conflicts=True,
+            unique_fields=["patient", key_field],
+            update_fields=update_fields,
+        )
+
+    def _write_delete(self, section, records):
+        model, key_field, _ = self._keyed(section, "delete")
+        keys = [r["path"][1] for r in records]
+        model.objects.filter(patient_id=self.patient_id, **{f"{key_field}__in": keys}).delete()
+
+    def _write_append(self, section, records):
+        values = [r["value"] for r in records]
+        if section == "conversation_history":
+            self._create_turns(values)
+        elif section == "important_memories":
+            ImportantMemory.objects.bulk_create(
+                [ImportantMemory(patient_id=self.patient_id, text=str(value), digest=text_digest(str(value)))
+                 for value in values],
+                batch_size=self.batch_size,
+                ignore_conflicts=True,
+            )
+        else:
+            raise ValueError(f"Can't append to memory section: {section}")
+
+    def _write_incr(self, section, records, bucket=True):
+        if section != "topics_discussed":
+            raise ValueError(f"Can't increment counters in memory section: {section}")
+        amounts = Counter()
+        for r in records:
+            amounts[r["path"][1]] += r["value"]
+
+        TopicCount.objects.bulk_create(
+            [TopicCount(patient_id=self.patient_id, topic=topic) for topic in amounts],
+            batch_size=self.batch_size,
+            ignore_conflicts=True,
+        )
+        # one UPDATE per distinct amount, usually just "+ 1"
+        by_amount = {}
+        for topic, amount in amounts.items():
+            by_amount.setdefault(amount, []).append(topic)
+        for amount, topics in by_amount.items():
+            TopicCount.objects.filter(patient_id=self.patient_id, topic__in=topics).update(
+                count=F("count") + amount
+            )
+        # and today's buckets, for top topics by window (imported lifetime counts have no day)
+        if bucket:
+            topic_trends.add(self.patient_id, amounts, batch_size=self.batch_size)
+
+    def _write_trim(self, section, records):
+        if section != "conversation_history":
+            raise ValueError(f"Can't trim memory section: {section}")
+        through = max((r["through"] for r in records if r.get("through")), default=None)
+        if through is not None:
+            ConversationTurn.objects.filter(
+                patient_id=self.patient_id, archived=False, timestamp__lte=to_datetime(through),
+            ).update(archived=True)
+
+    def _write_replace(self, section, records):
+        # only the last replacement in a run matters
+        self.write_state(records[-1]["value"], replace=True)
+
+    def _create_turns(self, turns, archived=False):
+        # ``turns`` may be a generator over a large archive; only one batch is held at a time
+        turns = iter(turns)
+        while True:
+            batch = list(islice(turns, self.batch_size))
+            if not batch:
+                return
+            ConversationTurn.objects.bulk_create([
+                ConversationTurn(
+                    patient_id=self.patient_id,
+                    timestamp=to_datetime(turn["timestamp"]),
+                    message=turn.get("patient", ""),
+                    reply=turn.get("lumora", ""),
+                    archived=archived,
+                )
+                for turn in batch
+            ])
+
+    def write_state(self, state, replace=False, archived_turns=()):
+        """Write a whole memory dict (and optionally archived turns), e.g. when importing a JSON file"""
+        with transaction.atomic():
+            if replace:
+                for model in MEMORY_MODELS:
+                    model.objects.filter(patient_id=self.patient_id).delete()
+                # the day and month buckets of the topic counts just deleted
+                topic_trends.remove(self.patient_id)
+
+            for section, (model, key_field, value_field) in KEYED_SECTIONS.items():
+                values = state.get(section, {})
+                if values:
+                    self._write_set(section, [
+                        {"path": [section, key], "value": value} for key, value in values.items()
+                    ])
+            if state.get("important_memories"):
+                self._write_append("important_memories", [
+                    {"value": memory} for memory in state["important_memories"]
+                ])
+            if state.get("topics_discussed"):
+                self._write_incr("topics_discussed", [
+                    {"path": ["topics_discussed", topic], "value": count}
+                    for topic, count in state["topics_discussed"].items()
+                ], bucket=False)
+            self._create_turns(archived_turns, archived=True)
+            self._create_turns(state.get("conversation_history", []))
+
+    # ---------------------------------------------------------------- lifecycle
+
+    def close(self):
+        """Write what is still queued"""
+        self.flush()
+
+
+class DatabaseHistoryArchive:
+    """
+    HistoryArchive over the archived rows of ConversationTurn.
+
+    Turns never leave the table: trimming them from the live history marks
+    them archived, so ``write`` has nothing to do.
+    """
+
+    def __init__(self, patient_id):
+        self.patient_id = patient_id
+
+    def _archived(self):
+        return ConversationTurn.objects.filter(patient_id=self.patient_id, archived=True)
+
+    def write(self, turns):
+        pass
+
+    def days(self):
+        """Sorted days that have archived turns"""
+        return [day.isoformat() for day in self._archived().dates("timestamp", "day")]
+
+    def load_day(self, day):
+        """Archived turns of one day, oldest first"""
+        day = datetime.date.fromisoformat(day)
+        return [turn_dict(turn) for turn in self._archived().filter(timestamp__date=day).order_by("timestamp", "id")]
+
+    def clear(self):
+        """Nothing to do: a reset's ``write_state(replace=True)`` deletes the turns"""
+
+
+class DatabaseMoodLog:
+    """MoodLog over MoodObservation rows, which ``manage.py rollup_moods`` aggregates"""
+
+    def __init__(self, patient_id):
+        self.patient_id = patient_id
+
+    def record(self, timestamp, emotional_state):
+        mood = classify(emotional_state)
+        if mood is None:
+            return None
+        MoodObservation.objects.create(
+            patient_id=self.patient_id, observed_at=to_datetime(timestamp), mood=mood, valence=VALENCES[mood],
+        )
+        return mood
+
+    def clear(self):
+        with transaction.atomic():
+            MoodObservation.objects.filter(patient_id=self.patient_id).delete()
+            MoodRollup.objects.filter(patient_id=self.patient_id).delete()
+            transaction.on_commit(lambda: mark_changed(MoodRollup._meta.label_lower))
+
+    def read(self):
+        observations = MoodObservation.objects.filter(patient_id=self.patient_id).order_by("observed_at", "id")
+        return [(to_timestamp(observed_at), mood) for observed_at, mood in observations.values_list("observed_at", "mood")]
+
+    def close(self):
+        pass
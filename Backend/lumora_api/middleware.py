@@ -0,0 +1,140 @@
+"""
+Request metrics for /metrics.
+
+Every request's latency goes into ``lumora_http_request_seconds``, labelled
+by method, view name and status class, so the label values stay few however
+many URLs there are; a streamed response counts until its stream closes. A
+``LUMORA_TRACE_SAMPLE_RATE`` share of requests to sync views is also traced:
+its database queries are counted and timed through a connection execute
+wrapper, into ``lumora_http_db_queries`` and ``lumora_http_db_seconds``, and
+the trace is kept with the tracer's recent ones. Under ASGI a sampled sync
+view runs in the thread the wrapper is installed on, as it would under WSGI.
+Async views (the chat endpoints) run their queries in worker threads the
+wrapper can't see, so only their latency is recorded.
+"""
+import time
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import connection
+from django.urls import Resolver404, resolve
+
+from metrics import REGISTRY
+from tracing import BUCKETS, TRACER
+
+
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+REGISTRY.describe("lumora_http_request_seconds", "Time to a response, by method, view and status class")
+REGISTRY.describe("lumora_http_db_queries", "Database queries per traced request")
+REGISTRY.describe("lumora_http_db_seconds", "Time in database queries per traced request")
+
+
+class QueryTimer:
+    """A connection execute wrapper counting and timing the queries it sees"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+def _sync_view(request):
+    """Whether the request goes to a sync view, before the handler resolves it"""
+    try:
+        match = resolve(request.path_info, getattr(request, "urlconf", None))
+    except Resolver404:
+        return False
+    return not iscoroutinefunction(match.func)
+
+
+def _on_close(response, callback):
+    """Call ``callback`` once a streamed response's content is exhausted or closed"""
+    chunks = response.streaming_content
+    if response.is_async:
+        async def content():
+            try:
+                async for chunk in chunks:
+                    yield chunk
+            finally:
+                callback()
+    else:
+        def content():
+            try:
+                yield from chunks
+            finally:
+                callback()
+    response.streaming_content = content()
+
+
+def _view(request):
+    match = getattr(request, "resolver_match", None)
+    # the URL name, or the view's dotted path for unnamed ones
+    return match.view_name if match is not None else "unmatched"
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        trace = TRACER.trace("request", method=request.method, path=request.path)
+        if not trace.sampled:
+            response = self.get_response(request)
+            self._finish(request, response, started)
+            return response
+        return self._traced(request, trace, started, self.get_response)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        trace = TRACER.trace("request", method=request.method, path=request.path)
+        if trace.sampled and _sync_view(request):
+            # the view would run in a thread of Django's choosing; run the rest
+            # of the chain from one thread with the wrapper installed on its
+            # connection, and the sync view runs in that same thread
+            return await sync_to_async(self._traced, thread_sensitive=True)(
+                request, trace, started, async_to_sync(self.get_response))
+        response = await self.get_response(request)
+        self._finish(request, response, started)
+        return response
+
+    def _traced(self, request, trace, started, get_response):
+        queries = QueryTimer()
+        with trace:
+            with connection.execute_wrapper(queries):
+                response = get_response(request)
+            trace.set(view=_view(request), status=response.status_code, queries=queries.count,
+                      query_ms=round(1000 * queries.seconds, 3))
+        self._finish(request, response, started, queries)
+        return response
+
+    def _finish(self, request, response, started, queries=None):
+        """Record the request now, or for a streamed response once its stream closes"""
+        if queries is not None:
+            labels = (("view", _view(request)),)
+            REGISTRY.observe("lumora_http_db_queries", labels, queries.count, QUERY_BUCKETS)
+            REGISTRY.observe("lumora_http_db_seconds", labels, queries.seconds, BUCKETS)
+        if response.streaming:
+            _on_close(response, lambda: self._observe(request, response, time.perf_counter() - started))
+        else:
+            self._observe(request, response, time.perf_counter() - started)
+
+    def _observe(self, request, response, seconds):
+        REGISTRY.observe("lumora_http_request_seconds",
+                         (("method", request.method), ("view", _view(request)),
+                          ("status", f"{response.status_code // 100}xx")),
+                         seconds, BUCKETS)
@@ -0,0 +1,93 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lumora_api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportantMemory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='important_memories', to='lumora_api.patient')),
+            ],
+            options={
+                'verbose_name_plural': 'Important memories',
+            },
+        ),
+        migrations.CreateModel(
+            name='ConversationSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(max_length=10)),
+                ('data', models.JSONField()),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_summaries', to='lumora_api.patient')),
+            ],
+            options={
+                'verbose_name_plural': 'Conversation summaries',
+                'constraints': [models.UniqueConstraint(fields=('patient', 'period'), name='unique_summary_period')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ConversationTurn',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('message', models.TextField()),
+                ('reply', models.TextField()),
+                ('archived', models.BooleanField(default=False)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='turns', to='lumora_api.patient')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['patient', 'archived', 'timestamp'], name='turn_patient_time_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PersonalInfo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255)),
+                ('value', models.JSONField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='personal_info', to='lumora_api.patient')),
+            ],
+            options={
+                'verbose_name_plural': 'Personal info',
+                'constraints': [models.UniqueConstraint(fields=('patient', 'key'), name='unique_personal_info_key')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Preference',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255)),
+                ('value', models.JSONField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='preferences', to='lumora_api.patient')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('patient', 'key'), name='unique_preference_key')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TopicCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(max_length=255)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='topics', to='lumora_api.patient')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['patient', '-count'], name='topic_count_idx')],
+                'constraints': [models.UniqueConstraint(fields=('patient', 'topic'), name='unique_patient_topic')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lumora_api', '0002_patient_memory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='memory',
+            name='patient',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='memories', to='lumora_api.patient'),
+        ),
+        migrations.AlterField(
+            model_name='memory',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='memory',
+            index=models.Index(fields=['patient', '-created_at', '-id'], name='memory_patient_created_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lumora_api', '0003_memory_patient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='caretaker',
+            name='patients',
+            field=models.ManyToManyField(blank=True, related_name='caretakers', to='lumora_api.patient'),
+        ),
+    ]
@@ -0,0 +1,81 @@
+from django.db import migrations
+
+
+# SQLite: an external-content FTS5 index over the memory table, kept in sync by
+# triggers. patient_id is indexed too, so a search within one patient's
+# memories intersects with their rows inside the index.
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE lumora_api_memory_fts USING fts5(
+        title, description, patient_id,
+        content='lumora_api_memory', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2'
+    )
+    """,
+    "INSERT INTO lumora_api_memory_fts(lumora_api_memory_fts) VALUES ('rebuild')",
+    """
+    CREATE TRIGGER lumora_api_memory_fts_insert AFTER INSERT ON lumora_api_memory BEGIN
+        INSERT INTO lumora_api_memory_fts(rowid, title, description, patient_id)
+        VALUES (new.id, new.title, new.description, new.patient_id);
+    END
+    """,
+    """
+    CREATE TRIGGER lumora_api_memory_fts_delete AFTER DELETE ON lumora_api_memory BEGIN
+        INSERT INTO lumora_api_memory_fts(lumora_api_memory_fts, rowid, title, description, patient_id)
+        VALUES ('delete', old.id, old.title, old.description, old.patient_id);
+    END
+    """,
+    """
+    CREATE TRIGGER lumora_api_memory_fts_update
+    AFTER UPDATE OF title, description, patient_id ON lumora_api_memory BEGIN
+        INSERT INTO lumora_api_memory_fts(lumora_api_memory_fts, rowid, title, description, patient_id)
+        VALUES ('delete', old.id, old.title, old.description, old.patient_id);
+        INSERT INTO lumora_api_memory_fts(rowid, title, description, patient_id)
+        VALUES (new.id, new.title, new.description, new.patient_id);
+    END
+    """,
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS lumora_api_memory_fts_update",
+    "DROP TRIGGER IF EXISTS lumora_api_memory_fts_delete",
+    "DROP TRIGGER IF EXISTS lumora_api_memory_fts_insert",
+    "DROP TABLE IF EXISTS lumora_api_memory_fts",
+]
+
+# Postgres: a generated tsvector column (titles weigh more) with a GIN index
+POSTGRES_FORWARD = [
+    """
+    ALTER TABLE lumora_api_memory ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX lumora_api_memory_search_idx ON lumora_api_memory USING GIN (search_vector)",
+]
+
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS lumora_api_memory_search_idx",
+    "ALTER TABLE lumora_api_memory DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lumora_api', '0004_caretaker_patients'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({"sqlite": SQLITE_FORWARD, "postgresql": POSTGRES_FORWARD}),
+            _run({"sqlite": SQLITE_BACKWARD, "postgresql": POSTGRES_BACKWARD}),
+        ),
+    ]
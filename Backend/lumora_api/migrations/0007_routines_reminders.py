@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:38
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lumora_api', '0006_memory_images'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Routine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255)),
+                ('kind', models.CharField(choices=[('medication', 'Medication'), ('meal', 'Meal'), ('task', 'Task'), ('other', 'Other')], default='task', max_length=20)),
+                ('frequency', models.CharField(choices=[('once', 'Once'), ('daily', 'Daily'), ('weekly', 'Weekly'), ('interval', 'Every N minutes')], default='daily', max_length=10)),
+                ('times', models.JSONField(blank=True, default=list)),
+                ('weekdays', models.JSONField(blank=True, default=list)),
+                ('interval_minutes', models.PositiveIntegerField(blank=True, null=True)),
+                ('starts_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('ends_at', models.DateTimeField(blank=True, null=True)),
+                ('timezone', models.CharField(default='UTC', max_length=64)),
+                ('grace_minutes', models.PositiveIntegerField(default=30)),
+                ('active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='routines', to='lumora_api.patient')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Reminder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('due_at', models.DateTimeField()),
+                ('fired_at', models.DateTimeField()),
+                ('status', models.CharField(choices=[('fired', 'Fired'), ('done', 'Done'), ('missed', 'Missed')], default='fired', max_length=10)),
+                ('missed_after', models.DateTimeField()),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reminders', to='lumora_api.patient')),
+                ('routine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reminders', to='lumora_api.routine')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['patient', '-due_at'], name='reminder_patient_due_idx'), models.Index(fields=['status', 'missed_after'], name='reminder_missed_idx')],
+                'constraints': [models.UniqueConstraint(fields=('routine', 'due_at'), name='unique_reminder_due')],
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lumora_api', '0007_routines_reminders'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MoodObservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('observed_at', models.DateTimeField()),
+                ('mood', models.PositiveSmallIntegerField()),
+                ('valence', models.SmallIntegerField()),
+                ('rolled_up', models.BooleanField(default=False)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='moods', to='lumora_api.patient')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['patient', 'observed_at'], name='mood_patient_time_idx'), models.Index(condition=models.Q(('rolled_up', False)), fields=['id'], name='mood_pending_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MoodRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('week', 'Week'), ('month', 'Month')], max_length=5)),
+                ('start', models.DateField()),
+                ('count', models.PositiveIntegerField()),
+                ('valence_sum', models.IntegerField()),
+                ('valence_min', models.SmallIntegerField()),
+                ('valence_max', models.SmallIntegerField()),
+                ('moods', models.JSONField()),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mood_rollups', to='lumora_api.patient')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('patient', 'period', 'start'), name='unique_mood_rollup')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+def fill_digests(apps, schema_editor):
+    """Digest existing memories, keeping the oldest copy of any a patient has more than once"""
+    ImportantMemory = apps.get_model("lumora_api", "ImportantMemory")
+    seen = set()
+    duplicates = []
+    for memory in ImportantMemory.objects.order_by("id").iterator():
+        memory.digest = hashlib.sha256(memory.text.encode()).hexdigest()
+        if (memory.patient_id, memory.digest) in seen:
+            duplicates.append(memory.id)
+        else:
+            seen.add((memory.patient_id, memory.digest))
+            memory.save(update_fields=["digest"])
+    ImportantMemory.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lumora_api', '0009_topic_buckets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importantmemory',
+            name='digest',
+            field=models.CharField(default='', editable=False, max_length=64),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_digests, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='importantmemory',
+            constraint=models.UniqueConstraint(fields=('patient', 'digest'), name='unique_important_memory'),
+        ),
+    ]
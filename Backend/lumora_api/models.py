@@ -1,19 +1,253 @@
+import hashlib
+
 from django.db import models
 from django.conf import settings
 from django.utils.timezone import now
 
 class Memory(models.Model):
+    patient = models.ForeignKey("Patient", on_delete=models.CASCADE, related_name="memories",
+                                null=True, blank=True)
     title = models.CharField(max_length=255)
     description = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name_plural = "Memories"
+        indexes = [
+            # one patient's memories, newest first, page by page
+            models.Index(fields=["patient", "-created_at", "-id"], name="memory_patient_created_idx"),
+        ]
 
     def __str__(self):
         return self.title
 
+class ImageBlob(models.Model):
+    """Uploaded image bytes, stored once under their SHA-256 however many memories attach them"""
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    content_type = models.CharField(max_length=50)
+    size = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+class MemoryImage(models.Model):
+    memory = models.ForeignKey(Memory, on_delete=models.CASCADE, related_name="images")
+    blob = models.ForeignKey(ImageBlob, on_delete=models.PROTECT, related_name="attachments")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["id"]
+
 class Patient(models.Model):
-    user = models.OneToOneField(User, on_delete=models.CASCADE)
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
+    date_of_birth = models.DateField(default=now)
 
 class Caretaker(models.Model):
-    user = models.OneToOneField(User, on_delete=models.CASCADE)
-    name = models.CharField(max_length=255)
\ No newline at end of file
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    patients = models.ManyToManyField(Patient, related_name="caretakers", blank=True)
+
+
+# What Lumora remembers about a patient, one row per fact instead of one JSON
+# file per patient, so several workers can write to it without losing updates
+
+class PersonalInfo(models.Model):
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name="personal_info")
+    key = models.CharField(max_length=255)
+    value = models.JSONField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "Personal info"
+        constraints = [
+            models.UniqueConstraint(fields=["patient", "key"], name="unique_personal_info_key"),
+        ]
+
+class Preference(models.Model):
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name="preferences")
+    key = models.CharField(max_length=255)
+    value = models.JSONField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["patient", "key"], name="unique_preference_key"),
+        ]
+
+def text_digest(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+class ImportantMemory(models.Model):
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name="important_memories")
+    text = models.TextField()
+    # sha256 of the text: a memory is stored once per patient, however many workers extract it
+    digest = models.CharField(max_length=64, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "Important memories"
+        constraints = [
+            models.UniqueConstraint(fields=["patient", "digest"], name="unique_important_memory"),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.digest = text_digest(self.text)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.text
+
+class TopicCount(models.Model):
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name="topics")
+    topic = models.CharField(max_length=255)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["patient", "topic"], name="unique_patient_topic"),
+        ]
+        indexes = [
+            models.Index(fields=["patient", "-count"], name="topic_count_idx"),
+        ]
+
+class ConversationTurn(models.Model):
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name="turns")
+    timestamp = models.DateTimeField()
+    message = models.TextField()
+    reply = models.TextField()
+    # archived turns have been summarized and left the assistant's live history
+    archived = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["patient", "archived", "timestamp"], name="turn_patient_time_idx"),
+        ]
+
+class ConversationSummary(models.Model):
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name="conversation_summaries")
+    # a day ("2025-03-14") or, once folded, a month ("2025-03")
+    period = models.CharField(max_length=10)
+    data = models.JSONField()
+
+    class Meta:
+        verbose_name_plural = "Conversation summaries"
+        constraints = [
+            models.UniqueConstraint(fields=["patient", "period"], name="unique_summary_period"),
+        ]
+
+
+# Routines (medication, meals, daily tasks) and the reminders they fire; see
+# recurrence.py for the schedule fields and scheduler.py for the engine
+
+class Routine(models.Model):
+    KINDS = [("medication", "Medication"), ("meal", "Meal"), ("task", "Task"), ("other", "Other")]
+    FREQUENCIES = [("once", "Once"), ("daily", "Daily"), ("weekly", "Weekly"), ("interval", "Every N minutes")]
+
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name="routines")
+    title = models.CharField(max_length=255)
+    kind = models.CharField(max_length=20, choices=KINDS, default="task")
+    frequency = models.CharField(max_length=10, choices=FREQUENCIES, default="daily")
+    # local "HH:MM" times of day (daily, weekly), weekdays with Monday = 0 (weekly)
+    times = models.JSONField(default=list, blank=True)
+    weekdays = models.JSONField(default=list, blank=True)
+    interval_minutes = models.PositiveIntegerField(null=True, blank=True)
+    # nothing fires before starts_at; a "once" routine fires at it, an interval counts from it
+    starts_at = models.DateTimeField(default=now)
+    ends_at = models.DateTimeField(null=True, blank=True)
+    timezone = models.CharField(max_length=64, default="UTC")
+    # a reminder not marked done this long after it was due counts as missed
+    grace_minutes = models.PositiveIntegerField(default=30)
+    active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # the scheduler picks up edits by this
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return self.title
+
+class Reminder(models.Model):
+    STATUSES = [("fired", "Fired"), ("done", "Done"), ("missed", "Missed")]
+
+    routine = models.ForeignKey(Routine, on_delete=models.CASCADE, related_name="reminders")
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name="reminders")
+    due_at = models.DateTimeField()
+    fired_at = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=STATUSES, default="fired")
+    missed_after = models.DateTimeField()
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # the scheduler resumes from each routine's last due_at after a restart
+            models.UniqueConstraint(fields=["routine", "due_at"], name="unique_reminder_due"),
+        ]
+        indexes = [
+            models.Index(fields=["patient", "-due_at"], name="reminder_patient_due_idx"),
+            models.Index(fields=["status", "missed_after"], name="reminder_missed_idx"),
+        ]
+
+
+# The mood of each conversation exchange (an index into AI/mood.py's MOODS) and
+# its daily / weekly / monthly aggregates; see moods.py
+
+class MoodObservation(models.Model):
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name="moods")
+    observed_at = models.DateTimeField()
+    mood = models.PositiveSmallIntegerField()
+    valence = models.SmallIntegerField()
+    # counted into MoodRollup yet
+    rolled_up = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["patient", "observed_at"], name="mood_patient_time_idx"),
+            models.Index(fields=["id"], condition=models.Q(rolled_up=False), name="mood_pending_idx"),
+        ]
+
+class MoodRollup(models.Model):
+    PERIODS = [("day", "Day"), ("week", "Week"), ("month", "Month")]
+
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name="mood_rollups")
+    period = models.CharField(max_length=5, choices=PERIODS)
+    # the first day of the period; weeks start on Monday
+    start = models.DateField()
+    count = models.PositiveIntegerField()
+    valence_sum = models.IntegerField()
+    valence_min = models.SmallIntegerField()
+    valence_max = models.SmallIntegerField()
+    # observations per mood, in MOODS order
+    moods = models.JSONField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["patient", "period", "start"], name="unique_mood_rollup"),
+        ]
+
+
+# Topic counts per day and per month, kept alongside the lifetime TopicCount
+# so top topics over any window read a few buckets; see topics.py
+
+class TopicBucket(models.Model):
+    PERIODS = [("day", "Day"), ("month", "Month")]
+
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name="topic_buckets")
+    period = models.CharField(max_length=5, choices=PERIODS)
+    start = models.DateField()
+    topic = models.CharField(max_length=255)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["patient", "period", "start", "topic"], name="unique_topic_bucket"),
+        ]
+
+class TopicTotal(models.Model):
+    """TopicBucket summed over every patient"""
+    period = models.CharField(max_length=5, choices=TopicBucket.PERIODS)
+    start = models.DateField()
+    topic = models.CharField(max_length=255)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["period", "start", "topic"], name="unique_topic_total"),
+        ]
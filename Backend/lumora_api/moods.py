@@ -0,0 +1,265 @@
+"""
+Mood trends: the moods of a patient's conversations, rolled up by day, week
+and month.
+
+The assistant stores one MoodObservation per exchange whose extracted
+emotional state names a mood (see AI/mood.py). ``rollup`` folds the ones not
+counted yet into MoodRollup rows, a batch at a time: each batch is grouped by
+patient and period in a handful of array operations, and the totals are added
+to the stored ones, so a run costs what arrived since the last, however long
+the history. Trend queries (``trends``) read only the rollups: a year of daily
+points for a patient is 365 rows rather than every exchange.
+
+Periods follow the server's TIME_ZONE: a day runs from local midnight, a week
+from Monday. Run ``manage.py rollup_moods`` from cron. Runs that overlap take
+turns batch by batch: on PostgreSQL and MySQL each batch holds a database
+lock while it reads and adds to the rollups, and the observations it claims
+are locked too (skipping any another run holds) where the database can.
+SQLite has one writer at a time, so there the later of two overlapping
+batches fails instead of counting anything twice.
+
+NumPy is optional; without it batches are grouped in plain Python, which
+gives the same rollups several times slower.
+"""
+import datetime
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from mood import MOODS, MOOD_LABELS, VALENCES
+
+from .caching import mark_changed
+from .models import MoodObservation, MoodRollup
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+PERIODS = ("day", "week", "month")
+# average days per period, to express a trend per period whatever the gaps
+PERIOD_DAYS = {"day": 1, "week": 7, "month": 365.25 / 12}
+EPOCH = datetime.date(1970, 1, 1)
+ROLLUP_FIELDS = ["count", "valence_sum", "valence_min", "valence_max", "moods"]
+# the database lock rollup batches take turns on
+LOCK_NAME = "lumora_api.mood_rollup"
+LOCK_KEY = 0x6C756D6F  # PostgreSQL advisory locks are keyed by integer
+
+
+def period_start(day, period):
+    """The first day of the period ``day`` falls in"""
+    if period == "week":
+        return day - datetime.timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day
+
+
+def _aggregate_python(patients, moments, moods, zone):
+    totals = {period: {} for period in PERIODS}
+    for patient_id, moment, mood in zip(patients, moments, moods):
+        day = timezone.localtime(moment, zone).date()
+        valence = VALENCES[mood]
+        for period in PERIODS:
+            key = (patient_id, period_start(day, period))
+            total = totals[period].get(key)
+            if total is None:
+                totals[period][key] = [1, valence, valence, valence, [int(index == mood) for index in range(len(MOODS))]]
+            else:
+                total[0] += 1
+                total[1] += valence
+                total[2] = min(total[2], valence)
+                total[3] = max(total[3], valence)
+                total[4][mood] += 1
+    return totals
+
+
+def _local_days(seconds, zone):
+    """Days since 1970-01-01 in ``zone`` of UTC timestamps"""
+    # UTC offsets only change on a quarter hour, so each distinct quarter
+    # hour is looked up once rather than each timestamp
+    quarters, inverse = np.unique(seconds // 900, return_inverse=True)
+    offsets = np.array([
+        datetime.datetime.fromtimestamp(int(quarter) * 900, zone).utcoffset().total_seconds() for quarter in quarters
+    ], dtype=np.int64)
+    return (seconds + offsets[inverse.reshape(-1)]) // 86400
+
+
+def _aggregate_numpy(patients, moments, moods, zone):
+    patients = np.asarray(patients, dtype=np.int64)
+    moods = np.asarray(moods, dtype=np.int64)
+    seconds = np.fromiter((moment.timestamp() for moment in moments), dtype=np.float64, count=len(moods))
+    valences = np.asarray(VALENCES, dtype=np.int64)[moods]
+    days = _local_days(np.floor(seconds).astype(np.int64), zone)
+    starts = {
+        "day": days,
+        # 1970-01-01 was a Thursday
+        "week": days - (days + 3) % 7,
+        "month": days.astype("datetime64[D]").astype("datetime64[M]").astype("datetime64[D]").astype(np.int64),
+    }
+
+    totals = {}
+    for period in PERIODS:
+        keys = (patients << 32) | starts[period]
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        # the first row of each (patient, start) group
+        bounds = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        counts = np.diff(np.r_[bounds, len(keys)])
+        group = np.repeat(np.arange(len(bounds)), counts)
+        ordered = valences[order]
+        mood_counts = np.bincount(group * len(MOODS) + moods[order], minlength=len(bounds) * len(MOODS))
+
+        group_keys = keys[bounds]
+        totals[period] = {
+            (patient_id, EPOCH + datetime.timedelta(days=start)): [count, total, low, high, mood_count]
+            for patient_id, start, count, total, low, high, mood_count in zip(
+                (group_keys >> 32).tolist(), (group_keys & 0xFFFFFFFF).tolist(), counts.tolist(),
+                np.add.reduceat(ordered, bounds).tolist(),
+                np.minimum.reduceat(ordered, bounds).tolist(),
+                np.maximum.reduceat(ordered, bounds).tolist(),
+                mood_counts.reshape(len(bounds), len(MOODS)).tolist(),
+            )
+        }
+    return totals
+
+
+def aggregate(patients, moments, moods, vectorized=True):
+    """
+    Per period, {(patient id, period start): [count, valence sum, min, max,
+    count per mood]} of parallel lists of observations
+    """
+    zone = timezone.get_default_timezone()
+    if not moods:
+        return {period: {} for period in PERIODS}
+    if vectorized and np is not None:
+        return _aggregate_numpy(patients, moments, moods, zone)
+    return _aggregate_python(patients, moments, moods, zone)
+
+
+def _merge(period, totals):
+    """Add a batch's totals to the stored rollups of the same periods"""
+    patient_ids = {patient_id for patient_id, _ in totals}
+    starts = [start for _, start in totals]
+    stored = MoodRollup.objects.filter(
+        period=period, patient_id__in=patient_ids, start__gte=min(starts), start__lte=max(starts),
+    ).values_list("patient_id", "start", *ROLLUP_FIELDS)
+    for patient_id, start, count, valence_sum, low, high, moods in stored:
+        total = totals.get((patient_id, start))
+        if total is not None:
+            total[0] += count
+            total[1] += valence_sum
+            total[2] = min(total[2], low)
+            total[3] = max(total[3], high)
+            # moods added to MOODS since the row was written count from zero
+            total[4] = [a + b for a, b in zip(total[4], moods + [0] * (len(MOODS) - len(moods)))]
+
+    MoodRollup.objects.bulk_create(
+        [
+            MoodRollup(patient_id=patient_id, period=period, start=start, count=count, valence_sum=valence_sum,
+                       valence_min=low, valence_max=high, moods=moods)
+            for (patient_id, start), (count, valence_sum, low, high, moods) in totals.items()
+        ],
+        batch_size=1000, update_conflicts=True, unique_fields=["patient", "period", "start"],
+        update_fields=ROLLUP_FIELDS,
+    )
+
+
+@contextmanager
+def _batch_lock():
+    """Hold the rollup lock for one batch; call inside its transaction"""
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            # released when the transaction ends
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [LOCK_KEY])
+        elif connection.vendor == "mysql":
+            cursor.execute("SELECT GET_LOCK(%s, -1)", [LOCK_NAME])
+    try:
+        yield
+    finally:
+        if connection.vendor == "mysql":
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", [LOCK_NAME])
+
+
+def rollup(batch_size=50000, vectorized=True):
+    """Fold every observation not yet counted into the rollups; returns how many there were"""
+    done = 0
+    while True:
+        with transaction.atomic(), _batch_lock():
+            pending = MoodObservation.objects.filter(rolled_up=False)
+            if connection.features.has_select_for_update_skip_locked:
+                pending = pending.select_for_update(skip_locked=True)
+            rows = list(pending.order_by("id").values_list("id", "patient_id", "observed_at", "mood")[:batch_size])
+            if not rows:
+                break
+            ids, patients, moments, moods = map(list, zip(*rows))
+            for period, totals in aggregate(patients, moments, moods, vectorized).items():
+                _merge(period, totals)
+            # by id, not id range: a row committed since the select has not been counted
+            chunk = connection.ops.bulk_batch_size(["id"], ids)
+            for start in range(0, len(ids), chunk):
+                MoodObservation.objects.filter(id__in=ids[start:start + chunk]).update(rolled_up=True)
+        done += len(rows)
+    if done:
+        mark_changed(MoodRollup._meta.label_lower)
+    return done
+
+
+def _slope(xs, ys):
+    """Least-squares slope of ys against xs, or None for fewer than two points"""
+    if len(xs) < 2:
+        return None
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    spread = sum((x - mean_x) ** 2 for x in xs)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / spread
+
+
+def trends(patient_ids, period="day", start=None, end=None):
+    """
+    Each patient's mood per ``period`` between the ``start`` and ``end``
+    dates (inclusive), with a summary: mean valence (-2 to 2), its trend per
+    period (least squares over the period means; positive is improving) and
+    the most frequent mood
+    """
+    rollups = MoodRollup.objects.filter(patient_id__in=patient_ids, period=period)
+    if start is not None:
+        rollups = rollups.filter(start__gte=period_start(start, period))
+    if end is not None:
+        rollups = rollups.filter(start__lte=end)
+
+    points = {patient_id: [] for patient_id in patient_ids}
+    for row in rollups.order_by("patient_id", "start").values_list("patient_id", "start", *ROLLUP_FIELDS):
+        points[row[0]].append(row[1:])
+
+    results = []
+    for patient_id, rows in points.items():
+        count = sum(row[1] for row in rows)
+        moods = [sum(row[5][index] for row in rows if index < len(row[5])) for index in range(len(MOODS))]
+        means = [row[2] / row[1] for row in rows]
+        slope = _slope([(row[0] - rows[0][0]).days / PERIOD_DAYS[period] for row in rows], means)
+        results.append({
+            "patient": patient_id,
+            "period": period,
+            "summary": {
+                "count": count,
+                "mean_valence": round(sum(row[2] for row in rows) / count, 3) if count else None,
+                "trend": round(slope, 4) if slope is not None else None,
+                "dominant_mood": MOOD_LABELS[moods.index(max(moods))] if count else None,
+                "moods": dict(zip(MOOD_LABELS, moods)),
+            },
+            "points": [
+                {
+                    "start": row[0],
+                    "count": row[1],
+                    "mean_valence": round(mean, 3),
+                    "min_valence": row[3],
+                    "max_valence": row[4],
+                    "moods": {label: n for label, n in zip(MOOD_LABELS, row[5]) if n},
+                }
+                for row, mean in zip(rows, means)
+            ],
+        })
+    return results
@@ -0,0 +1,25 @@
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Newest first, one page at a time.
+
+    A cursor is a position in the ``created_at`` index rather than an offset,
+    so fetching page 500 costs the same as page 1 and rows added meanwhile
+    don't shift or repeat items between pages.
+    """
+    ordering = ("-created_at", "-id")
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+
+
+class IdCursorPagination(CreatedAtCursorPagination):
+    """For models without a ``created_at``: in creation order by primary key"""
+    ordering = "id"
+
+
+class DueAtCursorPagination(CreatedAtCursorPagination):
+    """Reminders, most recently due first"""
+    ordering = ("-due_at", "-id")
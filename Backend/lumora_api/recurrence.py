@@ -0,0 +1,98 @@
+"""
+When a routine fires next.
+
+Times of day are local to the routine's timezone, so "08:00 daily" stays at
+08:00 across daylight-saving changes. A time that does not exist on the day
+the clocks go forward fires at the same wall-clock offset after the jump
+(02:30 becomes 03:30); a time that happens twice when they go back fires once,
+at the first.
+"""
+import datetime
+from collections import namedtuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+
+Rule = namedtuple("Rule", "frequency times weekdays interval starts_at ends_at zone")
+
+
+def parse_time(value):
+    """"HH:MM" -> datetime.time, ValueError otherwise"""
+    hours, _, minutes = value.partition(":")
+    return datetime.time(int(hours), int(minutes))
+
+
+def parse_zone(name):
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"unknown timezone {name!r}")
+
+
+def rule_for(routine):
+    """The schedule part of a Routine (or anything with its fields)"""
+    return Rule(
+        frequency=routine.frequency,
+        times=sorted(parse_time(value) for value in routine.times or ()),
+        weekdays=frozenset(routine.weekdays or ()),
+        interval=datetime.timedelta(minutes=routine.interval_minutes or 0),
+        starts_at=routine.starts_at,
+        ends_at=routine.ends_at,
+        zone=parse_zone(routine.timezone),
+    )
+
+
+def validate(frequency, times, weekdays, interval_minutes, zone):
+    """Problems with a routine's schedule fields, as {field: message}"""
+    errors = {}
+    if frequency in ("daily", "weekly"):
+        if not times:
+            errors["times"] = "at least one HH:MM time is required"
+        else:
+            try:
+                for value in times:
+                    parse_time(value)
+            except (AttributeError, TypeError, ValueError):
+                errors["times"] = "times must be HH:MM strings"
+    if frequency == "weekly":
+        if not weekdays or not all(isinstance(day, int) and 0 <= day <= 6 for day in weekdays):
+            errors["weekdays"] = "weekly routines need weekdays, 0 (Monday) to 6 (Sunday)"
+    if frequency == "interval" and not interval_minutes:
+        errors["interval_minutes"] = "is required for interval routines"
+    try:
+        parse_zone(zone)
+    except ValueError as error:
+        errors["timezone"] = str(error)
+    return errors
+
+
+def next_fire(rule, after):
+    """The first time the rule fires strictly after ``after`` (aware), or None once it is over"""
+    # nothing fires before the start
+    after = max(after, rule.starts_at - datetime.timedelta(microseconds=1))
+    moment = None
+
+    if rule.frequency == "once":
+        moment = rule.starts_at if rule.starts_at > after else None
+
+    elif rule.frequency == "interval":
+        steps = (after - rule.starts_at) // rule.interval + 1
+        moment = rule.starts_at + max(steps, 0) * rule.interval
+
+    elif rule.times:
+        day = after.astimezone(rule.zone).date()
+        # a weekly rule fires within eight days of any moment
+        for offset in range(8):
+            date = day + datetime.timedelta(days=offset)
+            if rule.frequency == "weekly" and date.weekday() not in rule.weekdays:
+                continue
+            for time in rule.times:
+                candidate = datetime.datetime.combine(date, time, tzinfo=rule.zone).astimezone(datetime.timezone.utc)
+                if candidate > after:
+                    moment = candidate
+                    break
+            if moment is not None:
+                break
+
+    if moment is None or (rule.ends_at is not None and moment > rule.ends_at):
+        return None
+    return moment
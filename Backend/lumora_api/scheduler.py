@@ -0,0 +1,270 @@
+"""
+The reminder engine: one process fires every patient's routines.
+
+Each active routine has one entry, its next fire time, in a heap, so finding
+what is due costs nothing however many routines there are and the loop sleeps
+until exactly the next one. A tick pops every due entry and writes their
+reminders with one batched insert, then pushes each routine's following time.
+
+Nothing but the reminders is persisted: after a restart ``load`` resumes each
+routine from its last reminder (or its last edit), so occurrences that
+fell due while the scheduler was down are fired late, or recorded as missed
+once they are past their grace period. Edits reach a running scheduler
+through one query for routines updated since the last look, every
+``sync_interval`` seconds; deleted or deactivated routines are dropped when
+they next come due. An edited or reactivated routine resumes after its last
+reminder too, and the insert skips any (routine, due time) already written,
+so no occurrence fires twice.
+
+A fired reminder is missed if nobody marks it done within its routine's
+grace period; a second heap of those deadlines says when one UPDATE should
+sweep them.
+"""
+import time
+import heapq
+import logging
+import datetime
+
+from django.db import connection, transaction
+from django.db.models import Max
+from django.db.models.constants import OnConflict
+
+from .models import Routine, Reminder
+from .recurrence import next_fire, rule_for
+
+
+UTC = datetime.timezone.utc
+# catching up after downtime goes back at most this far, and writes at most
+# MAX_CATCH_UP occurrences per routine
+CATCH_UP_WINDOW = datetime.timedelta(days=1)
+MAX_CATCH_UP = 50
+
+logger = logging.getLogger(__name__)
+
+
+def _ts(moment):
+    return moment.timestamp()
+
+
+def _moment(ts):
+    return datetime.datetime.fromtimestamp(ts, UTC)
+
+
+class _Entry:
+    """What the scheduler keeps per active routine"""
+    __slots__ = ("rule", "patient_id", "grace", "next_ts", "last_ts", "updated_ts")
+
+    def __init__(self, rule, patient_id, grace, updated_ts):
+        self.rule, self.patient_id, self.grace, self.updated_ts = rule, patient_id, grace, updated_ts
+        self.next_ts = self.last_ts = None
+
+
+class ReminderScheduler:
+    def __init__(self, on_fire=None, sync_interval=1.0, batch_size=2000, clock=time.time):
+        # on_fire(reminders) runs after each tick's reminders are committed (as unsaved
+        # Reminder instances: they are written without reading their ids back)
+        self.on_fire = on_fire
+        self.sync_interval = sync_interval
+        self.batch_size = batch_size
+        self.clock = clock
+        self.heap = []          # (fire timestamp, routine id)
+        self.deadlines = []     # missed_after timestamps of fired reminders
+        self.routines = {}      # routine id -> _Entry
+        self.synced_at = None
+        self.stats = {"fired": 0, "late": 0, "missed": 0, "swept": 0, "ticks": 0}
+
+    def _schedule(self, routine_id, entry, after):
+        """Queue the routine's first fire time after ``after``, superseding whatever was queued"""
+        moment = next_fire(entry.rule, after)
+        if moment is None:
+            self.routines.pop(routine_id, None)
+            return
+        entry.next_ts = _ts(moment)
+        self.routines[routine_id] = entry
+        heapq.heappush(self.heap, (entry.next_ts, routine_id))
+
+    def _add(self, routine, last_due=None):
+        """
+        Schedule a new or edited routine. Times that fell due within its grace
+        period before the edit still fire; none fires twice.
+        """
+        try:
+            rule = rule_for(routine)
+        except ValueError as error:
+            logger.warning("Skipping routine %s: %s", routine.id, error)
+            return
+        grace = datetime.timedelta(minutes=routine.grace_minutes)
+        entry = _Entry(rule, routine.patient_id, grace, _ts(routine.updated_at))
+        previous = self.routines.get(routine.id)
+        if previous is not None and previous.last_ts is not None:
+            last_due = max(filter(None, (last_due, _moment(previous.last_ts))))
+        after = max(routine.updated_at - grace, _moment(self.clock()) - CATCH_UP_WINDOW)
+        if last_due is not None:
+            entry.last_ts = _ts(last_due)
+            after = max(after, last_due)
+        self._schedule(routine.id, entry, after)
+
+    def load(self):
+        """
+        (Re)build the queues from the database; this is all crash recovery
+        needs. Run one scheduler per database: two would fire everything twice.
+        """
+        self.heap, self.deadlines, self.routines = [], [], {}
+        self.synced_at = _moment(self.clock())
+        # older reminders are outside the catch-up window anyway
+        last_due = self._last_due(Reminder.objects.filter(due_at__gte=self.synced_at - CATCH_UP_WINDOW))
+        for routine in Routine.objects.filter(active=True).iterator(chunk_size=5000):
+            self._add(routine, last_due.get(routine.id))
+        heapq.heapify(self.heap)
+        self.deadlines = [_ts(moment) for moment in
+                          Reminder.objects.filter(status="fired").values_list("missed_after", flat=True)]
+        heapq.heapify(self.deadlines)
+        self.sweep()
+
+    def sync(self):
+        """Pick up routines created or edited since the last look"""
+        now = _moment(self.clock())
+        # rows committed a little after their updated_at are still seen
+        changed = Routine.objects.filter(updated_at__gt=self.synced_at - datetime.timedelta(seconds=5))
+        added = []
+        for routine in changed:
+            if not routine.active:
+                self.routines.pop(routine.id, None)
+                continue
+            known = self.routines.get(routine.id)
+            if known is not None and known.updated_ts >= _ts(routine.updated_at):
+                continue
+            added.append(routine)
+        # a routine edited after it fired, or deactivated and reactivated, was
+        # dropped from the queue and resumes after its last reminder
+        last_due = {}
+        for start in range(0, len(added), self.batch_size):
+            ids = [routine.id for routine in added[start:start + self.batch_size]]
+            last_due.update(self._last_due(Reminder.objects.filter(routine_id__in=ids)))
+        for routine in added:
+            self._add(routine, last_due.get(routine.id))
+        self.synced_at = now
+
+    @staticmethod
+    def _last_due(reminders):
+        """Routine id -> due time of its latest reminder among ``reminders``"""
+        return dict(reminders.values("routine").annotate(last=Max("due_at")).values_list("routine", "last"))
+
+    def tick(self):
+        """Fire everything due by now; returns the reminders written"""
+        now_ts = self.clock()
+        due = []
+        while self.heap and self.heap[0][0] <= now_ts:
+            ts, routine_id = heapq.heappop(self.heap)
+            entry = self.routines.get(routine_id)
+            # stale entries were superseded by a later _schedule (perhaps for the same time)
+            if entry is not None and entry.next_ts == ts:
+                entry.next_ts = None
+                due.append((routine_id, ts))
+        if not due:
+            return []
+        self.stats["ticks"] += 1
+
+        ids = [routine_id for routine_id, _ in due]
+        live = set()
+        for start in range(0, len(ids), self.batch_size):
+            live.update(Routine.objects.filter(id__in=ids[start:start + self.batch_size], active=True)
+                        .values_list("id", flat=True))
+
+        now = _moment(now_ts)
+        reminders = []
+        for routine_id, ts in due:
+            entry = self.routines.pop(routine_id)
+            if routine_id not in live:
+                continue
+            rule, grace = entry.rule, entry.grace
+            moment, count = _moment(ts), 0
+            while moment is not None and moment <= now:
+                missed = now - moment > grace
+                reminders.append(Reminder(
+                    routine_id=routine_id, patient_id=entry.patient_id, due_at=moment, fired_at=now,
+                    status="missed" if missed else "fired", missed_after=moment + grace,
+                ))
+                self.stats["missed" if missed else "fired"] += 1
+                if now - moment > datetime.timedelta(seconds=1):
+                    self.stats["late"] += 1
+                entry.last_ts, count = _ts(moment), count + 1
+                moment = next_fire(rule, moment)
+                if count >= MAX_CATCH_UP and moment is not None and moment <= now:
+                    # skip the rest of a long outage rather than write every occurrence
+                    moment = next_fire(rule, max(now - grace, _moment(entry.last_ts)))
+            if moment is not None:
+                entry.next_ts = _ts(moment)
+                self.routines[routine_id] = entry
+                heapq.heappush(self.heap, (entry.next_ts, routine_id))
+
+        self._insert(reminders, now)
+        for reminder in reminders:
+            if reminder.status == "fired":
+                heapq.heappush(self.deadlines, _ts(reminder.missed_after))
+        if self.on_fire is not None:
+            self.on_fire(reminders)
+        return reminders
+
+    def _insert(self, reminders, now):
+        # executemany skips bulk_create's per-field SQL compilation, which is
+        # most of the time spent when a few thousand routines share a due time
+        adapt = connection.ops.adapt_datetimefield_value
+        fired_at = adapt(now)
+        rows = [(reminder.routine_id, reminder.patient_id, adapt(reminder.due_at), fired_at, reminder.status,
+                 adapt(reminder.missed_after)) for reminder in reminders]
+        # an occurrence already written (e.g. by an overlapping run) is skipped, not an error
+        insert = connection.ops.insert_statement(on_conflict=OnConflict.IGNORE)
+        suffix = connection.ops.on_conflict_suffix_sql([], OnConflict.IGNORE, None, None)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(
+                f"{insert} {Reminder._meta.db_table} "
+                f"(routine_id, patient_id, due_at, fired_at, status, missed_after) VALUES (%s, %s, %s, %s, %s, %s) "
+                f"{suffix}",
+                rows,
+            )
+
+    def sweep(self):
+        """Mark fired reminders whose grace period has passed as missed"""
+        now_ts = self.clock()
+        if not self.deadlines or self.deadlines[0] > now_ts:
+            return 0
+        while self.deadlines and self.deadlines[0] <= now_ts:
+            heapq.heappop(self.deadlines)
+        swept = Reminder.objects.filter(status="fired", missed_after__lte=_moment(now_ts)).update(status="missed")
+        self.stats["swept"] += swept
+        return swept
+
+    def next_wakeup(self):
+        """Seconds until something is due, capped by the sync interval"""
+        moments = [self.synced_at.timestamp() + self.sync_interval]
+        if self.heap:
+            moments.append(self.heap[0][0])
+        if self.deadlines:
+            moments.append(self.deadlines[0])
+        return max(0.0, min(moments) - self.clock())
+
+    def run(self, stop):
+        """
+        Fire reminders until the ``stop`` event is set. A failed step is logged
+        and the queues are rebuilt from the database, which is all the state a
+        tick that failed half way could have lost.
+        """
+        loaded = False
+        while not stop.is_set():
+            try:
+                if not loaded:
+                    self.load()
+                    loaded = True
+                self.tick()
+                self.sweep()
+                if self.clock() >= self.synced_at.timestamp() + self.sync_interval:
+                    self.sync()
+            except Exception:
+                logger.exception("Reminder scheduler step failed; reloading from the database")
+                loaded = False
+                # a broken connection is replaced on the next query
+                connection.close()
+                stop.wait(self.sync_interval)
+                continue
+            stop.wait(self.next_wakeup())
@@ -0,0 +1,106 @@
+"""
+Full-text search over memories.
+
+SQLite keeps an FTS5 index (``lumora_api_memory_fts``) in sync with the
+memory table through triggers; Postgres keeps a generated ``search_vector``
+tsvector column with a GIN index. Both are created by migration
+0005_memory_search. Other databases fall back to an unindexed ``icontains``.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Memory
+
+
+FTS_TABLE = "lumora_api_memory_fts"
+
+# ts_headline / snippet markers around matched words
+MARK_START, MARK_END = "<mark>", "</mark>"
+
+
+def fts_query(text, patient_id=None):
+    """
+    User input -> FTS5 MATCH expression: every word must match the title or
+    description, the last one as a prefix, and quotes keep FTS5 syntax
+    characters in the input harmless
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    match = "{title description} : (" + " ".join(terms) + ")"
+    if patient_id is not None:
+        match += f' AND patient_id : "{int(patient_id)}"'
+    return match
+
+
+def filter_matching(queryset, text):
+    """``queryset`` narrowed to memories matching ``text``, through the index"""
+    if connection.vendor == "sqlite":
+        match = fts_query(text)
+        if match is None:
+            return queryset.none()
+        return queryset.filter(id__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match]))
+    if connection.vendor == "postgresql":
+        return queryset.filter(id__in=RawSQL(
+            "SELECT id FROM lumora_api_memory WHERE search_vector @@ websearch_to_tsquery('english', %s)", [text]
+        ))
+    return queryset.filter(Q(title__icontains=text) | Q(description__icontains=text))
+
+
+def search_memories(text, patient_id=None, limit=20):
+    """
+    The best ``limit`` memories for ``text``, best first, as Memory objects with
+    ``rank`` (higher is better) and ``snippet`` (matched words in <mark>)
+    attributes; the description itself is not loaded
+    """
+    if connection.vendor == "sqlite":
+        match = fts_query(text, patient_id)
+        if match is None:
+            return []
+        # bm25 is lower for better matches; title hits weigh double
+        return list(Memory.objects.raw(f"""
+            SELECT m.id, m.title, m.created_at, m.patient_id,
+                   -bm25({FTS_TABLE}, 2.0, 1.0, 0.0) AS rank,
+                   snippet({FTS_TABLE}, 1, '{MARK_START}', '{MARK_END}', '…', 16) AS snippet
+            FROM {FTS_TABLE} JOIN lumora_api_memory m ON m.id = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH %s
+            ORDER BY bm25({FTS_TABLE}, 2.0, 1.0, 0.0)
+            LIMIT %s
+        """, [match, limit]))
+
+    if connection.vendor == "postgresql":
+        params = [text]
+        patient_clause = ""
+        if patient_id is not None:
+            patient_clause = "AND m.patient_id = %s"
+            params.append(patient_id)
+        params.append(limit)
+        # ts_headline re-parses the description, so it only runs on the rows returned
+        return list(Memory.objects.raw(f"""
+            SELECT id, title, created_at, patient_id, rank,
+                   ts_headline('english', description, query,
+                               'StartSel={MARK_START}, StopSel={MARK_END}, MaxWords=30, MinWords=10') AS snippet
+            FROM (
+                SELECT m.id, m.title, m.created_at, m.patient_id, m.description, q AS query,
+                       ts_rank(m.search_vector, q) AS rank
+                FROM lumora_api_memory m, websearch_to_tsquery('english', %s) q
+                WHERE m.search_vector @@ q {patient_clause}
+                ORDER BY rank DESC
+                LIMIT %s
+            ) best
+            ORDER BY rank DESC
+        """, params))
+
+    queryset = filter_matching(Memory.objects.all(), text)
+    if patient_id is not None:
+        queryset = queryset.filter(patient_id=patient_id)
+    results = list(queryset.order_by("-created_at")[:limit])
+    for memory in results:
+        memory.rank = 0.0
+        memory.snippet = memory.description[:200]
+    return results
@@ -1,21 +1,120 @@
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Memory, Patient, Caretaker
+from .models import Memory, MemoryImage, Patient, Caretaker, Routine, Reminder
+from .recurrence import next_fire, rule_for, validate
+
+def requested_fields(request):
+    """Field names asked for with ``?fields=id,title``, or None for all of them"""
+    if request is None or not request.query_params.get("fields"):
+        return None
+    return {name.strip() for name in request.query_params["fields"].split(",") if name.strip()}
+
+
+class SparseFieldsMixin:
+    """Drops the fields not named in ``?fields=``, e.g. a memory's long description in list views"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # nested serializers are bound to their parent later, and keep all their fields
+        fields = requested_fields(self._context.get("request"))
+        if fields:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+
+
+class MemoryImageSerializer(serializers.ModelSerializer):
+    """An attached image: links to the original and to each thumbnail size, which is what lists should show"""
+    sha256 = serializers.CharField(source="blob_id", read_only=True)
+    url = serializers.SerializerMethodField()
+    thumbnails = serializers.SerializerMethodField()
+
+    class Meta:
+        model = MemoryImage
+        fields = ('id', 'sha256', 'created_at', 'url', 'thumbnails')
+
+    def _link(self, url):
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request else url
+
+    def get_url(self, image):
+        return self._link(reverse("blob", args=[image.blob_id]))
+
+    def get_thumbnails(self, image):
+        return {name: self._link(reverse("blob-thumbnail", args=[image.blob_id, name]))
+                for name in settings.LUMORA_THUMBNAIL_SIZES}
 
 #serializers - convert mongoDB data into JSON (so we can send it using API)
-class MemorySerializer(serializers.ModelSerializer):
+class MemorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    images = MemoryImageSerializer(many=True, read_only=True)
+
     class Meta:
         model = Memory
         fields = '__all__'  
 
-class PatientSerializer(serializers.ModelSerializer):
-    memories = MemorySerializer(many=True) 
+class MemorySearchResultSerializer(serializers.ModelSerializer):
+    rank = serializers.FloatField(read_only=True)
+    # matched words are wrapped in <mark></mark>
+    snippet = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = Memory
+        fields = ('id', 'patient', 'title', 'created_at', 'rank', 'snippet')
+
+# Nested relations are read-only; the viewsets prefetch them so a list costs
+# the same number of queries however many rows it has
+class PatientSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    memories = MemorySerializer(many=True, read_only=True)
 
     class Meta:
         model = Patient
         fields = '__all__'
 
-class CaretakerSerializer(serializers.ModelSerializer):
-    patient = PatientSerializer() 
+class CaretakerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    patients = PatientSerializer(many=True, read_only=True)
+    # caretakers are assigned patients by id
+    patient_ids = serializers.PrimaryKeyRelatedField(
+        many=True, source="patients", queryset=Patient.objects.all(), write_only=True, required=False
+    )
+
     class Meta:
         model = Caretaker
         fields = '__all__'
+
+class RoutineSerializer(serializers.ModelSerializer):
+    # when the routine fires next, in UTC; null once it is over or paused
+    next_fire_at = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Routine
+        fields = '__all__'
+
+    def validate(self, attrs):
+        def value(name):
+            if name in attrs:
+                return attrs[name]
+            if self.instance is not None:
+                return getattr(self.instance, name)
+            return Routine._meta.get_field(name).get_default()
+
+        errors = validate(value("frequency"), value("times"), value("weekdays"),
+                          value("interval_minutes"), value("timezone"))
+        if errors:
+            raise serializers.ValidationError(errors)
+        return attrs
+
+    def get_next_fire_at(self, routine):
+        if not routine.active:
+            return None
+        moment = next_fire(rule_for(routine), timezone.now())
+        return serializers.DateTimeField().to_representation(moment) if moment else None
+
+class ReminderSerializer(serializers.ModelSerializer):
+    routine_title = serializers.CharField(source="routine.title", read_only=True)
+
+    class Meta:
+        model = Reminder
+        fields = ('id', 'routine', 'routine_title', 'patient', 'due_at', 'fired_at', 'status',
+                  'missed_after', 'completed_at')
+        read_only_fields = fields
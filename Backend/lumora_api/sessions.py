@@ -0,0 +1,220 @@
+import os
+import time
+import asyncio
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+
+class SessionManager:
+    """
+    Live assistants for the patients currently talking to Lumora.
+
+    A patient's memory is loaded the first time they send a message. At most
+    ``max_sessions`` assistants stay in memory; the least recently used one
+    is evicted beyond that, as is any session idle for ``idle_timeout``
+    seconds. Evicting a session finishes its pending memory extraction and
+    compacts its memory journal before the assistant is dropped, and a
+    patient whose session is still closing waits for it before reloading.
+
+    With ``store="database"`` memory lives in the lumora_api tables, which
+    several workers can share, and each session rebuilds its search index
+    from them; with ``store="json"`` ``memory_dir`` holds each patient's
+    journaled memory file and index.
+    """
+
+    def __init__(self, memory_dir, max_sessions=200, idle_timeout=30 * 60, limiter=None, store="database"):
+        self.memory_dir = memory_dir
+        self.store = store
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.limiter = limiter
+
+        self._sessions = OrderedDict()
+        self._loading = {}
+        self._closing = {}
+        self.stats = {"loads": 0, "hits": 0, "evictions": 0}
+        # sessions being closed, and the counters of those already closed, so
+        # totals over all sessions don't drop when one is evicted
+        self._retiring = set()
+        self._retired = Counter()
+
+    def memory_file(self, patient_id):
+        return os.path.join(self.memory_dir, f"patient_{patient_id}.json")
+
+    def __len__(self):
+        return len(self._sessions)
+
+    async def get(self, patient_id):
+        """The patient's AsyncLumoraAssistant, loading their memory if needed"""
+        self.evict_idle()
+
+        session = self._sessions.get(patient_id)
+        if session is not None:
+            self._sessions.move_to_end(patient_id)
+            session[1] = time.monotonic()
+            self.stats["hits"] += 1
+            return session[0]
+
+        # concurrent first messages from one patient share a single load
+        loading = self._loading.get(patient_id)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(patient_id))
+            self._loading[patient_id] = loading
+            loading.add_done_callback(lambda _: self._loading.pop(patient_id, None))
+        return await asyncio.shield(loading)
+
+    async def _load(self, patient_id):
+        from chat import LumoraAssistant
+        from async_chat import AsyncLumoraAssistant
+
+        closing = self._closing.get(patient_id)
+        if closing is not None:
+            await closing
+
+        assistant = await asyncio.to_thread(self._open, LumoraAssistant, patient_id)
+        cleanup = close_old_connections if self.store == "database" else None
+        session = AsyncLumoraAssistant(assistant, limiter=self.limiter, cleanup=cleanup)
+        self._sessions[patient_id] = [session, time.monotonic()]
+        self.stats["loads"] += 1
+
+        while len(self._sessions) > self.max_sessions:
+            self._evict(next(iter(self._sessions)))
+        return session
+
+    def _open(self, assistant_class, patient_id):
+        if self.store == "database":
+            from .memory_db import DatabaseMemoryStore, DatabaseHistoryArchive, DatabaseMoodLog
+
+            # runs in a worker thread, whose connection is closed like a request's
+            try:
+                return assistant_class(
+                    memory_file=self.memory_file(patient_id),
+                    store=DatabaseMemoryStore(patient_id),
+                    archive=DatabaseHistoryArchive(patient_id),
+                    moods=DatabaseMoodLog(patient_id),
+                    persist_index=False,
+                    # the extraction thread closes its connections after each batch
+                    thread_cleanup=connections.close_all,
+                )
+            finally:
+                close_old_connections()
+        os.makedirs(self.memory_dir, exist_ok=True)
+        return assistant_class(memory_file=self.memory_file(patient_id))
+
+    def _evict(self, patient_id):
+        """Start flushing one patient's session in the background and drop it"""
+        session = self._sessions.pop(patient_id, None)
+        if session is None:
+            return self._closing.get(patient_id)
+
+        self.stats["evictions"] += 1
+        # close() waits for a turn in progress to finish first
+        closing = asyncio.ensure_future(session[0].close())
+        self._closing[patient_id] = closing
+        self._retiring.add(session[0])
+
+        def done(future):
+            if self._closing.get(patient_id) is future:
+                del self._closing[patient_id]
+            self._retiring.discard(session[0])
+            self._retired.update(_assistant_counters(session[0].assistant))
+
+        closing.add_done_callback(done)
+        return closing
+
+    async def evict(self, patient_id):
+        """Flush and drop one patient's session"""
+        closing = self._evict(patient_id)
+        if closing is not None:
+            await closing
+
+    def evict_idle(self):
+        """Evict every session that has been idle longer than idle_timeout"""
+        cutoff = time.monotonic() - self.idle_timeout
+        # sessions are kept in least-recently-used order
+        while self._sessions:
+            patient_id, (_, last_used) = next(iter(self._sessions.items()))
+            if last_used >= cutoff:
+                break
+            self._evict(patient_id)
+
+    async def close(self):
+        """Flush and drop every session, e.g. on shutdown"""
+        for patient_id in list(self._sessions):
+            self._evict(patient_id)
+        if self._closing:
+            await asyncio.gather(*self._closing.values())
+
+
+    def assistant_metrics(self):
+        """Reply cache, extraction and extraction gate counters summed over every session, and live gauges"""
+        totals = Counter(self._retired)
+        entries, depth, lag = 0, 0, 0.0
+        for session in [session for session, _ in self._sessions.values()] + list(self._retiring):
+            assistant = session.assistant
+            totals.update(_assistant_counters(assistant))
+            entries += len(assistant.responses)
+            depth += assistant.extraction.queue_depth
+            lag = max(lag, assistant.extraction.stats["last_lag"])
+        lookups = totals["lumora_response_cache_hits_total"] + totals["lumora_response_cache_misses_total"]
+        samples = [(name, "counter", (), value) for name, value in totals.items()]
+        samples += [
+            ("lumora_response_cache_entries", "gauge", (), entries),
+            ("lumora_response_cache_hit_rate", "gauge", (),
+             totals["lumora_response_cache_hits_total"] / lookups if lookups else 0.0),
+            ("lumora_extraction_queue_depth", "gauge", (), depth),
+            ("lumora_extraction_lag_seconds", "gauge", (), lag),
+        ]
+        return samples
+
+
+def _assistant_counters(assistant):
+    """One assistant's reply cache, extraction and gate counters, by metric name"""
+    counters = Counter()
+    for name, value in assistant.responses.stats.items():
+        counters[f"lumora_response_cache_{name}_total"] += value
+    stats = assistant.extraction.stats
+    for name in ("submitted", "extracted", "batches", "failed_batches"):
+        counters[f"lumora_extraction_{name}_total"] += stats[name]
+    counters["lumora_extraction_seconds_total"] += stats["extract_seconds"]
+    for name, value in assistant.extraction_gate.stats.items():
+        counters[f"lumora_extraction_gate_{name}_total"] += value
+    counters["lumora_extraction_calls_saved_total"] += assistant.extraction_gate.calls_saved
+    return counters
+
+
+_manager = None
+
+
+def get_session_manager():
+    """The worker process's SessionManager, configured from settings"""
+    global _manager
+    if _manager is None:
+        limit = getattr(settings, "LUMORA_MAX_CONCURRENT_MODEL_CALLS", None)
+        _manager = SessionManager(
+            memory_dir=str(settings.LUMORA_MEMORY_DIR),
+            max_sessions=settings.LUMORA_MAX_SESSIONS,
+            idle_timeout=settings.LUMORA_SESSION_IDLE_TIMEOUT,
+            limiter=asyncio.Semaphore(limit) if limit else None,
+            store=getattr(settings, "LUMORA_MEMORY_STORE", "database"),
+        )
+    return _manager
+
+
+def session_metrics():
+    """The worker's live sessions and session counters, for /metrics"""
+    if _manager is None:
+        return []
+    samples = [("lumora_sessions", "gauge", (), len(_manager)),
+               ("lumora_sessions_closing", "gauge", (), len(_manager._closing))]
+    samples += [(f"lumora_session_{name}_total", "counter", (), value) for name, value in _manager.stats.items()]
+    return samples
+
+
+def assistant_metrics():
+    """The reply cache, extraction pipeline and extraction gate of the worker's sessions, for /metrics"""
+    if _manager is None:
+        return []
+    return _manager.assistant_metrics()
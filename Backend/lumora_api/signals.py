@@ -0,0 +1,54 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from . import blobs
+
+from .caching import mark_changed
+from .models import ImageBlob, Memory, MemoryImage, Patient, Caretaker
+
+
+def _changed(sender, **kwargs):
+    # once committed: a read between the write and the commit would otherwise
+    # cache the old rows under the new token
+    label = sender._meta.label_lower
+    transaction.on_commit(lambda: mark_changed(label))
+
+
+def _patients_changed(sender, action, **kwargs):
+    # only the caretaker payload lists the link
+    if action in ("post_add", "post_remove", "post_clear"):
+        transaction.on_commit(lambda: mark_changed(Caretaker._meta.label_lower))
+
+
+def locked_blob(sha256, content_type, size):
+    """The ImageBlob for ``sha256``, created if needed and locked until the transaction ends"""
+    while True:
+        ImageBlob.objects.get_or_create(sha256=sha256, defaults={"content_type": content_type, "size": size})
+        blob = ImageBlob.objects.select_for_update().filter(pk=sha256).first()
+        if blob is not None:
+            return blob
+        # collected between the two queries; create it again
+
+
+def _collect_blob(sha256):
+    # a blob goes once the last memory using it lets go; the row lock makes an
+    # upload of the same bytes wait, and attachments are checked under it
+    with transaction.atomic():
+        blob = ImageBlob.objects.select_for_update().filter(pk=sha256).first()
+        if blob is None or MemoryImage.objects.filter(blob_id=sha256).exists():
+            return
+        blob.delete()
+        blobs.remove(sha256)
+
+
+def _image_removed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: _collect_blob(instance.blob_id))
+
+
+def connect():
+    """Keep the API response cache in step with writes to the models it shows"""
+    for model in (Memory, MemoryImage, Patient, Caretaker):
+        post_save.connect(_changed, sender=model, dispatch_uid=f"lumora-cache-save-{model.__name__}")
+        post_delete.connect(_changed, sender=model, dispatch_uid=f"lumora-cache-delete-{model.__name__}")
+    post_delete.connect(_image_removed, sender=MemoryImage, dispatch_uid="lumora-blob-collect")
+    m2m_changed.connect(_patients_changed, sender=Caretaker.patients.through, dispatch_uid="lumora-cache-patients")
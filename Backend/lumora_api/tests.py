@@ -1,3 +1,925 @@
-from django.test import TestCase
+import io
+import json
+import asyncio
+import datetime
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from backends import SimulatedBackend
+from memory_store import MemoryStore
+from metrics import REGISTRY, Registry
+from retention import HistoryArchive
+from mood import MOOD_LABELS, classify
+from tracing import TRACER, Tracer
+from topics import normalize, top_topics
+
+from . import moods, thumbnails, topic_trends
+from .caching import api_cache
+from .middleware import RequestMetricsMiddleware
+from .memory_db import DatabaseHistoryArchive, DatabaseMemoryStore, DatabaseMoodLog
+from .models import (
+    ConversationTurn, ImageBlob, ImportantMemory, Memory, MoodObservation, Patient, Caretaker, Routine, Reminder,
+    MoodRollup, TopicBucket, TopicTotal,
+)
+from .recurrence import next_fire, rule_for
+from .scheduler import ReminderScheduler
+from .sessions import SessionManager
+from .thumbnails import Image
+
+
+UTC = datetime.timezone.utc
+
+
+class DatabaseMemoryStoreTests(TestCase):
+    """Patient memory in the database, shared by every worker serving the patient"""
+
+    def setUp(self):
+        self.patient = Patient.objects.create(user=get_user_model().objects.create(username="p1"), name="Margaret")
+
+    def _turn(self, minute, message):
+        return {"timestamp": f"2026-03-01 09:{minute:02d}:00", "patient": message, "lumora": "How lovely."}
+
+    def test_facts_are_upserted_and_counters_added(self):
+        first, second = DatabaseMemoryStore(self.patient.id), DatabaseMemoryStore(self.patient.id)
+        first.set(("personal_info", "name"), "Margaret")
+        first.set(("personal_info", "name"), "Maggie")
+        first.incr(("topics_discussed", "garden"))
+        first.flush()
+        second.set(("personal_info", "daughter"), "Sarah")
+        second.incr(("topics_discussed", "garden"), 2)
+        second.set(("preferences", "drink"), "tea")
+        second.delete(("preferences", "drink"))
+        second.flush()
+
+        state = DatabaseMemoryStore(self.patient.id).state
+        self.assertEqual(state["personal_info"], {"name": "Maggie", "daughter": "Sarah"})
+        self.assertEqual(state["preferences"], {})
+        self.assertEqual(state["topics_discussed"], {"garden": 3})
+
+    def test_workers_dedupe_memories_and_trim_by_time(self):
+        first, second = DatabaseMemoryStore(self.patient.id), DatabaseMemoryStore(self.patient.id)
+        for store in (first, second):
+            store.append(("important_memories",), "Grew up on a farm")
+            store.flush()
+        self.assertEqual(ImportantMemory.objects.filter(patient=self.patient).count(), 1)
+
+        for minute, (store, message) in enumerate([(first, "a"), (second, "b"), (first, "c"), (second, "d")]):
+            store.append(("conversation_history",), self._turn(minute, message))
+            store.flush()
+        # the first worker only knows a and c; trimming both archives b, which is older than c, too
+        first.trim(("conversation_history",), 2)
+        first.flush()
+        live = ConversationTurn.objects.filter(patient=self.patient, archived=False).values_list("message", flat=True)
+        self.assertEqual(list(live), ["d"])
+        self.assertEqual(DatabaseHistoryArchive(self.patient.id).days(), ["2026-03-01"])
+
+    def test_reset_clears_moods_and_topic_buckets(self):
+        from chat import LumoraAssistant
+
+        other = Patient.objects.create(user=get_user_model().objects.create(username="p2"), name="Other")
+        topic_trends.add(other.id, {"garden": 1})
+        lumora = LumoraAssistant(
+            backend=SimulatedBackend(upstream="tests"), store=DatabaseMemoryStore(self.patient.id),
+            archive=DatabaseHistoryArchive(self.patient.id), moods=DatabaseMoodLog(self.patient.id),
+            persist_index=False,
+        )
+        self.addCleanup(lumora.close)
+        lumora.store.incr(("topics_discussed", "garden"), 2)
+        lumora.store.flush()
+        lumora.moods.record("2026-03-01 09:00:00", "cheerful")
+        moods.rollup()
+        self.assertEqual(set(TopicTotal.objects.values_list("period", "count")), {("day", 3), ("month", 3)})
+
+        lumora.reset_memory()
+        for model in (TopicBucket, MoodObservation, MoodRollup):
+            self.assertFalse(model.objects.filter(patient=self.patient).exists(), model)
+        self.assertEqual(set(TopicTotal.objects.values_list("period", "count")), {("day", 1), ("month", 1)})
+
+    def test_import_memory_command(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        memory_file = f"{directory}/patient_memory.json"
+        HistoryArchive(f"{directory}/patient_memory_archive").write([self._turn(0, "archived")])
+        store = MemoryStore(memory_file)
+        store.set(("personal_info", "name"), "Margaret")
+        store.append(("important_memories",), "Grew up on a farm")
+        store.incr(("topics_discussed", "farm"), 4)
+        store.append(("conversation_history",), self._turn(5, "recent"))
+        store.close()
+
+        call_command("import_memory", self.patient.id, memory_file, stdout=io.StringIO())
+        state = DatabaseMemoryStore(self.patient.id).state
+        self.assertEqual(state["personal_info"], {"name": "Margaret"})
+        self.assertEqual(state["important_memories"], ["Grew up on a farm"])
+        self.assertEqual(state["topics_discussed"], {"farm": 4})
+        self.assertEqual([turn["patient"] for turn in state["conversation_history"]], ["recent"])
+        self.assertEqual(DatabaseHistoryArchive(self.patient.id).load_day("2026-03-01")[0]["patient"], "archived")
+
+        with self.assertRaises(CommandError):
+            call_command("import_memory", self.patient.id, memory_file, stdout=io.StringIO())
+        call_command("import_memory", self.patient.id, memory_file, "--replace", stdout=io.StringIO())
+        self.assertEqual(ConversationTurn.objects.filter(patient=self.patient).count(), 2)
+
+    def test_import_memory_refuses_any_existing_memory(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        memory_file = f"{directory}/patient_memory.json"
+        MemoryStore(memory_file).close()
+        # only preferences and topic counts, which --replace would delete too
+        store = DatabaseMemoryStore(self.patient.id)
+        store.set(("preferences", "tea"), "milk, no sugar")
+        store.incr(("topics_discussed", "garden"), 2)
+        store.close()
+        with self.assertRaises(CommandError):
+            call_command("import_memory", self.patient.id, memory_file, stdout=io.StringIO())
+        self.assertEqual(DatabaseMemoryStore(self.patient.id).state["preferences"], {"tea": "milk, no sugar"})
+
+
+@override_settings(LUMORA_API_CACHE=None)
+class MemoryListTests(TestCase):
+    """Memory lists come a cursor page at a time, filtered and trimmed to the fields asked for"""
+
+    def setUp(self):
+        self.client = APIClient()
+        User = get_user_model()
+        self.patient = Patient.objects.create(user=User.objects.create(username="p1"), name="Margaret")
+        self.other = Patient.objects.create(user=User.objects.create(username="p2"), name="John")
+        for day in range(1, 6):
+            for patient in (self.patient, self.other):
+                memory = Memory.objects.create(patient=patient, title=f"Day {day}", description="Roses by the fence")
+                Memory.objects.filter(pk=memory.pk).update(
+                    created_at=datetime.datetime(2026, 3, day, 9, 30, tzinfo=UTC))
+
+    def _list(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_cursor_pages_cover_every_memory_once_newest_first(self):
+        url, seen = "/memories/?page_size=3", []
+        while url:
+            page = self._list(url)
+            self.assertLessEqual(len(page["results"]), 3)
+            seen += [(memory["created_at"], memory["id"]) for memory in page["results"]]
+            url = page["next"]
+        self.assertEqual(len(seen), 10)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        self.assertNotIn("count", page)
+
+    def test_filters_by_patient_and_date(self):
+        page = self._list(f"/memories/?patient={self.patient.id}&created_after=2026-03-02&created_before=2026-03-04")
+        self.assertEqual([memory["title"] for memory in page["results"]], ["Day 4", "Day 3", "Day 2"])
+        self.assertTrue(all(memory["patient"] == self.patient.id for memory in page["results"]))
+
+        page = self._list("/memories/?created_after=2026-03-05T09:30:00")
+        self.assertEqual(len(page["results"]), 2)
+
+    def test_invalid_filters_are_rejected(self):
+        for query in ("patient=me", "created_after=March", "created_before=2026-13-01"):
+            self.assertEqual(self.client.get(f"/memories/?{query}").status_code, 400, query)
+
+    def test_fields_trims_the_payload(self):
+        page = self._list("/memories/?fields=id,title&page_size=1")
+        self.assertEqual(set(page["results"][0]), {"id", "title"})
+        self.assertTrue(page["next"])
+
+        patient = self._list("/patients/?fields=id,name")["results"][0]
+        self.assertEqual(set(patient), {"id", "name"})
+
+
+# what building a response costs, so the response cache stays out of the way
+@override_settings(LUMORA_API_CACHE=None)
+class ListQueryCountTests(TestCase):
+    """List endpoints cost a fixed number of queries, however many rows they return"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.users = 0
+
+    def _user(self):
+        self.users += 1
+        return get_user_model().objects.create(username=f"user{self.users}", email=f"user{self.users}@example.com")
+
+    def _add_rows(self, caretakers, patients_each=2, memories_each=3):
+        for _ in range(caretakers):
+            caretaker = Caretaker.objects.create(user=self._user(), name="Caretaker")
+            for _ in range(patients_each):
+                patient = Patient.objects.create(user=self._user(), name="Patient")
+                caretaker.patients.add(patient)
+                Memory.objects.bulk_create([
+                    Memory(patient=patient, title="Garden", description="Roses by the fence")
+                    for _ in range(memories_each)
+                ])
+
+    def _assert_constant(self, url, queries):
+        self._add_rows(1)
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data["results"])
+
+        self._add_rows(5, patients_each=3, memories_each=5)
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_memories(self):
+        # memories, then their images
+        self._assert_constant("/memories/", 2)
+
+    def test_memories_without_images_skip_the_prefetch(self):
+        self._assert_constant("/memories/?fields=id,title", 1)
+
+    def test_patients_with_memories(self):
+        # patients, then all of their memories, then those memories' images
+        self._assert_constant("/patients/", 3)
+
+    def test_patients_without_memories_skip_the_prefetch(self):
+        self._assert_constant("/patients/?fields=id,name", 1)
+
+    def test_caretakers_with_patients_and_memories(self):
+        # caretakers, their patients, those patients' memories, then the images
+        self._assert_constant("/caretakers/", 4)
+
+    def test_caretaker_payload_nests_patients_and_memories(self):
+        self._add_rows(1, patients_each=2, memories_each=3)
+        caretaker = self.client.get("/caretakers/").data["results"][0]
+        self.assertEqual(len(caretaker["patients"]), 2)
+        self.assertEqual(len(caretaker["patients"][0]["memories"]), 3)
+
+
+class MemorySearchTests(TestCase):
+    """The full-text index follows saves and deletes, and ranks title hits first"""
+
+    def setUp(self):
+        self.client = APIClient()
+        User = get_user_model()
+        self.patient = Patient.objects.create(user=User.objects.create(username="p1"), name="Margaret")
+        self.other = Patient.objects.create(user=User.objects.create(username="p2"), name="John")
+
+    def _search(self, **params):
+        response = self.client.get("/memories/search/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.data["results"]
+
+    def test_ranked_results_with_snippets(self):
+        Memory.objects.create(patient=self.patient, title="Tea party", description="She talked about the roses.")
+        best = Memory.objects.create(patient=self.patient, title="Roses", description="The roses by the fence.")
+        results = self._search(q="rose")
+        self.assertEqual([r["id"] for r in results][0], best.id)
+        self.assertIn("<mark>roses</mark>", results[0]["snippet"])
+
+    def test_index_follows_updates_and_deletes(self):
+        memory = Memory.objects.create(patient=self.patient, title="Wedding", description="A summer wedding")
+        self.assertEqual(len(self._search(q="wedding")), 1)
+        memory.description = "A winter wedding"
+        with self.captureOnCommitCallbacks(execute=True):
+            memory.save()
+        self.assertEqual(len(self._search(q="summer")), 0)
+        self.assertEqual(len(self._search(q="winter")), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            memory.delete()
+        self.assertEqual(self._search(q="wedding"), [])
+
+    def test_search_within_one_patient(self):
+        Memory.objects.create(patient=self.patient, title="Bakery", description="Bread every morning")
+        Memory.objects.create(patient=self.other, title="Bakery", description="Cakes on Sundays")
+        results = self._search(q="bakery", patient=self.other.id)
+        self.assertEqual([r["patient"] for r in results], [self.other.id])
+
+    def test_query_syntax_in_input_is_harmless(self):
+        Memory.objects.create(patient=self.patient, title="Dog", description="Rex the dog")
+        self.assertEqual(len(self._search(q='"dog" (*')), 1)
+        self.assertEqual(self.client.get("/memories/search/").status_code, 400)
+
+    def test_limit_must_be_positive_and_is_capped(self):
+        Memory.objects.bulk_create([
+            Memory(patient=self.patient, title="Garden", description="Roses") for _ in range(105)
+        ])
+        self.assertEqual(len(self._search(q="garden", limit=1000)), 100)
+        self.assertEqual(len(self._search(q="garden", limit=1)), 1)
+        for limit in (0, -5):
+            self.assertEqual(self.client.get("/memories/search/", {"q": "garden", "limit": limit}).status_code, 400)
+
+
+class ResponseCacheTests(TestCase):
+    """Reads are served from the cache, revalidated with 304s, and invalidated by writes"""
+
+    def setUp(self):
+        api_cache().clear()
+        self.client = APIClient()
+        User = get_user_model()
+        self.patient = Patient.objects.create(user=User.objects.create(username="p1"), name="Margaret")
+        self.caretaker = Caretaker.objects.create(user=User.objects.create(username="c1"), name="Anne")
+        self.caretaker.patients.add(self.patient)
+        Memory.objects.create(patient=self.patient, title="Garden", description="Roses by the fence")
+
+    def test_repeat_reads_skip_the_database(self):
+        first = self.client.get("/patients/")
+        with self.assertNumQueries(0):
+            second = self.client.get("/patients/")
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second["ETag"], first["ETag"])
+
+    def test_conditional_get(self):
+        response = self.client.get("/memories/")
+        self.assertIn("no-cache", response["Cache-Control"])
+        with self.assertNumQueries(0):
+            response = self.client.get("/memories/", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get("/memories/", HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_writes_invalidate_nested_payloads(self):
+        etag = self.client.get("/caretakers/")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            Memory.objects.create(patient=self.patient, title="Beach", description="Sandcastles")
+        response = self.client.get("/caretakers/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"][0]["patients"][0]["memories"]), 2)
+
+        etag = response["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.caretaker.patients.remove(self.patient)
+        response = self.client.get("/caretakers/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.data["results"][0]["patients"], [])
+
+    def test_changes_count_once_committed(self):
+        etag = self.client.get("/memories/")["ETag"]
+        with self.captureOnCommitCallbacks() as callbacks:
+            Memory.objects.create(patient=self.patient, title="Beach", description="Sandcastles")
+            # a read before the commit can't be cached as the new state
+            self.assertEqual(self.client.get("/memories/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.client.get("/memories/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_each_query_is_cached_separately(self):
+        Memory.objects.create(patient=self.patient, title="Bakery", description="Bread every morning")
+        self.assertEqual(len(self.client.get("/memories/search/", {"q": "garden"}).data["results"]), 1)
+        self.assertEqual(self.client.get("/memories/search/", {"q": "bakery"}).data["results"][0]["title"], "Bakery")
+
+
+class BulkMemoryTests(TestCase):
+    """Bulk import is all or nothing and round-trips through the streaming export"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.patient = Patient.objects.create(user=get_user_model().objects.create(username="p1"), name="Margaret")
+
+    def _import(self, body, content_type, **params):
+        query = "&".join(f"{key}={value}" for key, value in params.items())
+        return self.client.post(f"/memories/import/?{query}", data=body, content_type=content_type)
+
+    def test_ndjson_import_then_export(self):
+        body = "\n".join(json.dumps({"title": f"Memory {i}", "description": "Roses"}) for i in range(3))
+        response = self._import(body, "application/x-ndjson", patient=self.patient.id)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["imported"], 3)
+
+        response = self.client.get("/memories/export/")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row["title"] for row in rows], ["Memory 0", "Memory 1", "Memory 2"])
+        self.assertEqual({row["patient"] for row in rows}, {self.patient.id})
+
+    def test_csv_import_and_export(self):
+        body = f"title,description,patient\nGarden,\"Roses, tulips\",{self.patient.id}\nBeach,Sandcastles,{self.patient.id}\n"
+        self.assertEqual(self._import(body, "text/csv").data["imported"], 2)
+        response = self.client.get("/memories/export/", {"format": "csv"})
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "id,patient,title,description,created_at")
+        self.assertIn('"Roses, tulips"', lines[1])
+
+    def test_invalid_rows_roll_back_the_whole_import(self):
+        body = "\n".join([
+            json.dumps({"title": "Fine", "description": "Roses", "patient": self.patient.id}),
+            "not json",
+            json.dumps({"title": "", "description": "Roses", "patient": self.patient.id}),
+            json.dumps({"title": "Nobody", "description": "Roses", "patient": 999}),
+        ])
+        response = self._import(body, "application/x-ndjson")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error["line"] for error in response.data["errors"]], [2, 3, 4])
+        self.assertFalse(Memory.objects.exists())
+        self.assertEqual(self._import("{}", "application/xml").status_code, 415)
+
+
+class MemoryImageTests(TestCase):
+    """Images are stored once per content, served with ranges and 304s, and thumbnailed"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        # background thumbnails finish before their directory goes
+        self.addCleanup(lambda: [future.exception() for future in list(thumbnails._pending.values())
+                                 if not future.cancelled()])
+        settings = override_settings(LUMORA_BLOB_ROOT=self.root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        patient = Patient.objects.create(user=get_user_model().objects.create(username="p1"), name="Margaret")
+        self.memory = Memory.objects.create(patient=patient, title="Garden", description="Roses")
+
+    def _png(self, color="red", size=(800, 600)):
+        if Image is None:
+            return b"\x89PNG\r\n\x1a\n" + bytes(size[0]) * 8
+        out = io.BytesIO()
+        Image.new("RGB", size, color).save(out, "PNG")
+        return out.getvalue()
+
+    def _upload(self, body, content_type="image/png", memory=None):
+        memory = memory or self.memory
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f"/memories/{memory.id}/images/", data=body, content_type=content_type)
+
+    def test_duplicate_uploads_share_one_blob(self):
+        other = Memory.objects.create(patient=self.memory.patient, title="Again", description="Roses")
+        first = self._upload(self._png())
+        second = self._upload(self._png(), memory=other)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(first.data["sha256"], second.data["sha256"])
+        self.assertEqual(ImageBlob.objects.count(), 1)
+        self.assertEqual(self._upload(b"not an image", "application/octet-stream").status_code, 415)
+
+        memory = self.client.get(f"/memories/{self.memory.id}/").data
+        self.assertEqual(set(memory["images"][0]["thumbnails"]), {"small", "medium"})
+
+    def test_collection_keeps_a_blob_uploaded_again_meanwhile(self):
+        first = self._upload(self._png()).data
+        # the image is removed, but the same bytes are attached again before collection runs
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.delete(f"/memories/{self.memory.id}/images/{first['id']}/")
+        second = self._upload(self._png()).data
+        for callback in callbacks:
+            callback()
+        self.assertEqual(ImageBlob.objects.count(), 1)
+        self.assertEqual(self.client.get(second["url"]).status_code, 200)
+
+        # once nothing uses it, the row and the file go, and a new upload brings both back
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f"/memories/{self.memory.id}/images/{second['id']}/")
+        self.assertEqual(self.client.get(second["url"]).status_code, 404)
+        self.assertEqual(self.client.get(self._upload(self._png()).data["url"]).status_code, 200)
+
+    def test_range_and_conditional_get(self):
+        body = self._png()
+        url = self._upload(body).data["url"]
+        response = self.client.get(url, HTTP_RANGE="bytes=0-99")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 0-99/{len(body)}")
+        self.assertEqual(b"".join(response.streaming_content), body[:100])
+        self.assertEqual(b"".join(self.client.get(url, HTTP_RANGE="bytes=-10").streaming_content), body[-10:])
+        self.assertEqual(self.client.get(url, HTTP_RANGE=f"bytes={len(body)}-").status_code, 416)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+    @unittest.skipIf(Image is None, "thumbnails need Pillow")
+    def test_thumbnails_fit_their_box(self):
+        image = self._upload(self._png(size=(1600, 1200))).data
+        response = self.client.get(image["thumbnails"]["small"])
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        with Image.open(io.BytesIO(b"".join(response.streaming_content))) as thumbnail:
+            self.assertEqual(thumbnail.size, (160, 120))
+
+    def test_failed_thumbnails_are_logged(self):
+        failed, cancelled = Future(), Future()
+        failed.set_exception(OSError("truncated image"))
+        cancelled.cancel()
+        with self.assertLogs("lumora_api.thumbnails", "WARNING") as logs:
+            thumbnails._finished("abc", failed)
+            thumbnails._finished("def", cancelled)
+        self.assertEqual(logs.output, ["WARNING:lumora_api.thumbnails:Thumbnails for abc failed: truncated image"])
+
+
+class RecurrenceTests(TestCase):
+    """Times of day follow the routine's timezone, across daylight-saving changes"""
+
+    def _rule(self, **fields):
+        fields = {"frequency": "daily", "times": ["08:00"], "weekdays": [], "interval_minutes": None,
+                  "starts_at": datetime.datetime(2026, 1, 1, tzinfo=UTC), "ends_at": None,
+                  "timezone": "America/New_York", **fields}
+        return rule_for(SimpleNamespace(**fields))
+
+    def test_daily_time_is_local(self):
+        rule = self._rule()
+        # clocks go forward on 8 March 2026: 08:00 is 13:00 UTC before, 12:00 after
+        self.assertEqual(next_fire(rule, datetime.datetime(2026, 3, 6, 14, tzinfo=UTC)),
+                         datetime.datetime(2026, 3, 7, 13, tzinfo=UTC))
+        self.assertEqual(next_fire(rule, datetime.datetime(2026, 3, 7, 14, tzinfo=UTC)),
+                         datetime.datetime(2026, 3, 8, 12, tzinfo=UTC))
+        # 02:30 doesn't exist that night and fires at 03:30 local
+        rule = self._rule(times=["02:30"])
+        self.assertEqual(next_fire(rule, datetime.datetime(2026, 3, 8, 0, tzinfo=UTC)),
+                         datetime.datetime(2026, 3, 8, 7, 30, tzinfo=UTC))
+
+    def test_weekly_interval_and_end(self):
+        # Mondays and Thursdays; 5 March 2026 is a Thursday
+        rule = self._rule(frequency="weekly", weekdays=[0, 3], times=["09:00", "21:00"], timezone="UTC")
+        self.assertEqual(next_fire(rule, datetime.datetime(2026, 3, 5, 21, tzinfo=UTC)),
+                         datetime.datetime(2026, 3, 9, 9, tzinfo=UTC))
+        rule = self._rule(frequency="interval", interval_minutes=90,
+                          ends_at=datetime.datetime(2026, 1, 1, 3, tzinfo=UTC))
+        self.assertEqual(next_fire(rule, datetime.datetime(2026, 1, 1, 1, 30, tzinfo=UTC)),
+                         datetime.datetime(2026, 1, 1, 3, tzinfo=UTC))
+        self.assertIsNone(next_fire(rule, datetime.datetime(2026, 1, 1, 3, tzinfo=UTC)))
+
+
+class ReminderSchedulerTests(TestCase):
+    """Reminders fire on time, late ones count as missed, and a restart resumes without repeats"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.patient = Patient.objects.create(user=get_user_model().objects.create(username="p1"), name="Margaret")
+        # the scheduler's clock is faked from here on, edits still stamp the real time
+        self.start = timezone.now().replace(microsecond=0)
+        self.routine = Routine.objects.create(patient=self.patient, title="Pills", frequency="interval",
+                                              interval_minutes=10, starts_at=self.start, grace_minutes=5)
+        self.now = self.start
+
+    def _scheduler(self):
+        scheduler = ReminderScheduler(clock=lambda: self.now.timestamp())
+        scheduler.load()
+        return scheduler
+
+    def _at(self, minutes):
+        self.now = self.start + datetime.timedelta(minutes=minutes, seconds=1)
+
+    def _statuses(self):
+        return [(round((r.due_at - self.start).total_seconds() / 60), r.status)
+                for r in Reminder.objects.order_by("due_at")]
+
+    def test_fire_sweep_and_restart(self):
+        scheduler = self._scheduler()
+        self._at(0)
+        self.assertEqual(len(scheduler.tick()), 1)
+        self.assertEqual(scheduler.tick(), [])
+        self._at(10)
+        scheduler.tick()
+        reminder = Reminder.objects.get(due_at=self.start + datetime.timedelta(minutes=10))
+        self.assertEqual(self.client.post(f"/reminders/{reminder.id}/done/").data["status"], "done")
+
+        # down from 10 to 32 minutes: 20 is past its grace, 30 is not
+        self._at(32)
+        scheduler = self._scheduler()
+        scheduler.tick()
+        self.assertEqual(self._statuses(), [(0, "missed"), (10, "done"), (20, "missed"), (30, "fired")])
+        self._at(36)
+        scheduler.sweep()
+        self.assertEqual(self._statuses()[-1], (30, "missed"))
+
+    def test_edits_and_deletes_reach_a_running_scheduler(self):
+        scheduler = self._scheduler()
+        self.routine.interval_minutes = 5
+        self.routine.save()
+        scheduler.sync()
+        self._at(5)
+        scheduler.tick()
+        self.assertEqual(self._statuses(), [(0, "missed"), (5, "fired")])
+        self.routine.delete()
+        self._at(10)
+        self.assertEqual(scheduler.tick(), [])
+
+    def test_reactivated_or_edited_routines_do_not_fire_twice(self):
+        once = Routine.objects.create(patient=self.patient, title="Doctor", frequency="once",
+                                      starts_at=self.start, grace_minutes=5)
+        scheduler = self._scheduler()
+        self._at(0)
+        self.assertEqual(len(scheduler.tick()), 2)
+
+        # both inside the grace period of what they just fired
+        self.routine.active = False
+        self.routine.save()
+        scheduler.sync()
+        self.routine.active = True
+        self.routine.save()
+        once.title = "Doctor at two"
+        once.save()
+        scheduler.sync()
+        self.assertEqual(scheduler.tick(), [])
+        self._at(10)
+        self.assertEqual([r.routine_id for r in scheduler.tick()], [self.routine.id])
+        self.assertEqual(Reminder.objects.count(), 3)
+
+    def test_a_duplicate_occurrence_is_skipped_not_an_error(self):
+        scheduler = self._scheduler()
+        self._at(0)
+        fired = scheduler.tick()
+        # as written by an overlapping run
+        scheduler._insert(fired, self.now)
+        self.assertEqual(Reminder.objects.count(), 1)
+
+    def test_run_survives_a_failing_step(self):
+        scheduler = ReminderScheduler(clock=lambda: self.now.timestamp(), sync_interval=0)
+        stop = threading.Event()
+        loads = []
+        load = scheduler.load
+
+        def flaky_load():
+            loads.append(1)
+            if len(loads) == 1:
+                raise RuntimeError("database away")
+            load()
+            stop.set()
+
+        scheduler.load = flaky_load
+        self._at(0)
+        with self.assertLogs("lumora_api.scheduler", "ERROR"):
+            scheduler.run(stop)
+        self.assertEqual(len(loads), 2)
+
+    def test_routine_schedule_is_validated(self):
+        response = self.client.post("/routines/", {
+            "patient": self.patient.id, "title": "Walk", "frequency": "weekly", "times": ["7:00pm"],
+            "timezone": "Mars/Olympus",
+        }, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data), {"times", "weekdays", "timezone"})
+
+
+class MoodTrendTests(TestCase):
+    """Emotional states become mood observations, rolled up incrementally and served from the rollups"""
+
+    def setUp(self):
+        self.patient = Patient.objects.create(user=get_user_model().objects.create(username="p1"), name="Margaret")
+        self.log = DatabaseMoodLog(self.patient.id)
+        for timestamp, state in [("2026-03-01 09:00:00", "Cheerful, enjoyed the photos"),
+                                 ("2026-03-01 18:00:00", "not calm, worried about the dog"),
+                                 ("2026-03-03 10:00:00", "calm and reminiscing"),
+                                 ("2026-03-03 11:00:00", "hard to say")]:
+            self.log.record(timestamp, state)
+
+    def _rollup(self, period, start):
+        row = MoodRollup.objects.get(patient=self.patient, period=period, start=start)
+        return row.count, row.valence_sum, row.valence_min, row.valence_max
+
+    def test_classify(self):
+        self.assertEqual(MOOD_LABELS[classify("A bit confused but happy to talk")], "confused")
+        self.assertEqual(MOOD_LABELS[classify("not sad, quite cheerful")], "happy")
+        self.assertIsNone(classify(""))
+
+    def test_rollups_are_incremental(self):
+        self.assertEqual(moods.rollup(), 3)
+        self.assertEqual(self._rollup("day", datetime.date(2026, 3, 1)), (2, 0, -2, 2))
+        self.assertEqual(self._rollup("week", datetime.date(2026, 3, 2)), (1, 1, 1, 1))
+
+        self.log.record("2026-03-05 10:00:00", "tearful")
+        self.assertEqual(moods.rollup(), 1)
+        self.assertEqual(moods.rollup(), 0)
+        self.assertEqual(self._rollup("week", datetime.date(2026, 3, 2)), (2, -1, -2, 1))
+        self.assertEqual(self._rollup("month", datetime.date(2026, 3, 1)), (4, -1, -2, 2))
+
+        if moods.np is not None:
+            rows = [(1, datetime.datetime(2025, 12, 29, 23, 30, tzinfo=UTC), 0), (1, datetime.datetime(2026, 1, 1, tzinfo=UTC), 6),
+                    (2, datetime.datetime(2026, 1, 31, 23, 59, tzinfo=UTC), 3)]
+            patients, moments, observed = map(list, zip(*rows))
+            self.assertEqual(moods.aggregate(patients, moments, observed),
+                             moods.aggregate(patients, moments, observed, vectorized=False))
+
+    def test_trends_endpoint(self):
+        self.log.record("2026-03-10 10:00:00", "anxious")
+        moods.rollup()
+        client = APIClient()
+        response = client.get(f"/moods/?patient={self.patient.id}&period=week&start=2026-03-01&end=2026-03-31")
+        self.assertEqual(response.status_code, 200)
+        result, = response.data["results"]
+        self.assertEqual([point["start"] for point in result["points"]],
+                         [datetime.date(2026, 2, 23), datetime.date(2026, 3, 2), datetime.date(2026, 3, 9)])
+        self.assertEqual(result["summary"]["count"], 4)
+        self.assertLess(result["summary"]["trend"], 0)
+        self.assertEqual(client.get(f"/moods/?patient={self.patient.id}&period=year").status_code, 400)
+
+
+class TopicTrendTests(TestCase):
+    """Topics are counted normalized, by day and month, and ranked over any window"""
+
+    def setUp(self):
+        User = get_user_model()
+        self.patients = [Patient.objects.create(user=User.objects.create(username=f"p{i}"), name=f"Patient {i}")
+                         for i in range(2)]
+
+    def test_normalize(self):
+        self.assertEqual({normalize(topic) for topic in ["Family", "family members", "My family"]}, {"family"})
+        self.assertEqual(normalize("Her grandchildren"), "grandchild")
+        self.assertEqual(normalize("Family Members"), "family")
+        for topic, expected in [("James", "james"), ("Charles", "charles"), ("trip to Paris", "trip to paris"),
+                                ("visits from uncle Bates", "visits from uncle bates"), ("Gardens", "garden")]:
+            self.assertEqual(normalize(topic), expected)
+        self.assertEqual(top_topics({"Family": 3, "family members": 2, "garden": 4, "": 9}, 1), [("family", 5)])
+
+    def test_flush_counts_todays_buckets(self):
+        store = DatabaseMemoryStore(self.patients[0].id)
+        store.incr(("topics_discussed", "family"))
+        store.incr(("topics_discussed", "family"))
+        store.flush()
+        today = timezone.localdate()
+        self.assertEqual(
+            set(TopicBucket.objects.values_list("period", "start", "count")),
+            {("day", today, 2), ("month", today.replace(day=1), 2)},
+        )
+
+    def test_windows_and_endpoint(self):
+        first, second = (patient.id for patient in self.patients)
+        topic_trends.add(first, {"family": 2, "garden": 1}, day=datetime.date(2026, 1, 31))
+        topic_trends.add(first, {"garden": 3}, day=datetime.date(2026, 2, 14))
+        topic_trends.add(second, {"war": 1, "family": 1}, day=datetime.date(2026, 3, 1))
+        # January's last day, all of February and March's first day
+        start, end = datetime.date(2026, 1, 31), datetime.date(2026, 3, 1)
+        self.assertEqual(topic_trends.top(start, end, 2), [("garden", 4), ("family", 3)])
+        self.assertEqual(topic_trends.top(datetime.date(2026, 2, 1), end, 5, [second]), [("family", 1), ("war", 1)])
+
+        response = APIClient().get(f"/topics/?patient={first},{second}&start=2026-02-01&end=2026-03-31&k=1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["topics"], [{"topic": "garden", "count": 3}])
+        self.assertEqual([entry["topics"] for entry in response.data["patients"]],
+                         [[{"topic": "garden", "count": 3}], [{"topic": "family", "count": 1}]])
+        self.assertEqual(APIClient().get("/topics/?start=2026-03-01&end=2026-02-01").status_code, 400)
+
+
+class _TestSessions(SessionManager):
+    """Sessions on JSON memory files and the simulated model, recording what is opened"""
+
+    def __init__(self, memory_dir, **kwargs):
+        super().__init__(memory_dir, store="json", **kwargs)
+        self.events = []
+
+    def _open(self, assistant_class, patient_id):
+        from chat import LumoraAssistant
+
+        events = self.events
+
+        class Assistant(LumoraAssistant):
+            def close(self):
+                # slow enough for a reload to come in while it runs
+                time.sleep(0.05)
+                super().close()
+                events.append(("closed", patient_id))
+
+        events.append(("opened", patient_id))
+        return Assistant(memory_file=self.memory_file(patient_id),
+                         backend=SimulatedBackend(chunk_latency=0, upstream="tests/sessions"))
+
+
+class SessionManagerTests(TestCase):
+    """Sessions load once, stay within max_sessions, and a reload waits for the old session to close"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def _run(self, manager, scenario):
+        async def run():
+            try:
+                return await scenario()
+            finally:
+                await manager.close()
+        return asyncio.run(run())
+
+    def test_concurrent_first_messages_share_one_load(self):
+        manager = _TestSessions(self.directory)
+
+        async def scenario():
+            return await asyncio.gather(manager.get(1), manager.get(1))
+
+        first, second = self._run(manager, scenario)
+        self.assertIs(first, second)
+        self.assertEqual(manager.events.count(("opened", 1)), 1)
+        self.assertEqual(manager.stats["loads"], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        manager = _TestSessions(self.directory, max_sessions=2)
+
+        async def scenario():
+            for patient_id in (1, 2, 1, 3):
+                await manager.get(patient_id)
+            return list(manager._sessions), manager.stats["evictions"], list(manager._closing)
+
+        self.assertEqual(self._run(manager, scenario), ([1, 3], 1, [2]))
+        self.assertIn(("closed", 2), manager.events)
+
+    def test_reload_waits_for_the_evicted_session_to_close(self):
+        manager = _TestSessions(self.directory)
+
+        async def scenario():
+            first = await manager.get(1)
+            await first.send_message("My daughter is called Sarah")
+            manager._evict(1)
+            second = await manager.get(1)
+            return first, second
+
+        first, second = self._run(manager, scenario)
+        self.assertIsNot(first, second)
+        self.assertEqual(manager.events[:3], [("opened", 1), ("closed", 1), ("opened", 1)])
+        # the reloaded session sees what the closed one wrote
+        history = second.assistant.get_patient_memory()["conversation_history"]
+        self.assertEqual(history[-1]["patient"], "My daughter is called Sarah")
+
+
+class MetricsTests(TestCase):
+    """Turns and requests are timed span by span and shown at /metrics"""
+
+    def test_spans_feed_metrics_and_samples(self):
+        registry = Registry()
+        tracer = Tracer(sample_rate=0, registry=registry)
+        with tracer.trace("turn") as trace:
+            with trace.span("chat_call") as span:
+                span.set(prompt_tokens=120, bytes_out=512)
+        with self.assertRaises(ValueError), tracer.trace("turn") as trace, trace.span("persist"):
+            raise ValueError("disk full")
+
+        text = registry.render()
+        self.assertIn('lumora_span_seconds_count{span="chat_call"} 1', text)
+        self.assertIn('lumora_span_prompt_tokens_total{span="chat_call"} 120', text)
+        self.assertIn('lumora_span_errors_total{span="persist"} 1', text)
+        self.assertIn('lumora_trace_seconds_count{trace="turn"} 2', text)
+        # unsampled traces are timed but not kept
+        self.assertEqual(len(tracer.recent), 0)
+        tracer.configure(sample_rate=1.0)
+        with tracer.trace("turn") as trace, trace.span("prompt_build"):
+            pass
+        self.assertEqual([span["name"] for span in tracer.recent[0].summary()["spans"]], ["prompt_build"])
+
+    def test_requests_and_endpoint(self):
+        rate = TRACER.sample_rate
+        TRACER.configure(sample_rate=1.0)
+        self.addCleanup(TRACER.configure, sample_rate=rate)
+        client = APIClient()
+        self.assertEqual(client.get("/memories/").status_code, 200)
+
+        response = client.get("/metrics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        text = response.content.decode()
+        self.assertIn('lumora_http_request_seconds_count{method="GET",view="memory-list",status="2xx"}', text)
+        self.assertIn('lumora_http_db_queries_count{view="memory-list"}', text)
+        self.assertEqual(client.get("/metrics/traces/").json()["traces"][0]["view"], "metrics")
+
+        with override_settings(LUMORA_METRICS_TOKEN="s3cret"):
+            self.assertEqual(client.get("/metrics/").status_code, 401)
+            self.assertEqual(client.get("/metrics/", HTTP_AUTHORIZATION="Bearer s3cret").status_code, 200)
+
+    def _count(self, series):
+        """The current value of one ``name{labels}`` series in the process registry"""
+        for line in REGISTRY.render().splitlines():
+            if line.startswith(series + " "):
+                return float(line.rsplit(" ", 1)[1])
+        return 0.0
+
+    async def test_sync_views_are_traced_under_asgi(self):
+        rate = TRACER.sample_rate
+        TRACER.configure(sample_rate=1.0)
+        self.addCleanup(TRACER.configure, sample_rate=rate)
+        series = 'lumora_http_db_queries_count{view="memory-list"}'
+        before = self._count(series)
+        response = await AsyncClient().get("/memories/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._count(series), before + 1)
+        self.assertEqual(TRACER.recent[-1].summary()["view"], "memory-list")
+
+    def test_streamed_responses_count_until_closed(self):
+        series = 'lumora_http_request_seconds_count{method="GET",view="unmatched",status="2xx"}'
+        before = self._count(series)
+        middleware = RequestMetricsMiddleware(lambda request: StreamingHttpResponse(iter([b"a", b"b"])))
+        response = middleware(RequestFactory().get("/stream/"))
+        self.assertEqual(self._count(series), before)
+        self.assertEqual(b"".join(response), b"ab")
+        self.assertEqual(self._count(series), before + 1)
+
+        RequestMetricsMiddleware(lambda request: HttpResponse("done"))(RequestFactory().get("/plain/"))
+        self.assertEqual(self._count(series), before + 2)
+
+    def test_assistant_counters_are_summed_over_sessions(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        manager = _TestSessions(directory, max_sessions=1)
+
+        async def talk():
+            for patient_id in (1, 2):
+                session = await manager.get(patient_id)
+                for _ in range(3):
+                    await session.send_message("What is my daughter's name?")
+                await session.end_session()
+            live = dict(((name, value) for name, _, _, value in manager.assistant_metrics()))
+            await manager.close()
+            return live, dict(((name, value) for name, _, _, value in manager.assistant_metrics()))
+
+        live, closed = asyncio.run(talk())
+        # the first patient's session was evicted for the second's; its counts stay in the totals
+        self.assertEqual(live["lumora_response_cache_misses_total"] + live["lumora_response_cache_hits_total"], 6)
+        # replies answered from the cache never reach extraction
+        self.assertEqual(live["lumora_extraction_gate_checked_total"], live["lumora_response_cache_misses_total"])
+        self.assertEqual(live["lumora_extraction_queue_depth"], 0)
+        self.assertEqual(closed["lumora_response_cache_misses_total"], live["lumora_response_cache_misses_total"])
+        self.assertEqual(closed["lumora_response_cache_entries"], 0)
+        self.assertIn("lumora_extraction_calls_saved_total", closed)
@@ -0,0 +1,115 @@
+"""
+JPEG thumbnails of image blobs, made in a process pool off the request thread.
+
+An upload starts its thumbnails in the background; a request for one that is
+missing (the worker was restarted, a size was added) starts it and waits.
+Sizes are bounding boxes in pixels, from ``LUMORA_THUMBNAIL_SIZES``.
+
+Pillow is optional: without it no thumbnails are made and ``thumbnail``
+returns None, so callers fall back to the original image.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from .blobs import blob_path
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pending = {}
+_lock = threading.Lock()
+
+
+def thumbnail_path(sha256, name):
+    return blob_path(sha256, f".{name}.jpg")
+
+
+def render(source, destinations):
+    """
+    Runs in a worker process: write ``source`` shrunk to fit each bounding
+    box in ``destinations`` ({pixels: path}), largest first, each one scaled
+    down from the last
+    """
+    with Image.open(source) as image:
+        largest = max(destinations)
+        # JPEGs decode straight at a reduced scale, far cheaper than a full decode
+        image.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+
+        for box in sorted(destinations, reverse=True):
+            image.thumbnail((box, box), Image.LANCZOS)
+            path = destinations[box]
+            tmp = f"{path}.{os.getpid()}.tmp"
+            image.save(tmp, "JPEG", quality=82, optimize=True, progressive=True)
+            os.replace(tmp, path)
+    return sorted(destinations)
+
+
+def _finished(sha256, future):
+    with _lock:
+        _pending.pop(sha256, None)
+    if future.cancelled():
+        return
+    if future.exception() is not None:
+        logger.warning("Thumbnails for %s failed: %s", sha256, future.exception())
+
+
+def generate(sha256):
+    """Start making the blob's missing thumbnails unless that is under way; the Future, or None if there is nothing to do"""
+    global _pool
+    if Image is None:
+        return None
+    with _lock:
+        future = _pending.get(sha256)
+        if future is not None:
+            return future
+        missing = {
+            box: thumbnail_path(sha256, name)
+            for name, box in settings.LUMORA_THUMBNAIL_SIZES.items()
+            if not os.path.exists(thumbnail_path(sha256, name))
+        }
+        if not missing:
+            return None
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=settings.LUMORA_THUMBNAIL_WORKERS)
+        try:
+            future = _pool.submit(render, blob_path(sha256), missing)
+        except BrokenProcessPool:
+            # a worker died (out of memory on a huge image, say): start a new pool
+            _pool = ProcessPoolExecutor(max_workers=settings.LUMORA_THUMBNAIL_WORKERS)
+            future = _pool.submit(render, blob_path(sha256), missing)
+        _pending[sha256] = future
+    future.add_done_callback(lambda done: _finished(sha256, done))
+    return future
+
+
+def thumbnail(sha256, name, wait=10.0):
+    """Path of a thumbnail, made now if missing (waiting up to ``wait`` seconds), or None if it can't be"""
+    path = thumbnail_path(sha256, name)
+    if os.path.exists(path):
+        return path
+    future = generate(sha256)
+    if future is not None:
+        try:
+            future.result(timeout=wait)
+        except Exception:
+            pass
+    return path if os.path.exists(path) else None
@@ -0,0 +1,99 @@
+"""
+What patients have been talking about, over any window.
+
+Besides each patient's lifetime TopicCount, every topic increment lands in a
+day bucket and a month bucket of TopicBucket, and of TopicTotal (the same
+summed over every patient). A window is read as the whole months it spans
+plus the days at either end, so a week costs seven buckets per topic and a
+year at most twelve months and sixty-odd days, however many conversations
+there were; top topics across all patients never touch a per-patient row.
+"""
+import datetime
+
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q, Subquery, Sum, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .caching import mark_changed
+from .models import TopicBucket, TopicTotal
+
+
+def _next_month(day):
+    return (day.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+
+def window(start, end):
+    """Filter for the buckets that exactly cover ``start`` to ``end`` (dates, inclusive)"""
+    months = []
+    month = start if start.day == 1 else _next_month(start)
+    while _next_month(month) - datetime.timedelta(days=1) <= end:
+        months.append(month)
+        month = _next_month(month)
+    if not months:
+        return Q(period="day", start__range=(start, end))
+    buckets = Q(period="month", start__in=months)
+    if start < months[0]:
+        buckets |= Q(period="day", start__range=(start, months[0] - datetime.timedelta(days=1)))
+    if month <= end:
+        buckets |= Q(period="day", start__range=(month, end))
+    return buckets
+
+
+def _increment(model, amounts, batch_size, **fields):
+    model.objects.bulk_create(
+        [model(topic=topic, **fields) for topic in amounts], batch_size=batch_size, ignore_conflicts=True,
+    )
+    # one UPDATE per distinct amount, usually just "+ 1"
+    by_amount = {}
+    for topic, amount in amounts.items():
+        by_amount.setdefault(amount, []).append(topic)
+    for amount, topics in by_amount.items():
+        model.objects.filter(topic__in=topics, **fields).update(count=F("count") + amount)
+
+
+def add(patient_id, amounts, day=None, batch_size=500):
+    """Count {topic: amount} for the patient on ``day`` (today by default)"""
+    day = day or timezone.localdate()
+    for period, start in (("day", day), ("month", day.replace(day=1))):
+        _increment(TopicBucket, amounts, batch_size, patient_id=patient_id, period=period, start=start)
+        _increment(TopicTotal, amounts, batch_size, period=period, start=start)
+    # usually inside a memory flush's transaction
+    transaction.on_commit(lambda: mark_changed(TopicBucket._meta.label_lower, TopicTotal._meta.label_lower))
+
+
+def remove(patient_id):
+    """Drop a patient's buckets and take their counts back out of the totals"""
+    buckets = TopicBucket.objects.filter(patient_id=patient_id)
+    same = buckets.filter(period=OuterRef("period"), start=OuterRef("start"), topic=OuterRef("topic"))
+    TopicTotal.objects.filter(Exists(same)).update(count=F("count") - Subquery(same.values("count")[:1]))
+    buckets.delete()
+    transaction.on_commit(lambda: mark_changed(TopicBucket._meta.label_lower, TopicTotal._meta.label_lower))
+
+
+def top(start, end, k=10, patient_ids=None):
+    """
+    The ``k`` most discussed topics between ``start`` and ``end``, as
+    [(topic, count)], for the given patients together or everyone
+    """
+    if patient_ids is None:
+        buckets = TopicTotal.objects.all()
+    else:
+        buckets = TopicBucket.objects.filter(patient_id__in=patient_ids)
+    ranked = (buckets.filter(window(start, end)).values("topic").annotate(total=Sum("count"))
+              .order_by("-total", "topic")[:k])
+    return [(row["topic"], row["total"]) for row in ranked]
+
+
+def top_per_patient(patient_ids, start, end, k=10):
+    """Each patient's ``k`` most discussed topics, {patient id: [(topic, count)]}, in one query"""
+    ranked = (
+        TopicBucket.objects.filter(window(start, end), patient_id__in=patient_ids)
+        .values("patient_id", "topic").annotate(total=Sum("count"))
+        .annotate(rank=Window(RowNumber(), partition_by=F("patient_id"), order_by=[F("total").desc(), F("topic")]))
+        .filter(rank__lte=k).order_by("patient_id", "rank")
+    )
+    results = {patient_id: [] for patient_id in patient_ids}
+    for row in ranked:
+        results[row["patient_id"]].append((row["topic"], row["total"]))
+    return results
@@ -1,12 +1,22 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import MemoryViewSet, PatientViewSet, CaretakerViewSet
+from .views import MemoryViewSet, PatientViewSet, CaretakerViewSet, RoutineViewSet, ReminderViewSet, MoodTrendViewSet, TopicTrendViewSet, blob, chat, chat_stream, metrics, traces
 
 router = DefaultRouter()
 router.register(r'memories', MemoryViewSet)
 router.register(r'patients', PatientViewSet)
 router.register(r'caretakers', CaretakerViewSet)
+router.register(r'routines', RoutineViewSet)
+router.register(r'reminders', ReminderViewSet)
+router.register(r'moods', MoodTrendViewSet, basename='mood')
+router.register(r'topics', TopicTrendViewSet, basename='topic')
 
 urlpatterns = [
       path('', include(router.urls)),   # API endpoints will start with /api/
+      path('patients/<int:patient_id>/chat/', chat, name='patient-chat'),
+      path('patients/<int:patient_id>/chat/stream/', chat_stream, name='patient-chat-stream'),   # Server-Sent Events, serve via ASGI
+      path('blobs/<str:sha256>/', blob, name='blob'),
+      path('blobs/<str:sha256>/<str:size>/', blob, name='blob-thumbnail'),
+      path('metrics/', metrics, name='metrics'),   # Prometheus
+      path('metrics/traces/', traces, name='metrics-traces'),
 ]
@@ -1,18 +1,483 @@
 #from django.shortcuts import render
+import json
+import time
+import codecs
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_date, parse_datetime
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods, require_safe
 from rest_framework import viewsets
-from .models import Memory, Patient, Caretaker
-from .serializers import MemorySerializer, PatientSerializer, CaretakerSerializer
+from rest_framework.decorators import action
+from rest_framework.exceptions import UnsupportedMediaType, ValidationError
+from rest_framework.response import Response
+
+from metrics import REGISTRY
+from tracing import TRACER
+
+from . import blobs
+from .bulk import IMPORT_TYPES, READERS, CSVRenderer, ImportFailed, NDJSONRenderer, export_memories, import_memories
+from .caching import CachedResponseMixin
+from .sessions import get_session_manager
+from .thumbnails import generate as generate_thumbnails, thumbnail
+from .models import ImageBlob, Memory, MemoryImage, Patient, Caretaker, Routine, Reminder
+from .moods import PERIODS, trends
+from .topic_trends import top as top_topics, top_per_patient as top_topics_per_patient
+from .pagination import CreatedAtCursorPagination, DueAtCursorPagination
+from .search import search_memories
+from .signals import locked_blob
+from .serializers import (
+    MemorySerializer, MemoryImageSerializer, MemorySearchResultSerializer, PatientSerializer, CaretakerSerializer,
+    RoutineSerializer, ReminderSerializer, requested_fields,
+)
+
+
+def _int_param(params, name):
+    try:
+        return int(params[name])
+    except ValueError:
+        raise ValidationError({name: "must be an integer"})
+
+
+def _datetime_param(params, name, end_of_day=False):
+    """A ``?name=`` date or datetime as an aware datetime; a bare date means its start (or the next day's)"""
+    value = params.get(name)
+    if not value:
+        return None
+    # parse_datetime reads a bare date as midnight, so try it as a date first;
+    # both raise ValueError on well-formed but impossible values like month 13
+    try:
+        day = parse_date(value)
+        moment = None if day else parse_datetime(value)
+    except ValueError:
+        day = moment = None
+    if day is not None:
+        moment = datetime.datetime.combine(day + datetime.timedelta(days=1 if end_of_day else 0), datetime.time())
+    elif moment is None:
+        raise ValidationError({name: "must be a date (2025-03-14) or datetime (2025-03-14T09:30:00)"})
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
 
-class MemoryViewSet(viewsets.ModelViewSet):
+def _patient_ids(params, limit):
+    """The patients in ``?patient=1,2,3`` and those of ``?caretaker=``, in that order"""
+    try:
+        patient_ids = [int(value) for value in params.get("patient", "").split(",") if value.strip()]
+    except ValueError:
+        raise ValidationError({"patient": "must be a comma-separated list of integers"})
+    if "caretaker" in params:
+        caretaker = get_object_or_404(Caretaker, pk=_int_param(params, "caretaker"))
+        patient_ids += caretaker.patients.order_by("id").values_list("id", flat=True)
+    patient_ids = list(dict.fromkeys(patient_ids))
+    if len(patient_ids) > limit:
+        raise ValidationError({"patient": f"at most {limit} patients at a time"})
+    return patient_ids
+
+
+def _date_range(params, days):
+    """``?start=`` and ``?end=`` dates, inclusive; by default the ``days`` up to today"""
+    dates = {}
+    for name in ("start", "end"):
+        if params.get(name):
+            try:
+                dates[name] = parse_date(params[name])
+            except ValueError:
+                dates[name] = None
+            if dates[name] is None:
+                raise ValidationError({name: "must be a date (2025-03-14)"})
+    end = dates.get("end", timezone.localdate())
+    start = dates.get("start", end - datetime.timedelta(days=days - 1))
+    if start > end:
+        raise ValidationError({"start": "must not be after end"})
+    return start, end
+
+
+def _only_requested(queryset, request, always=("id",)):
+    """Load only the columns the response will show when ``?fields=`` is given"""
+    fields = requested_fields(request)
+    if not fields:
+        return queryset
+    columns = {field.name for field in queryset.model._meta.concrete_fields}
+    return queryset.only(*((fields & columns) | set(always)))
+
+
+class MemoryViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    """
+    Memories, newest first and a page at a time.
+
+    Filters: ``?patient=<id>``, ``?created_after=`` and ``?created_before=``
+    (dates or datetimes; a date in ``created_before`` includes that whole
+    day). ``?fields=id,title,created_at`` leaves out everything else,
+    including the description column in the database query. Reads are
+    cached until a memory changes and answer conditional GETs with 304.
+    ``import/`` and ``export/`` move memories in bulk as NDJSON or CSV, and
+    ``<id>/images/`` attaches an image.
+    """
     queryset = Memory.objects.all()
     serializer_class = MemorySerializer
+    pagination_class = CreatedAtCursorPagination
+    cache_dependencies = ("lumora_api.memory", "lumora_api.memoryimage")
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        params = self.request.query_params
+        if "patient" in params:
+            queryset = queryset.filter(patient_id=_int_param(params, "patient"))
+        created_after = _datetime_param(params, "created_after")
+        if created_after:
+            queryset = queryset.filter(created_at__gte=created_after)
+        created_before = _datetime_param(params, "created_before", end_of_day=True)
+        if created_before:
+            queryset = queryset.filter(created_at__lt=created_before)
+        if _wants(self.request, "images"):
+            queryset = queryset.prefetch_related("images")
+        # the cursor is built from created_at and id
+        return _only_requested(queryset, self.request, always=("id", "created_at"))
 
-class PatientViewSet(viewsets.ModelViewSet):
+    @action(detail=False)
+    def search(self, request):
+        """
+        ``?q=`` ranked against titles and descriptions through the full-text
+        index, best first, with a highlighted snippet; ``?patient=`` and
+        ``?limit=`` (at most 100) narrow it down
+        """
+        return self.cached_response(request, self._search)
+
+    def _search(self, request):
+        params = request.query_params
+        text = params.get("q", "").strip()
+        if not text:
+            raise ValidationError({"q": "is required"})
+        patient_id = _int_param(params, "patient") if "patient" in params else None
+        limit = _int_param(params, "limit") if "limit" in params else 20
+        if limit < 1:
+            raise ValidationError({"limit": "must be at least 1"})
+        limit = min(limit, 100)
+        results = search_memories(text, patient_id=patient_id, limit=limit)
+        return Response({"results": MemorySearchResultSerializer(results, many=True).data})
+
+    @action(detail=False, methods=["post"], url_path="import")
+    def bulk_import(self, request):
+        """
+        Create memories from an NDJSON (``application/x-ndjson``) or CSV
+        (``text/csv``, with a header) request body, read as it streams in.
+        ``?patient=`` is used for rows without a patient. Nothing is kept if
+        any row is invalid; the 400 lists the bad rows by line.
+        """
+        content_type = request.content_type.split(";")[0].strip()
+        fmt = IMPORT_TYPES.get(content_type)
+        if fmt is None:
+            raise UnsupportedMediaType(content_type)
+        params = request.query_params
+        patient_id = _int_param(params, "patient") if "patient" in params else None
+        # the underlying HttpRequest yields the body a line at a time
+        lines = codecs.iterdecode(request._request, "utf-8-sig")
+        try:
+            imported = import_memories(READERS[fmt](lines), patient_id=patient_id)
+        except ImportFailed as failed:
+            # a ValidationError would turn the line numbers into strings
+            return Response({"errors": failed.errors}, status=400)
+        return Response({"imported": imported}, status=201)
+
+    @action(detail=True, methods=["post"], url_path="images")
+    def add_image(self, request, pk=None):
+        """
+        Attach an image sent as the request body (``Content-Type: image/jpeg``
+        and so on) or as a multipart ``image`` file. It is written to the blob
+        store as it arrives, kept once however often it is uploaded, and its
+        thumbnails are made in the background.
+        """
+        memory = self.get_object()
+        if request.content_type.startswith("multipart/"):
+            upload = request.FILES.get("image")
+            if upload is None:
+                raise ValidationError({"image": "is required"})
+            chunks = upload.chunks(blobs.CHUNK_SIZE)
+        else:
+            chunks = iter(lambda: request._request.read(blobs.CHUNK_SIZE), b"")
+        try:
+            sha256, size, content_type, tmp = blobs.receive(chunks, settings.LUMORA_MAX_IMAGE_SIZE)
+        except blobs.BlobTooLarge as error:
+            return Response({"detail": str(error)}, status=413)
+        except blobs.UnsupportedImage as error:
+            raise UnsupportedMediaType(request.content_type, detail=str(error))
+
+        try:
+            with transaction.atomic():
+                # placed and attached under the blob's row lock, so collecting
+                # the same bytes (see signals.py) can't remove the file meanwhile
+                blob = locked_blob(sha256, content_type, size)
+                blobs.place(sha256, tmp)
+                image = MemoryImage.objects.create(memory=memory, blob=blob)
+        finally:
+            blobs.discard(tmp)
+        transaction.on_commit(lambda: generate_thumbnails(sha256))
+        return Response(MemoryImageSerializer(image, context=self.get_serializer_context()).data, status=201)
+
+    @action(detail=True, methods=["delete"], url_path=r"images/(?P<image_id>\d+)")
+    def remove_image(self, request, pk=None, image_id=None):
+        get_object_or_404(MemoryImage, memory_id=pk, pk=image_id).delete()
+        return Response(status=204)
+
+    @action(detail=False, renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request):
+        """
+        Every memory matching the list filters, streamed as NDJSON or, with
+        ``Accept: text/csv`` or ``?format=csv``, as CSV
+        """
+        fmt = request.accepted_renderer.format
+        response = StreamingHttpResponse(export_memories(self.get_queryset(), fmt),
+                                         content_type=request.accepted_renderer.media_type)
+        response["Content-Disposition"] = f'attachment; filename="memories.{fmt}"'
+        return response
+
+def _wants(request, field):
+    fields = requested_fields(request)
+    return fields is None or field in fields
+
+
+def _patient_memories():
+    return Prefetch("memories", queryset=Memory.objects.order_by("-created_at", "-id").prefetch_related("images"))
+
+
+class PatientViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    """Patients with their memories and images: three queries per page, however many rows"""
     queryset = Patient.objects.all()
     serializer_class = PatientSerializer
+    cache_dependencies = ("lumora_api.patient", "lumora_api.memory", "lumora_api.memoryimage")
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if _wants(self.request, "memories"):
+            queryset = queryset.prefetch_related(_patient_memories())
+        return _only_requested(queryset, self.request)
 
-class CaretakerViewSet(viewsets.ModelViewSet):
+class CaretakerViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    """Caretakers with their patients and the patients' memories and images: four queries per page"""
     queryset = Caretaker.objects.all()
     serializer_class = CaretakerSerializer
+    cache_dependencies = ("lumora_api.caretaker", "lumora_api.patient", "lumora_api.memory", "lumora_api.memoryimage")
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if _wants(self.request, "patients"):
+            patients = Patient.objects.order_by("id").prefetch_related(_patient_memories())
+            queryset = queryset.prefetch_related(Prefetch("patients", queryset=patients))
+        return _only_requested(queryset, self.request)
+
+
+class RoutineViewSet(viewsets.ModelViewSet):
+    """
+    A patient's medication, meal and task routines (``?patient=``); the
+    scheduler (``manage.py run_scheduler``) picks up changes within a second
+    """
+    queryset = Routine.objects.order_by("id")
+    serializer_class = RoutineSerializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if "patient" in self.request.query_params:
+            queryset = queryset.filter(patient_id=_int_param(self.request.query_params, "patient"))
+        return queryset
+
+class ReminderViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Reminders the scheduler has fired, newest first; filter by ``?patient=``,
+    ``?status=`` (fired, done or missed) and ``?due_after=``
+    """
+    queryset = Reminder.objects.select_related("routine")
+    serializer_class = ReminderSerializer
+    pagination_class = DueAtCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        params = self.request.query_params
+        if "patient" in params:
+            queryset = queryset.filter(patient_id=_int_param(params, "patient"))
+        if params.get("status"):
+            queryset = queryset.filter(status=params["status"])
+        due_after = _datetime_param(params, "due_after")
+        if due_after:
+            queryset = queryset.filter(due_at__gte=due_after)
+        return queryset
+
+    @action(detail=True, methods=["post"])
+    def done(self, request, pk=None):
+        """Mark the reminder done; a missed one can still be done late"""
+        reminder = self.get_object()
+        if reminder.status != "done":
+            reminder.status = "done"
+            reminder.completed_at = timezone.now()
+            reminder.save(update_fields=["status", "completed_at"])
+        return Response(self.get_serializer(reminder).data)
+
+
+class MoodTrendViewSet(CachedResponseMixin, viewsets.ViewSet):
+    """
+    Mood trends from the precomputed rollups, for the patients in
+    ``?patient=1,2,3`` and/or those of ``?caretaker=``: ``?period=`` day
+    (default), week or month, between ``?start=`` and ``?end=`` dates
+    (default: the past year)
+    """
+    cache_dependencies = ("lumora_api.moodrollup",)
+    max_patients = 500
+
+    def list(self, request):
+        return self.cached_response(request, self._trends)
+
+    def _trends(self, request):
+        params = request.query_params
+        period = params.get("period", "day")
+        if period not in PERIODS:
+            raise ValidationError({"period": f"must be one of {', '.join(PERIODS)}"})
+        patient_ids = _patient_ids(params, self.max_patients)
+        if not patient_ids:
+            raise ValidationError({"patient": "give ?patient= or ?caretaker="})
+        start, end = _date_range(params, days=366)
+        return Response({"start": start, "end": end, "results": trends(patient_ids, period, start, end)})
+
+class TopicTrendViewSet(CachedResponseMixin, viewsets.ViewSet):
+    """
+    The ``?k=`` (default 10) most discussed topics between ``?start=`` and
+    ``?end=`` (default: the past week): across every patient, or across
+    those in ``?patient=1,2,3`` and/or ``?caretaker=`` along with each
+    one's own top topics
+    """
+    cache_dependencies = ("lumora_api.topicbucket", "lumora_api.topictotal")
+    max_patients = 500
+
+    def list(self, request):
+        return self.cached_response(request, self._topics)
+
+    def _topics(self, request):
+        params = request.query_params
+        k = _int_param(params, "k") if "k" in params else 10
+        if not 1 <= k <= 100:
+            raise ValidationError({"k": "must be between 1 and 100"})
+        patient_ids = _patient_ids(params, self.max_patients)
+        start, end = _date_range(params, days=7)
+
+        as_list = lambda ranked: [{"topic": topic, "count": count} for topic, count in ranked]
+        if not patient_ids:
+            return Response({"start": start, "end": end, "topics": as_list(top_topics(start, end, k))})
+        return Response({
+            "start": start,
+            "end": end,
+            "topics": as_list(top_topics(start, end, k, patient_ids)),
+            "patients": [
+                {"patient": patient_id, "topics": as_list(ranked)}
+                for patient_id, ranked in top_topics_per_patient(patient_ids, start, end, k).items()
+            ],
+        })
+
+
+def _metrics_allowed(request):
+    token = settings.LUMORA_METRICS_TOKEN
+    return not token or constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}")
+
+
+@require_safe
+def metrics(request):
+    """
+    This worker process's metrics in the Prometheus text format: chat turn
+    and request latency, model tokens and payload sizes, database queries
+    per request, live sessions. Each worker keeps its own, so scrape every one.
+    """
+    if not _metrics_allowed(request):
+        return HttpResponse(status=401)
+    return HttpResponse(REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@require_safe
+def traces(request):
+    """The latest sampled traces of this worker process, newest first"""
+    if not _metrics_allowed(request):
+        return HttpResponse(status=401)
+    return JsonResponse({"sample_rate": TRACER.sample_rate,
+                         "traces": [trace.summary() for trace in reversed(TRACER.recent)]})
+
+
+@require_safe
+def blob(request, sha256, size=None):
+    """
+    An attached image, or its ``size`` thumbnail (see LUMORA_THUMBNAIL_SIZES).
+    Without Pillow there are no thumbnails and the original is sent instead.
+    """
+    if not blobs.SHA256.match(sha256) or (size is not None and size not in settings.LUMORA_THUMBNAIL_SIZES):
+        raise Http404("No such image")
+    if size is not None:
+        path = thumbnail(sha256, size)
+        if path is not None:
+            return blobs.serve(request, path, "image/jpeg")
+    content_type = get_object_or_404(ImageBlob.objects.only("content_type"), pk=sha256).content_type
+    return blobs.serve(request, blobs.blob_path(sha256), content_type)
+
+
+def _sse(event, data):
+    """One Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _chat_message(request):
+    if request.method == "GET":
+        return request.GET.get("message", "")
+    try:
+        return json.loads(request.body or b"{}").get("message", "")
+    except (json.JSONDecodeError, AttributeError):
+        return ""
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def chat(request, patient_id):
+    """Send the patient's ``message`` to Lumora and return the complete reply"""
+    message = _chat_message(request).strip()
+    if not message:
+        return JsonResponse({"error": "message is required"}, status=400)
+    if not await Patient.objects.filter(pk=patient_id).aexists():
+        return JsonResponse({"error": "patient not found"}, status=404)
+
+    started = time.perf_counter()
+    assistant = await get_session_manager().get(patient_id)
+    reply = await assistant.send_message(message)
+    return JsonResponse({"reply": reply, "total_ms": round(1000 * (time.perf_counter() - started))})
+
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+async def chat_stream(request, patient_id):
+    """Stream Lumora's reply to the patient's ``message`` as Server-Sent Events"""
+    message = _chat_message(request).strip()
+    if not message:
+        return JsonResponse({"error": "message is required"}, status=400)
+    if not await Patient.objects.filter(pk=patient_id).aexists():
+        return JsonResponse({"error": "patient not found"}, status=404)
+
+    async def events():
+        started = time.perf_counter()
+        first_token = None
+        assistant = await get_session_manager().get(patient_id)
+        async for chunk in assistant.send_message_stream(message):
+            if first_token is None:
+                first_token = time.perf_counter() - started
+            yield _sse("chunk", {"text": chunk})
+
+        total = time.perf_counter() - started
+        yield _sse("done", {
+            "first_token_ms": round(1000 * (first_token if first_token is not None else total)),
+            "total_ms": round(1000 * total),
+        })
 
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
 
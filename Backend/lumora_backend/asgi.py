@@ -3,6 +3,9 @@ ASGI config for lumora_backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Streaming endpoints such as patients/<id>/chat/stream/ only stream under an ASGI server,
+e.g. ``uvicorn lumora_backend.asgi:application``.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
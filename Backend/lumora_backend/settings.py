@@ -10,11 +10,16 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# The assistant modules in AI/ import each other by plain module name (they
+# also run as the CLI from that directory), so put it on the import path.
+sys.path.append(str(BASE_DIR / 'AI'))
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
@@ -44,6 +49,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so its latency covers the other middleware too
+    'lumora_api.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -129,7 +136,55 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',  # Use JSON as the default renderer
-    ]
+    ],
+    # list endpoints return pages with next/previous cursors instead of every row
+    'DEFAULT_PAGINATION_CLASS': 'lumora_api.pagination.IdCursorPagination',
+    'PAGE_SIZE': 50,
 }
 
 AUTH_USER_MODEL = 'users.User'
+
+# The local-memory cache is per worker process: with several workers, point
+# 'default' at a shared cache so a write through one worker invalidates the
+# API responses cached by the others, e.g.
+#   'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+#   'LOCATION': 'redis://127.0.0.1:6379',
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'lumora',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+}
+
+# Lumora assistant
+# Where patient memory lives: 'database' (the lumora_api tables) or 'json'
+# (one journaled file per patient in LUMORA_MEMORY_DIR)
+LUMORA_MEMORY_STORE = 'database'
+LUMORA_MEMORY_DIR = BASE_DIR / 'AI' / 'patients'
+# Live patient sessions kept per worker, and seconds before an idle one is flushed and dropped
+LUMORA_MAX_SESSIONS = 200
+LUMORA_SESSION_IDLE_TIMEOUT = 30 * 60
+# Cap on concurrent outbound model requests per worker process (None = no cap)
+LUMORA_MAX_CONCURRENT_MODEL_CALLS = None
+# Cache alias for API responses and their ETags (None turns caching off), and
+# seconds a cached response is kept at most
+LUMORA_API_CACHE = 'default'
+LUMORA_API_CACHE_TIMEOUT = 10 * 60
+# Images attached to memories: stored once per content hash under
+# LUMORA_BLOB_ROOT, with JPEG thumbnails (bounding boxes in pixels) made by a
+# pool of LUMORA_THUMBNAIL_WORKERS processes (None = one per CPU; needs Pillow)
+LUMORA_BLOB_ROOT = BASE_DIR / 'media' / 'blobs'
+LUMORA_MAX_IMAGE_SIZE = 25 * 1024 * 1024
+LUMORA_THUMBNAIL_SIZES = {'small': 160, 'medium': 640}
+LUMORA_THUMBNAIL_WORKERS = 2
+# Share of chat turns, extraction batches and requests traced span by span
+# (requests with their database queries); latency histograms at /metrics cover
+# all of them whatever the rate. Sampled traces slower than
+# LUMORA_TRACE_SLOW_SECONDS are printed (None = never).
+LUMORA_TRACE_SAMPLE_RATE = 0.1
+LUMORA_TRACE_SLOW_SECONDS = None
+# /metrics asks for "Authorization: Bearer <token>" when this is set
+LUMORA_METRICS_TOKEN = None
+# multipart uploads are spooled to a temporary file, never held in memory
+FILE_UPLOAD_HANDLERS = ['django.core.files.uploadhandler.TemporaryFileUploadHandler']